@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+#
+# Intel AMT command line actions
+#
+# Copyright (C) 2018  Juerg Haefliger <juergh@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Kept apart from the drivers, so that the command line can list the actions
+# without loading them.
+
+# Actions of amt-cli, see fleet.run_action
+ACTIONS = ("power-state", "power-on", "power-off", "power-cycle", "reset",
+           "nmi")
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+#
+# Intel AMT agent, keeps warm AMT clients for short-lived callers
+#
+# Copyright (C) 2018  Juerg Haefliger <juergh@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# The agent listens on a Unix socket that only its owner can access. The
+# protocol is one JSON object per line in both directions:
+#
+#   -> {"op": "get_power_state", "host": ..., "username": ...,
+#       "password": ...}
+#   <- {"result": 2}
+#
+#   -> {"op": "set_power_state", ..., "state": 8, "wait": false,
+#       "timeout": null}
+#   <- {"result": 0}
+#
+# Failed requests are answered with {"error": "<message>"}.
+
+import json
+import logging
+import os
+import socket
+import socketserver
+import stat
+import struct
+import tempfile
+import threading
+import time
+
+from amt import metrics, power
+
+_requests = metrics.counter("amt_agent_requests_total",
+                            "Agent requests by operation and result")
+
+
+def socket_path():
+    """
+    Return the path of the agent socket
+    """
+    path = os.getenv("AMT_AGENT_SOCKET")
+    if path:
+        return path
+    rundir = os.getenv("XDG_RUNTIME_DIR")
+    if rundir:
+        return os.path.join(rundir, "amt-agent.sock")
+    return os.path.join(_fallback_dir(), "agent.sock")
+
+
+def _fallback_dir():
+    return os.path.join(tempfile.gettempdir(), "amt-agent-%d" % os.getuid())
+
+
+def _private_dir(path):
+    """
+    Create a directory that only the caller can access or check that an
+    existing one is such a directory
+    """
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or \
+       st.st_mode & 0o077:
+        raise PermissionError("%s is not a private directory" % path)
+
+
+class _Host():
+    """
+    A warm AMT client and the cached power state of a single host
+    """
+    def __init__(self, host, username, password):
+        self.password = password
+        self.power = power.AMTPower(host, username, password)
+        self.state = None
+        self.stamp = 0
+        self.lock = threading.Lock()
+
+
+class Agent():
+    """
+    Keeps warm AMT clients (and with them the WS-Man sessions and the
+    wake-up state) and caches power states for ttl seconds. All requests go
+    through a scheduler, so that the hosts aren't swamped.
+    """
+    def __init__(self, ttl=5.0):
+        # Only the agent needs the scheduler, not the clients
+        from amt import scheduler   # pylint: disable=import-outside-toplevel
+
+        self.ttl = ttl
+        self.scheduler = scheduler.Scheduler()
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host(self, host, username, password):
+        key = (host, username)
+        with self._lock:
+            entry = self._hosts.get(key)
+            if entry is None or entry.password != password:
+                entry = _Host(host, username, password)
+                self._hosts[key] = entry
+        return entry
+
+    def get_power_state(self, host, username, password):
+        entry = self._host(host, username, password)
+
+        # Concurrent queries of the same host wait for the first one and
+        # then use its result
+        with entry.lock:
+            if entry.state is not None and \
+               time.monotonic() - entry.stamp <= self.ttl:
+                _requests.inc(op="get_power_state", result="cached")
+                return entry.state
+
+            state = self.scheduler.get_power_state(entry.power).result()
+            if state in power.POWER_STATES:
+                entry.state = state
+                entry.stamp = time.monotonic()
+            _requests.inc(op="get_power_state", result="queried")
+            return state
+
+    def set_power_state(self, host, username, password, state, wait=False,
+                        timeout=None):
+        entry = self._host(host, username, password)
+        with entry.lock:
+            entry.state = None
+        _requests.inc(op="set_power_state", result="queried")
+        retval = self.scheduler.set_power_state(entry.power, state).result()
+        if retval == 0 and wait:
+            retval = entry.power.watch_power_state(state,
+                                                   timeout=timeout).result()
+        # Drop whatever was cached while the request was in flight
+        with entry.lock:
+            entry.state = None
+        return retval
+
+    def handle(self, request):
+        """
+        Handle a single request, return the response
+        """
+        op = request.get("op")
+        args = (request["host"], request["username"], request["password"])
+        if op == "get_power_state":
+            return {"result": self.get_power_state(*args)}
+        if op == "set_power_state":
+            return {"result": self.set_power_state(
+                *args, request["state"], wait=request.get("wait", False),
+                timeout=request.get("timeout"))}
+        raise ValueError("Invalid operation: %s" % op)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.agent.handle(json.loads(line))
+            except Exception as e:   # pylint: disable=broad-except
+                logging.error("Request failed: %s", e)
+                response = {"error": str(e)}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class Server(socketserver.ThreadingUnixStreamServer):
+    """
+    Serve an agent on a Unix socket
+    """
+    daemon_threads = True
+
+    def __init__(self, agent, path=None):
+        self.agent = agent
+        self.path = path or socket_path()
+
+        # Anybody can create files in the temp directory, so keep the socket
+        # in a directory that only we can access
+        if os.path.dirname(self.path) == _fallback_dir():
+            _private_dir(_fallback_dir())
+
+        if os.path.exists(self.path):
+            if _listening(self.path):
+                raise RuntimeError("Agent already running on %s" % self.path)
+            os.unlink(self.path)
+
+        # Keep the socket (and with it the passwords in the requests) private
+        umask = os.umask(0o177)
+        try:
+            super(Server, self).__init__(self.path, _Handler)
+        finally:
+            os.umask(umask)
+
+    def server_close(self):
+        super(Server, self).server_close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def _listening(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        return False
+    finally:
+        sock.close()
+    return True
+
+
+class AgentPower():
+    """
+    Intel AMT power driver that goes through a running agent
+
+    Same interface as AMTPower. Raises OSError if no agent is listening.
+    The agent runs all requests through its own scheduler.
+    """
+    scheduled = True
+
+    def __init__(self, host, username, password, path=None):
+        self.POWER_STATE_ON = power.POWER_STATE_ON
+        self.POWER_STATE_CYCLE = power.POWER_STATE_CYCLE
+        self.POWER_STATE_OFF = power.POWER_STATE_OFF
+        self.POWER_STATE_RESET = power.POWER_STATE_RESET
+        self.POWER_STATE_NMI = power.POWER_STATE_NMI
+        self.POWER_STATE_INVALID = power.POWER_STATE_INVALID
+        self.POWER_STATES = power.POWER_STATES
+
+        self.host = host
+        self.username = username
+        self.password = password
+        self.path = path or socket_path()
+
+        self._sock = None
+        self._rfile = None
+        self._lock = threading.Lock()
+        self._connect()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+            # The requests carry the password, so make sure it's our agent
+            # at the other end before sending anything
+            uid = self._peer_uid(sock)
+            if uid != os.getuid():
+                raise PermissionError("Agent on %s runs as uid %d" %
+                                      (self.path, uid))
+        except OSError:
+            sock.close()
+            raise
+        self._sock = sock
+        self._rfile = sock.makefile("rb")
+
+    def _peer_uid(self, sock):
+        if hasattr(socket, "SO_PEERCRED"):
+            creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                                    struct.calcsize("3i"))
+            _pid, uid, _gid = struct.unpack("3i", creds)
+            return uid
+        return os.stat(self.path).st_uid
+
+    def _stale(self):
+        """
+        Check if the agent closed the connection (or went away) since the
+        last request
+        """
+        try:
+            return self._sock.recv(1, socket.MSG_PEEK |
+                                   socket.MSG_DONTWAIT) == b""
+        except BlockingIOError:
+            return False
+        except OSError:
+            return True
+
+    def _close(self):
+        if self._sock is not None:
+            self._rfile.close()
+            self._sock.close()
+            self._sock = None
+            self._rfile = None
+
+    def _request(self, op, **kwargs):
+        request = dict(kwargs, op=op, host=self.host, username=self.username,
+                       password=self.password)
+        data = json.dumps(request).encode() + b"\n"
+
+        with self._lock:
+            # Reconnect if the agent went away (or was restarted). This is
+            # only safe as long as the request hasn't been sent, the agent
+            # might have acted on it otherwise.
+            if self._sock is not None and self._stale():
+                self._close()
+            for retry in (False, True):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    self._sock.sendall(data)
+                    break
+                except PermissionError as e:
+                    self._close()
+                    logging.error("Agent request failed: %s", e)
+                    return -1
+                except OSError as e:
+                    self._close()
+                    if retry:
+                        logging.error("Agent request failed: %s", e)
+                        return -1
+
+            try:
+                line = self._rfile.readline()
+                if not line:
+                    raise ConnectionResetError("Connection closed by agent")
+            except OSError as e:
+                # Don't resend the request, the agent may have acted on it
+                self._close()
+                logging.error("Agent request failed: %s", e)
+                return -1
+
+        response = json.loads(line)
+        if "error" in response:
+            logging.error("Agent request failed: %s", response["error"])
+            return -1
+        return response["result"]
+
+    def get_power_state(self):
+        """
+        Get the power state from the host
+        """
+        return self._request("get_power_state")
+
+    def set_power_state(self, state, wait=False, timeout=None):
+        """
+        Set the power state of the host and optionally wait for the
+        transition to complete
+        """
+        if state not in power.POWER_STATES:
+            logging.error("Invalid power state: %s", state)
+            return -1
+        return self._request("set_power_state", state=state, wait=wait,
+                             timeout=timeout)
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+def get_power(host, username, password, path=None):
+    """
+    Return an AgentPower if an agent is running, an AMTPower otherwise
+    """
+    try:
+        amt = AgentPower(host, username, password, path)
+    except PermissionError as e:
+        logging.warning("Not using the AMT agent: %s", e)
+        return power.AMTPower(host, username, password)
+    except OSError:
+        return power.AMTPower(host, username, password)
+    logging.debug("Using the AMT agent on %s", amt.path)
+    return amt
@@ -0,0 +1,632 @@
+#!/usr/bin/env python3
+#
+# asyncio Intel AMT power driver
+#
+# Copyright (C) 2018  Juerg Haefliger <juergh@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Speaks WS-Man SOAP over HTTP with digest authentication directly, so that
+# a single event loop can keep many AMT requests in flight without the
+# pywsman C bindings and without one thread per request. The synchronous
+# AMTPower driver runs its requests on a shared background event loop.
+
+import asyncio
+import functools
+import hashlib
+import logging
+import os
+import re
+import ssl
+import threading
+import time
+import uuid
+from xml.etree import ElementTree
+
+from amt import metrics, power, transition, utils, wakeup, wsman
+
+_SOAP = "http://www.w3.org/2003/05/soap-envelope"
+_ADDRESSING = "http://schemas.xmlsoap.org/ws/2004/08/addressing"
+_WSMAN = "http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd"
+_TRANSFER_GET = "http://schemas.xmlsoap.org/ws/2004/09/transfer/Get"
+_ANONYMOUS = _ADDRESSING + "/role/anonymous"
+
+_requests = metrics.counter("amt_wsman_requests_total",
+                            "WS-Man requests by method and result")
+_sessions = metrics.counter("amt_wsman_sessions_total",
+                            "New WS-Man sessions (digest handshakes)")
+_roundtrip = metrics.histogram("amt_wsman_roundtrip_seconds",
+                               "WS-Man request round trip time")
+_parse = metrics.histogram("amt_wsman_parse_seconds",
+                           "WS-Man response parse time")
+_wakeup = metrics.histogram("amt_wsman_wakeup_seconds",
+                            "Time to wake up the target")
+_get_latency = metrics.histogram("amt_power_get_seconds",
+                                 "Power state query latency")
+_set_latency = metrics.histogram("amt_power_set_seconds",
+                                 "Power state change request latency")
+_transition_latency = metrics.histogram(
+    "amt_power_transition_seconds",
+    "Time spent waiting for power state transitions")
+
+_CHALLENGE_RE = re.compile(r'(\w+)=("([^"]*)"|[^,\s]*)')
+
+# Cache of warm clients for the synchronous driver, indexed by (protocol,
+# host, port, username)
+_clients = {}
+_clients_lock = threading.Lock()
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _md5(*args):
+    return hashlib.md5(":".join(args).encode()).hexdigest()
+
+
+class _DigestAuth():
+    """
+    HTTP digest authentication state (RFC 2617), the server nonce is cached
+    and reused for subsequent requests
+    """
+    def __init__(self, username, password, challenge):
+        params = {}
+        for match in _CHALLENGE_RE.finditer(challenge.split(" ", 1)[1]):
+            params[match.group(1).lower()] = match.group(3) \
+                if match.group(3) is not None else match.group(2)
+
+        self.username = username
+        self.realm = params.get("realm", "")
+        self.nonce = params.get("nonce", "")
+        self.opaque = params.get("opaque")
+        self.qop = "auth" if "auth" in params.get("qop", "").split(",") \
+            else None
+        self.stale = params.get("stale", "").lower() == "true"
+        self.nc = 0
+        self._ha1 = _md5(username, self.realm, password)
+
+    def header(self, method, uri):
+        ha2 = _md5(method, uri)
+        value = 'Digest username="%s", realm="%s", nonce="%s", uri="%s"' % \
+                (self.username, self.realm, self.nonce, uri)
+        if self.qop:
+            self.nc += 1
+            nc = "%08x" % self.nc
+            cnonce = os.urandom(8).hex()
+            response = _md5(self._ha1, self.nonce, nc, cnonce, self.qop, ha2)
+            value += ', qop=%s, nc=%s, cnonce="%s"' % (self.qop, nc, cnonce)
+        else:
+            response = _md5(self._ha1, self.nonce, ha2)
+        value += ', response="%s"' % response
+        if self.opaque is not None:
+            value += ', opaque="%s"' % self.opaque
+        return value
+
+
+class _Connection():
+    """
+    A keep-alive HTTP/1.1 connection
+    """
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.keep_alive = True
+        # Taken from the idle pool rather than freshly opened
+        self.reused = False
+        # The server started to answer the current request
+        self.answered = False
+
+    async def request(self, method, path, headers, body):
+        self.answered = False
+        head = ["%s %s HTTP/1.1" % (method, path)]
+        head.extend("%s: %s" % item for item in headers.items())
+        head.append("Content-Length: %d" % len(body))
+        self.writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("connection closed by server")
+        self.answered = True
+        status = int(status_line.split()[1])
+
+        resp_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            key, _sep, val = line.decode("latin-1").partition(":")
+            resp_headers[key.strip().lower()] = val.strip()
+
+        if resp_headers.get("connection", "").lower() == "close":
+            self.keep_alive = False
+        return status, resp_headers, await self._read_body(resp_headers)
+
+    async def _read_body(self, headers):
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    # Skip the trailers
+                    while (await self.reader.readline()) not in \
+                          (b"\r\n", b"\n", b""):
+                        pass
+                    break
+                chunks.append(await self.reader.readexactly(size))
+                await self.reader.readexactly(2)
+            return b"".join(chunks)
+
+        if "content-length" in headers:
+            return await self.reader.readexactly(
+                int(headers["content-length"]))
+
+        self.keep_alive = False
+        return await self.reader.read()
+
+    def close(self):
+        self.writer.close()
+
+
+def _envelope(action, url, resource_uri, body=None, selectors=None):
+    """
+    Build a WS-Man SOAP envelope
+    """
+    env = ElementTree.Element("{%s}Envelope" % _SOAP)
+    header = ElementTree.SubElement(env, "{%s}Header" % _SOAP)
+
+    for ns, tag, text in ((_ADDRESSING, "Action", action),
+                          (_ADDRESSING, "To", url),
+                          (_WSMAN, "ResourceURI", resource_uri),
+                          (_ADDRESSING, "MessageID", "uuid:%s" % uuid.uuid4())):
+        elem = ElementTree.SubElement(header, "{%s}%s" % (ns, tag))
+        elem.text = text
+        elem.set("{%s}mustUnderstand" % _SOAP, "true")
+
+    reply_to = ElementTree.SubElement(header, "{%s}ReplyTo" % _ADDRESSING)
+    ElementTree.SubElement(reply_to, "{%s}Address" % _ADDRESSING).text = \
+        _ANONYMOUS
+
+    if selectors:
+        selector_set = ElementTree.SubElement(header,
+                                              "{%s}SelectorSet" % _WSMAN)
+        for name, val in selectors.items():
+            selector = ElementTree.SubElement(selector_set,
+                                              "{%s}Selector" % _WSMAN)
+            selector.set("Name", name)
+            selector.text = val
+
+    soap_body = ElementTree.SubElement(env, "{%s}Body" % _SOAP)
+    if body is not None:
+        soap_body.append(body)
+
+    return ElementTree.tostring(env, encoding="utf-8")
+
+
+def _request_power_state_change_input(state):
+    """
+    Generate the body element for requesting a power state change
+    """
+    namespace = power._CIM_PowerManagementService   # pylint: disable=protected-access
+
+    root = ElementTree.Element("{%s}RequestPowerStateChange_INPUT" %
+                               namespace)
+    ElementTree.SubElement(root, "{%s}PowerState" % namespace).text = \
+        str(state)
+
+    child = ElementTree.SubElement(root, "{%s}ManagedElement" % namespace)
+    ElementTree.SubElement(child, "{%s}Address" % _ADDRESSING).text = \
+        _ANONYMOUS
+
+    grand_child = ElementTree.SubElement(child, "{%s}ReferenceParameters" %
+                                         _ADDRESSING)
+    ElementTree.SubElement(grand_child, "{%s}ResourceURI" % _WSMAN).text = \
+        power._CIM_ComputerSystem   # pylint: disable=protected-access
+
+    g_grand_child = ElementTree.SubElement(grand_child, "{%s}SelectorSet" %
+                                           _WSMAN)
+    g_g_grand_child = ElementTree.SubElement(g_grand_child, "{%s}Selector" %
+                                             _WSMAN)
+    g_g_grand_child.set("Name", "Name")
+    g_g_grand_child.text = "ManagedSystem"
+
+    return root
+
+
+class AsyncWsManClient():
+    """
+    An asyncio WS-Man client to connect to a target server
+
+    Keeps up to max_connections keep-alive connections to the server and
+    reuses the cached digest authentication state (the session) across
+    requests. A session that has been idle for more than idle_timeout
+    seconds is dropped, i.e., its connections are closed and the next
+    request starts with a new digest handshake.
+    """
+    def __init__(self, host, username, password, wakeup_interval=60,
+                 idle_timeout=30, wakeup_timeout=1.0, wakeup_ports=None,
+                 max_connections=2, timeout=30, ssl_context=None):
+        protocol, host, port = wsman.parse_host(host)
+
+        self.protocol = protocol
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.url = "%s://%s:%s/wsman" % (protocol, host, port)
+        self.timeout = timeout
+
+        self.last_query = 0
+        self.last_wakeup = None
+        self.wakeup_interval = wakeup_interval
+        self.wakeup_timeout = wakeup_timeout
+        self.wakeup_ports = wakeup_ports or (port,)
+        self.idle_timeout = idle_timeout
+
+        # Session statistics
+        self.sessions = 0
+        self.requests = 0
+        self.reused = 0
+
+        if protocol == "https" and ssl_context is None:
+            # AMT uses self-signed certificates
+            ssl_context = ssl.create_default_context()
+            ssl_context.check_hostname = False
+            ssl_context.verify_mode = ssl.CERT_NONE
+        self._ssl = ssl_context
+
+        self._auth = None
+        self._idle = []
+        self._last_request = 0
+        self._slots = asyncio.Semaphore(max_connections)
+
+    def _session(self):
+        """
+        Account for a request, drop the current session if it has been idle
+        for too long
+        """
+        if self.session_active:
+            self.reused += 1
+            logging.debug("Reusing session to %s (%d/%d requests reused)",
+                          self.host, self.reused, self.requests + 1)
+        else:
+            logging.debug("Creating new session to %s", self.host)
+            self._drop()
+            self.sessions += 1
+
+        self.requests += 1
+        self._last_request = time.time()
+
+    def _drop(self):
+        """
+        Drop the current session: the idle connections and the cached
+        digest authentication state
+        """
+        while self._idle:
+            self._idle.pop().close()
+        self._auth = None
+
+    @property
+    def session_active(self):
+        """
+        True if the next request will reuse the current session
+        """
+        return self._auth is not None and \
+            time.time() - self._last_request <= self.idle_timeout
+
+    async def _open(self):
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port, ssl=self._ssl),
+                self.timeout)
+        except asyncio.TimeoutError:
+            raise ConnectionError("timed out connecting to %s:%s" %
+                                  (self.host, self.port)) from None
+        return _Connection(reader, writer)
+
+    async def _connect(self):
+        while self._idle:
+            conn = self._idle.pop()
+            # Skip connections that the server closed while they were idle
+            if conn.reader.at_eof() or conn.writer.is_closing():
+                conn.close()
+                continue
+            conn.reused = True
+            return conn
+        return await self._open()
+
+    async def _send(self, conn, data):
+        headers = {
+            "Host": "%s:%s" % (self.host, self.port),
+            "Content-Type": "application/soap+xml;charset=UTF-8",
+        }
+        if self._auth:
+            headers["Authorization"] = self._auth.header("POST", "/wsman")
+        return await asyncio.wait_for(
+            conn.request("POST", "/wsman", headers, data), self.timeout)
+
+    async def _post(self, data):
+        """
+        POST a SOAP envelope to the server and return the response body
+        """
+        async with self._slots:
+            self._session()
+            conn = await self._connect()
+            try:
+                for _attempt in range(2):
+                    try:
+                        status, resp_headers, body = await self._send(conn,
+                                                                      data)
+                    except (OSError, asyncio.IncompleteReadError) as e:
+                        # The server may close an idle keep-alive connection
+                        # just as it is reused. The request didn't get
+                        # anywhere if there's no answer at all, so retry it
+                        # once on a new connection.
+                        if isinstance(e, asyncio.TimeoutError) or \
+                           not conn.reused or conn.answered:
+                            raise
+                        logging.debug("Idle connection to %s closed by the "
+                                      "server, reconnecting", self.host)
+                        conn.close()
+                        conn = await self._open()
+                        status, resp_headers, body = await self._send(conn,
+                                                                      data)
+
+                    if status != 401:
+                        break
+
+                    challenge = resp_headers.get("www-authenticate", "")
+                    if not challenge.lower().startswith("digest"):
+                        break
+                    self._auth = _DigestAuth(self.username, self.password,
+                                             challenge)
+                    _sessions.inc()
+                    if not conn.keep_alive:
+                        conn.close()
+                        conn = await self._open()
+            except BaseException:
+                conn.close()
+                raise
+
+            if conn.keep_alive:
+                self._idle.append(conn)
+            else:
+                conn.close()
+
+        self.last_query = time.time()
+        return status, body
+
+    async def _request(self, name, data):
+        try:
+            with _roundtrip.time(method=name):
+                status, body = await self._post(data)
+        except (OSError, ValueError, asyncio.TimeoutError,
+                asyncio.IncompleteReadError) as e:
+            # Don't reuse a session that failed
+            self._drop()
+            _requests.inc(method=name, result="error")
+            return -1, "[%s] %s" % (name, str(e) or type(e).__name__), None
+
+        if status == 401 or not body:
+            _requests.inc(method=name, result="error")
+            if status == 401:
+                return -1, "[%s] authentication failed" % name, None
+            return -1, "[%s] empty response" % name, None
+        try:
+            with _parse.time(method=name):
+                resp = utils.XmlResponse(body)
+        except ElementTree.ParseError:
+            _requests.inc(method=name, result="error")
+            return -1, "[%s] invalid response (HTTP %s)" % (name, status), \
+                None
+        return 0, "", resp
+
+    async def get(self, resource_uri, selectors=None):
+        """
+        Get info from the target server
+        """
+        data = _envelope(_TRANSFER_GET, self.url, resource_uri,
+                         selectors=selectors)
+        errno, errstr, resp = await self._request("get", data)
+        if errno:
+            return errno, errstr, resp
+
+        fault = resp.find(_SOAP, "Fault")
+        if fault is not None:
+            reason = resp.findtext(_SOAP, "Text", fault.text)
+            _requests.inc(method="get", result="fault")
+            return -2, "[get] %s" % reason, resp
+        _requests.inc(method="get", result="ok")
+        return 0, "[get] success", resp
+
+    async def invoke(self, resource_uri, method, data=None, selectors=None):
+        """
+        Invoke a method on the target server
+        """
+        data = _envelope(resource_uri + "/" + method, self.url, resource_uri,
+                         body=data, selectors=selectors)
+        errno, errstr, resp = await self._request("invoke", data)
+        if errno:
+            return errno, errstr, resp
+
+        retval = resp.findtext(resource_uri, "ReturnValue")
+        if retval is None or not power.is_int(retval):
+            fault = resp.findtext(_SOAP, "Text", "no ReturnValue")
+            _requests.inc(method="invoke", result="fault")
+            return -1, "[invoke] %s" % fault, resp
+        retval = int(retval)
+        _requests.inc(method="invoke", result="ok" if retval == 0 else "fault")
+        if retval == 0:
+            return 0, "[invoke] success", resp
+        if retval == 2:
+            return -2, "[invoke] illegal request", resp
+        return -retval, "[invoke] error (%s)" % retval, resp
+
+    async def wake_up(self):
+        """
+        Wake up the target server, return the time it took to answer or None
+        if no wake-up was necessary
+        """
+        now = time.time()
+        if now - self.last_query <= self.wakeup_interval:
+            return None
+
+        # The probe blocks (in select) until the host answers, so run it in
+        # a worker thread rather than on the event loop
+        probe = functools.partial(wakeup.probe, [self.host],
+                                  ports=self.wakeup_ports,
+                                  timeout=self.wakeup_timeout)
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(None,
+                                                                      probe)
+            elapsed = result[self.host]
+        except OSError as e:
+            logging.debug("Failed to wake up %s: %s", self.host, e)
+            elapsed = None
+
+        if elapsed is None:
+            logging.debug("No wake-up response from %s after %.3fs",
+                          self.host, self.wakeup_timeout)
+            elapsed = self.wakeup_timeout
+        else:
+            logging.debug("Woke up %s in %.3fs", self.host, elapsed)
+        _wakeup.observe(elapsed)
+
+        self.last_wakeup = elapsed
+        self.last_query = time.time()
+        return elapsed
+
+    async def close(self):
+        """
+        Close all connections and drop the session
+        """
+        self._drop()
+
+
+class AsyncAMTPower():
+    """
+    asyncio Intel AMT power driver, see AMTPower
+    """
+    def __init__(self, host, username, password, client=None, **kwargs):
+        self.POWER_STATE_ON = power.POWER_STATE_ON
+        self.POWER_STATE_CYCLE = power.POWER_STATE_CYCLE
+        self.POWER_STATE_OFF = power.POWER_STATE_OFF
+        self.POWER_STATE_RESET = power.POWER_STATE_RESET
+        self.POWER_STATE_NMI = power.POWER_STATE_NMI
+        self.POWER_STATE_INVALID = power.POWER_STATE_INVALID
+        self.POWER_STATES = power.POWER_STATES
+
+        if client is None:
+            client = AsyncWsManClient(host, username, password, **kwargs)
+        self.client = client
+
+    async def get_power_state(self):
+        """
+        Get the power state from the host
+        """
+        with _get_latency.time():
+            return await self._get_power_state()
+
+    async def _get_power_state(self):
+        logging.debug("Getting power state")
+
+        await self.client.wake_up()
+
+        namespace = power._CIM_AssociatedPowerManagementService   # pylint: disable=protected-access
+        errno, errstr, resp = await self.client.get(namespace)
+        if errno:
+            logging.error("Failed to get power state: %s (%s)", errstr, errno)
+            return errno
+
+        state = resp.findtext(namespace, "PowerState")
+        if state is not None and power.is_int(state) and \
+           int(state) in power.POWER_STATES:
+            return int(state)
+
+        logging.warning("Invalid power state: %s", state)
+        return power.POWER_STATE_INVALID
+
+    async def request_power_state_change(self, state):
+        """
+        Invoke RequestPowerStateChange on the host
+        """
+        logging.debug("Setting power state to: %s", state)
+
+        await self.client.wake_up()
+
+        errno, errstr, _resp = await self.client.invoke(
+            power._CIM_PowerManagementService,   # pylint: disable=protected-access
+            "RequestPowerStateChange",
+            data=_request_power_state_change_input(state),
+            selectors={"Name": "Intel(r) AMT Power Management Service"})
+        if errno:
+            logging.error("Failed to set power state: %s (%s)", errstr, errno)
+        return errno
+
+    async def set_power_state(self, state, wait=False, timeout=None):
+        """
+        Set the power state of the host and optionally wait for the
+        transition to complete, see AMTPower.set_power_state
+        """
+        if state not in power.POWER_STATES:
+            logging.error("Invalid power state: %s", state)
+            return -1
+
+        state_name = power.power_string_from_state(state)
+        with _set_latency.time(state=state_name):
+            retval = await self.request_power_state_change(state)
+        profile = power._power_state_profiles.get(state)   # pylint: disable=protected-access
+        if retval or not wait or profile is None:
+            return retval
+
+        start = time.monotonic()
+        retval = await transition.wait_for(self.get_power_state, profile,
+                                           timeout=timeout)
+        _transition_latency.observe(time.monotonic() - start, state=state_name,
+                                    result="ok" if retval == 0 else "timeout")
+        return retval
+
+    async def close(self):
+        """
+        Close all connections to the host
+        """
+        await self.client.close()
+
+
+def get_client(host, username, password, **kwargs):
+    """
+    Return a (shared) warm client for the target server
+    """
+    protocol, hostname, port = wsman.parse_host(host)
+    key = (protocol, hostname, port, username)
+
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None or client.password != password:
+            client = AsyncWsManClient(host, username, password, **kwargs)
+            _clients[key] = client
+    return client
+
+
+def run(coro):
+    """
+    Run a coroutine on the shared background event loop and wait for its
+    result
+    """
+    global _loop   # pylint: disable=global-statement
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="amt-aio",
+                             daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coro, _loop).result()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+#
+# Intel AMT fleet operations
+#
+# Copyright (C) 2018  Juerg Haefliger <juergh@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import logging
+import time
+
+from amt import power, wakeup, wsman
+
+class Result():
+    """
+    The result of an action on a single host
+    """
+    def __init__(self, host, action, retval, elapsed, error=None):
+        self.host = host
+        self.action = action
+        self.retval = retval
+        self.elapsed = elapsed
+        self.error = error
+
+    @property
+    def ok(self):
+        if self.error:
+            return False
+        if self.action == "power-state":
+            return self.retval in power.POWER_STATES
+        return self.retval == 0
+
+    def __str__(self):
+        if self.error:
+            status = "error: %s" % self.error
+        elif self.action == "power-state":
+            status = power.power_string_from_state(self.retval)
+        else:
+            status = "ok" if self.ok else "failed (%s)" % self.retval
+        return "%s: %s %s (%.3fs)" % (self.host, self.action, status,
+                                      self.elapsed)
+
+
+def read_hosts(fobj):
+    """
+    Read a list of hosts from a file object, one host per line, ignoring
+    empty lines and comments
+    """
+    hosts = []
+    for line in fobj:
+        line = line.split("#", 1)[0].strip()
+        if line:
+            hosts.append(line)
+    return hosts
+
+
+def run_action(amt, action):
+    """
+    Run an amt-cli action on an AMTPower object
+    """
+    if action == "power-state":
+        return amt.get_power_state()
+
+    state = action
+    if state.startswith("power-"):
+        state = state[6:]
+    return amt.set_power_state(power.power_state_from_string(state))
+
+
+def _run(host, username, password, action, awake):
+    start = time.monotonic()
+    try:
+        amt = power.AMTPower(host, username, password)
+        if awake:
+            # The host answered the fleet wake-up probe already
+            amt.client.last_query = time.time()
+        retval = run_action(amt, action)
+    except Exception as e:   # pylint: disable=broad-except
+        return Result(host, action, None, time.monotonic() - start,
+                      error=str(e))
+    return Result(host, action, retval, time.monotonic() - start)
+
+
+def _wake_up(hosts):
+    """
+    Wake up all hosts at once (in batches of a bounded number of sockets),
+    return the set of hosts that answered
+    """
+    targets = {}
+    for host in hosts:
+        _protocol, hostname, port = wsman.parse_host(host)
+        targets.setdefault(port, []).append((hostname, host))
+
+    awake = set()
+    for port, names in targets.items():
+        try:
+            result = wakeup.probe([hostname for hostname, _host in names],
+                                  ports=(port,))
+        except OSError as e:
+            # Not fatal, the hosts are woken up individually then
+            logging.warning("Wake-up probe failed: %s", e)
+            continue
+        awake.update(host for hostname, host in names
+                     if result[hostname] is not None)
+    logging.debug("%d of %d hosts answered the wake-up probe", len(awake),
+                  len(hosts))
+    return awake
+
+
+def run(hosts, username, password, action, jobs=16):
+    """
+    Run an action concurrently on a list of hosts, with at most jobs hosts
+    in flight at any time, and yield the results as they complete
+    """
+    import concurrent.futures   # pylint: disable=import-outside-toplevel
+
+    awake = _wake_up(hosts)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(_run, host, username, password, action,
+                                   host in awake)
+                   for host in hosts]
+        for future in concurrent.futures.as_completed(futures):
+            yield future.result()
+
+
+def summary(results):
+    """
+    Summarize a list of results
+    """
+    elapsed = sorted(r.elapsed for r in results)
+    ok = sum(1 for r in results if r.ok)
+
+    def percentile(p):
+        if not elapsed:
+            return 0.0
+        return elapsed[min(len(elapsed) - 1, int(p * len(elapsed)))]
+
+    return {
+        "hosts": len(results),
+        "ok": ok,
+        "failed": len(results) - ok,
+        "min": elapsed[0] if elapsed else 0.0,
+        "avg": sum(elapsed) / len(elapsed) if elapsed else 0.0,
+        "p50": percentile(0.50),
+        "p95": percentile(0.95),
+        "max": elapsed[-1] if elapsed else 0.0,
+    }
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+#
+# Counters and latency histograms
+#
+# Copyright (C) 2018  Juerg Haefliger <juergh@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Metrics are disabled by default. While disabled, the instrumentation
+# points cost a single flag check.
+
+import bisect
+import sys
+import threading
+import time
+
+# Latency buckets in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+           2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+_enabled = False
+_metrics = {}
+_lock = threading.Lock()
+
+
+def enable(flag=True):
+    """
+    Enable (or disable) metrics collection
+    """
+    global _enabled   # pylint: disable=global-statement
+    _enabled = flag
+
+
+def enabled():
+    return _enabled
+
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class Counter():
+    """
+    A monotonically increasing counter
+    """
+    kind = "counter"
+
+    def __init__(self, name, doc):
+        self.name = name
+        self.doc = doc
+        self.values = {}
+
+    def inc(self, value=1, **labels):
+        if not _enabled:
+            return
+        key = _key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def samples(self):
+        with _lock:
+            return [(dict(key), value) for key, value in self.values.items()]
+
+
+class Histogram():
+    """
+    A latency histogram with cumulative buckets
+    """
+    kind = "histogram"
+
+    def __init__(self, name, doc, buckets=BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.buckets = tuple(buckets)
+        self.values = {}
+
+    def observe(self, value, **labels):
+        if not _enabled:
+            return
+        key = _key(labels)
+        with _lock:
+            counts, total, count = self.values.get(
+                key, ([0] * len(self.buckets), 0.0, 0))
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(counts):
+                counts[index] += 1
+            self.values[key] = (counts, total + value, count + 1)
+
+    def time(self, **labels):
+        """
+        Context manager that observes the time spent in its block
+        """
+        if not _enabled:
+            return _null_timer
+        return _Timer(self, labels)
+
+    def samples(self):
+        with _lock:
+            result = []
+            for key, (counts, total, count) in self.values.items():
+                cumulative = []
+                running = 0
+                for upper, n in zip(self.buckets, counts):
+                    running += n
+                    cumulative.append((upper, running))
+                result.append((dict(key), {"buckets": cumulative,
+                                           "sum": total, "count": count}))
+            return result
+
+
+class _Timer():
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *_exc):
+        self.histogram.observe(time.monotonic() - self.start, **self.labels)
+
+
+class _NullTimer():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc):
+        pass
+
+
+_null_timer = _NullTimer()
+
+
+def _register(cls, name, doc, *args):
+    with _lock:
+        metric = _metrics.get(name)
+        if metric is None:
+            metric = cls(name, doc, *args)
+            _metrics[name] = metric
+    return metric
+
+
+def counter(name, doc):
+    """
+    Return the counter with the given name, create it if necessary
+    """
+    return _register(Counter, name, doc)
+
+
+def histogram(name, doc, buckets=BUCKETS):
+    """
+    Return the histogram with the given name, create it if necessary
+    """
+    return _register(Histogram, name, doc, buckets)
+
+
+# -----------------------------------------------------------------------------
+# Export
+
+def to_dict():
+    """
+    Return all metrics as a dict
+    """
+    result = {}
+    for name, metric in sorted(_metrics.items()):
+        samples = [dict(value, labels=labels) if isinstance(value, dict)
+                   else {"labels": labels, "value": value}
+                   for labels, value in metric.samples()]
+        result[name] = {"type": metric.kind, "help": metric.doc,
+                        "samples": samples}
+    return result
+
+
+def to_json():
+    import json   # pylint: disable=import-outside-toplevel
+    return json.dumps(to_dict(), indent=2, sort_keys=True)
+
+
+def _labels(labels, extra=None):
+    items = sorted(labels.items())
+    if extra:
+        items.append(extra)
+    if not items:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (key, str(val).replace('"', '\\"'))
+                             for key, val in items)
+
+
+def to_prometheus():
+    """
+    Return all metrics in the Prometheus text exposition format
+    """
+    lines = []
+    for name, metric in sorted(_metrics.items()):
+        lines.append("# HELP %s %s" % (name, metric.doc))
+        lines.append("# TYPE %s %s" % (name, metric.kind))
+        for labels, value in metric.samples():
+            if metric.kind == "counter":
+                lines.append("%s%s %s" % (name, _labels(labels), value))
+                continue
+            for upper, count in value["buckets"]:
+                lines.append("%s_bucket%s %d" % (
+                    name, _labels(labels, ("le", repr(upper))), count))
+            lines.append("%s_bucket%s %d" % (
+                name, _labels(labels, ("le", "+Inf")), value["count"]))
+            lines.append("%s_sum%s %s" % (name, _labels(labels),
+                                          repr(value["sum"])))
+            lines.append("%s_count%s %d" % (name, _labels(labels),
+                                            value["count"]))
+    return "\n".join(lines) + "\n"
+
+
+def write(path, fmt="json"):
+    """
+    Write all metrics to a file ('-' for stdout) as JSON or Prometheus text
+    """
+    data = to_prometheus() if fmt == "prometheus" else to_json() + "\n"
+    if path == "-":
+        sys.stdout.write(data)
+        sys.stdout.flush()
+        return
+    with open(path, "w") as fh:
+        fh.write(data)
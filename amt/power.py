@@ -18,12 +18,9 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
-import logging
-import time
+import threading
 
-import pywsman
-
-from amt import utils, wsman
+from amt import transition
 
 
 # AMT power states
@@ -45,6 +42,19 @@ _power_state_map = {
     POWER_STATE_NMI: "nmi",
 }
 
+# Expected power state transitions: the state the host ends up in, how long
+# it typically takes and when to give up. A reset or an NMI leaves the host
+# powered on, i.e., the power state doesn't tell when they're done, so they
+# aren't waited for.
+_power_state_profiles = {
+    POWER_STATE_ON: transition.Profile(POWER_STATE_ON, 0, 30),
+    POWER_STATE_CYCLE: transition.Profile(POWER_STATE_ON, 2, 120),
+    POWER_STATE_OFF: transition.Profile(POWER_STATE_OFF, 0, 60),
+}
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
 _CIM_Schema = "http://schemas.dmtf.org/wbem/wscim/1/cim-schema/2/"
 _CIM_AssociatedPowerManagementService = _CIM_Schema + "CIM_AssociatedPowerManagementService"
 _CIM_PowerManagementService = _CIM_Schema + "CIM_PowerManagementService"
@@ -79,77 +89,6 @@ def is_int(val):
     return True
 
 
-def _request_power_state_change_input(state):
-    """
-    Generate a wsman xmldoc for requesting a power state change
-    """
-    method_input = "RequestPowerStateChange_INPUT"
-    address = "http://schemas.xmlsoap.org/ws/2004/08/addressing"
-    anonymous = address + "/role/anonymous"
-    wsman = "http://schemas.dmtf.org/wbem/wsman/1/wsman.xsd"
-    namespace = _CIM_PowerManagementService
-
-    doc = pywsman.XmlDoc(method_input)
-    root = doc.root()
-    root.set_ns(namespace)
-    root.add(namespace, "PowerState", str(state))
-
-    child = root.add(namespace, "ManagedElement", None)
-    child.add(address, "Address", anonymous)
-
-    grand_child = child.add(address, "ReferenceParameters", None)
-    grand_child.add(wsman, "ResourceURI", _CIM_ComputerSystem)
-
-    g_grand_child = grand_child.add(wsman, "SelectorSet", None)
-
-    g_g_grand_child = g_grand_child.add(wsman, "Selector", "ManagedSystem")
-    g_g_grand_child.attr_add(wsman, "Name", "Name")
-
-    return doc
-
-
-def _get_power_state(client):
-    """
-    Get the power state from the wsman client
-    """
-    logging.debug("Getting power state")
-
-    client.wake_up()
-
-    namespace = _CIM_AssociatedPowerManagementService
-    errno, errstr, doc = client.get(namespace)
-    if errno:
-        logging.error("Failed to get power state: %s (%s)", errstr, errno)
-        return errno
-
-    state = utils.xml_find(doc, namespace, "PowerState").text
-    if is_int(state) and int(state) in POWER_STATES:
-        return int(state)
-
-    logging.warning("Invalid power state: %s", state)
-    return POWER_STATE_INVALID
-
-
-def _set_power_state(client, state):
-    """
-    Set the power state of the wsman client
-    """
-    logging.debug("Setting power state to: %s", state)
-
-    client.wake_up()
-
-    options = pywsman.ClientOptions()
-    options.add_selector("Name", "Intel(r) AMT Power Management Service")
-
-    doc = _request_power_state_change_input(state)
-    errno, errstr, _retdoc = client.invoke(_CIM_PowerManagementService,
-                                           "RequestPowerStateChange", data=doc,
-                                           options=options)
-    if errno:
-        logging.error("Failed to set power state: %s (%s)", errstr, errno)
-    return errno
-
-
 class AMTPower():
     """
     Intel AMT power driver
@@ -163,6 +102,9 @@ class AMTPower():
       7: Hibernate (Off - Soft)     15: Power Cycle (Off - Soft Graceful)
       8: Power Off - Soft           16: Power Cycle (Off - Hard Graceful)
       9: Power Cycle (Off - Hard)
+
+    A synchronous front end to the asyncio driver, the requests of all
+    hosts run on a shared background event loop.
     """
     def __init__(self, host, username, password):
         self.POWER_STATE_ON = POWER_STATE_ON
@@ -173,32 +115,53 @@ class AMTPower():
         self.POWER_STATE_INVALID = POWER_STATE_INVALID
         self.POWER_STATES = POWER_STATES
 
-        self.client = wsman.WsManClient(host, username, password)
+        # The asyncio driver needs this module, import it when it's used
+        from amt import aiopower   # pylint: disable=import-outside-toplevel
+
+        self.host = host
+        self.client = aiopower.get_client(host, username, password)
+        self._run = aiopower.run
+        self._power = aiopower.AsyncAMTPower(host, username, password,
+                                             client=self.client)
 
     def get_power_state(self):
         """
         Get the power state from the host
         """
-        return _get_power_state(self.client)
+        return self._run(self._power.get_power_state())
+
+    def set_power_state(self, state, wait=False, timeout=None):
+        """
+        Set the power state of the host and optionally wait for the
+        transition to complete. The timeout defaults to the time after which
+        the transition's profile gives up. Resets and NMIs aren't waited
+        for.
+        """
+        return self._run(self._power.set_power_state(state, wait=wait,
+                                                     timeout=timeout))
 
-    def set_power_state(self, state, wait=False, timeout=10):
+    def watch_power_state(self, state, timeout=None, callback=None):
         """
-        Set the power state of the host
+        Wait for a (previously requested) power state transition in the
+        background. Returns a future that resolves to 0 on success or -1 on
+        timeout, the optional callback is called with the future when done.
+        Transitions of all hosts are watched by a single shared watcher.
+        Resets and NMIs aren't watched, their future is resolved right away.
         """
-        if state not in POWER_STATES:
-            logging.error("Invalid power state: %s", state)
-            return -1
-
-        retval = _set_power_state(self.client, state)
-        if retval or not wait:
-            return retval
-
-        now = time.time()
-        while time.time() < (now + timeout):
-            time.sleep(1)
-            current_state = _get_power_state(self.client)
-            if current_state == state:
-                return 0
-
-        logging.debug("Timed out waiting for requested power state")
-        return -1
+        global _watcher   # pylint: disable=global-statement
+
+        if state not in _power_state_profiles:
+            import concurrent.futures   # pylint: disable=import-outside-toplevel
+            future = concurrent.futures.Future()
+            future.set_result(0)
+            if callback:
+                future.add_done_callback(callback)
+            return future
+
+        with _watcher_lock:
+            if _watcher is None:
+                _watcher = transition.Watcher()
+
+        return _watcher.watch(self.get_power_state,
+                              _power_state_profiles[state], timeout=timeout,
+                              callback=callback)
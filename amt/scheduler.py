@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+#
+# Intel AMT request scheduler
+#
+# Copyright (C) 2018  Juerg Haefliger <juergh@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# AMT firmware only handles a few concurrent WS-Man sessions and rejects
+# power commands while it's busy, so all operations on an endpoint go
+# through a per-endpoint queue.
+
+import collections
+import concurrent.futures
+import logging
+import threading
+import time
+
+from amt import metrics, transition
+
+# Errors worth retrying a power state query for: no response (-1), a SOAP
+# fault or unspecified error (-2), timeout (-3) and busy (-6)
+RETRY_ERRORS = (-1, -2, -3, -6)
+
+# A power state change is only retried if the firmware rejected it because
+# it's busy (-6). After no response or a timeout, the firmware may well have
+# run the command already, and resetting or power cycling a host twice is
+# worse than reporting the error.
+SET_RETRY_ERRORS = (-6,)
+
+_ops = metrics.counter("amt_scheduler_ops_total",
+                       "Scheduled operations by operation and outcome")
+_queue_latency = metrics.histogram("amt_scheduler_queue_seconds",
+                                   "Time operations spend in the queue")
+
+_GET = "get"
+_SET = "set"
+
+
+class _Op():
+    def __init__(self, kind, amt, func, args):
+        self.kind = kind
+        self.amt = amt
+        self.func = func
+        self.args = args
+        self.queued = time.monotonic()
+        self.future = concurrent.futures.Future()
+
+
+class _Endpoint():
+    def __init__(self):
+        self.queue = collections.deque()
+        self.running = 0
+        self.exclusive = False
+
+
+class Scheduler():
+    """
+    Queue AMT operations per endpoint
+
+    Operations on an endpoint start in the order they're submitted, with at
+    most max_per_host of them in flight. Power state changes run on their
+    own, i.e., they wait for the operations ahead of them to finish and
+    hold back the ones behind them. A power state query is merged into a
+    query of the same client that is queued but not yet running. Queries
+    that fail with one of retry_errors and power state changes that fail
+    with one of set_retry_errors are retried up to retries times with
+    backoff.
+    """
+    def __init__(self, max_per_host=2, max_workers=16, retries=3,
+                 retry_errors=RETRY_ERRORS, set_retry_errors=SET_RETRY_ERRORS,
+                 backoff=None):
+        self.max_per_host = max_per_host
+        self.retries = retries
+        self.retry_errors = retry_errors
+        self.set_retry_errors = set_retry_errors
+        self.backoff = backoff or transition.Backoff(initial=0.5, factor=2,
+                                                     maximum=4)
+
+        self._endpoints = {}
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="amt-sched")
+
+    def _endpoint(self, amt):
+        endpoint = self._endpoints.get(amt.host)
+        if endpoint is None:
+            endpoint = _Endpoint()
+            self._endpoints[amt.host] = endpoint
+        return endpoint
+
+    def _dispatch(self, endpoint):
+        """
+        Start as many queued operations as the limits allow, called with
+        the lock held
+        """
+        while endpoint.queue and not endpoint.exclusive:
+            op = endpoint.queue[0]
+            if op.kind == _SET:
+                if endpoint.running:
+                    break
+                endpoint.exclusive = True
+            elif endpoint.running >= self.max_per_host:
+                break
+
+            endpoint.queue.popleft()
+            endpoint.running += 1
+            self._executor.submit(self._run, endpoint, op)
+
+    def _run(self, endpoint, op):
+        _queue_latency.observe(time.monotonic() - op.queued)
+        try:
+            if op.future.set_running_or_notify_cancel():
+                op.future.set_result(self._call(op))
+        except Exception as e:   # pylint: disable=broad-except
+            op.future.set_exception(e)
+        finally:
+            with self._lock:
+                endpoint.running -= 1
+                if op.kind == _SET:
+                    endpoint.exclusive = False
+                self._dispatch(endpoint)
+
+    def _call(self, op):
+        retry_errors = self.set_retry_errors if op.kind == _SET else \
+            self.retry_errors
+        delays = iter(self.backoff)
+        for attempt in range(self.retries + 1):
+            retval = op.func(*op.args)
+            if retval not in retry_errors:
+                break
+            if attempt == self.retries:
+                logging.error("%s failed (%s), giving up after %d attempts",
+                              op.func.__name__, retval, attempt + 1)
+                _ops.inc(op=op.kind, result="failed")
+                return retval
+            delay = next(delays)
+            logging.debug("%s failed (%s), retrying in %.1fs",
+                          op.func.__name__, retval, delay)
+            _ops.inc(op=op.kind, result="retried")
+            time.sleep(delay)
+        _ops.inc(op=op.kind, result="ok")
+        return retval
+
+    def get_power_state(self, amt):
+        """
+        Queue a power state query, return a future for the power state
+        """
+        with self._lock:
+            endpoint = self._endpoint(amt)
+            # A query of the same client (and with it the same credentials)
+            # that hasn't started yet answers this one just as well, unless
+            # there's a power state change queued in between
+            for queued in reversed(endpoint.queue):
+                if queued.kind == _SET:
+                    break
+                if queued.amt is amt:
+                    _ops.inc(op=_GET, result="coalesced")
+                    return queued.future
+
+            op = _Op(_GET, amt, amt.get_power_state, ())
+            endpoint.queue.append(op)
+            self._dispatch(endpoint)
+        return op.future
+
+    def set_power_state(self, amt, state):
+        """
+        Queue a power state change, return a future for the result
+        """
+        op = _Op(_SET, amt, amt.set_power_state, (state,))
+        with self._lock:
+            endpoint = self._endpoint(amt)
+            endpoint.queue.append(op)
+            self._dispatch(endpoint)
+        return op.future
+
+    def shutdown(self):
+        """
+        Cancel all queued operations and stop the workers once the running
+        ones are finished
+        """
+        with self._lock:
+            for endpoint in self._endpoints.values():
+                for op in endpoint.queue:
+                    op.future.cancel()
+                endpoint.queue.clear()
+        self._executor.shutdown(wait=False)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def scheduler():
+    """
+    Return the shared scheduler
+    """
+    global _scheduler   # pylint: disable=global-statement
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+    return _scheduler
+
+
+def get_power_state(amt):
+    """
+    Get the power state of a host through the shared scheduler, unless the
+    client schedules its requests itself (like an agent client does)
+    """
+    if getattr(amt, "scheduled", False):
+        return amt.get_power_state()
+    return scheduler().get_power_state(amt).result()
+
+
+def set_power_state(amt, state):
+    """
+    Set the power state of a host through the shared scheduler, unless the
+    client schedules its requests itself
+    """
+    if getattr(amt, "scheduled", False):
+        return amt.set_power_state(state)
+    return scheduler().set_power_state(amt, state).result()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+#
+# Power state transition wait engine
+#
+# Copyright (C) 2018  Juerg Haefliger <juergh@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+
+class Profile():
+    """
+    The expected behavior of a power state transition: the state the host
+    ends up in, the time it typically takes to get there (no earlier result
+    is accepted) and the time after which to give up
+    """
+    def __init__(self, target, duration, timeout):
+        self.target = target
+        self.duration = duration
+        self.timeout = timeout
+
+
+class Backoff():
+    """
+    Adaptive poll intervals: poll fast at first, then back off
+    """
+    def __init__(self, initial=0.25, factor=1.5, maximum=2.0):
+        self.initial = initial
+        self.factor = factor
+        self.maximum = maximum
+
+    def __iter__(self):
+        delay = self.initial
+        while True:
+            yield delay
+            delay = min(delay * self.factor, self.maximum)
+
+
+class _Wait():
+    """
+    The timing rules of waiting for a transition: when to poll next and
+    whether a polled state ends the wait
+    """
+    def __init__(self, profile, timeout=None, backoff=None):
+        if timeout is None:
+            timeout = profile.timeout
+        self.profile = profile
+        self.start = time.monotonic()
+        self.deadline = self.start + timeout
+        self.delays = iter(backoff or Backoff())
+
+    def delay(self):
+        """
+        Return the time to wait before the next poll
+        """
+        return max(0, min(next(self.delays),
+                          self.deadline - time.monotonic()))
+
+    def result(self, state):
+        """
+        Check a polled state, return 0 if the transition is complete, -1 if
+        it timed out and None if it's still in progress
+        """
+        now = time.monotonic()
+        if state == self.profile.target and \
+           now - self.start >= self.profile.duration:
+            logging.debug("Reached power state %s after %.3fs", state,
+                          now - self.start)
+            return 0
+        if now >= self.deadline:
+            logging.debug("Timed out waiting for requested power state")
+            return -1
+        return None
+
+
+async def wait_for(get_state, profile, timeout=None, backoff=None):
+    """
+    Poll the coroutine get_state until it returns the profile's target
+    state, return 0 on success or -1 on timeout
+    """
+    import asyncio   # pylint: disable=import-outside-toplevel
+
+    wait = _Wait(profile, timeout, backoff)
+    while True:
+        await asyncio.sleep(wait.delay())
+        retval = wait.result(await get_state())
+        if retval is not None:
+            return retval
+
+
+class _Watch(_Wait):
+    def __init__(self, get_state, profile, timeout, backoff):
+        import concurrent.futures   # pylint: disable=import-outside-toplevel
+
+        super(_Watch, self).__init__(profile, timeout, backoff)
+        self.get_state = get_state
+        self.future = concurrent.futures.Future()
+
+
+class Watcher():
+    """
+    Wait for many power state transitions at once
+
+    A single scheduler thread keeps track of all pending transitions and
+    hands the actual power state queries to a small pool of worker threads,
+    so there's no need for a thread per host.
+    """
+    def __init__(self, max_workers=8):
+        # Not needed unless transitions are watched in the background
+        import concurrent.futures   # pylint: disable=import-outside-toplevel
+
+        self._queue = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="amt-watch")
+        self._thread = None
+
+    def watch(self, get_state, profile, timeout=None, backoff=None,
+              callback=None):
+        """
+        Start watching a transition, return a future that resolves to 0 on
+        success or -1 on timeout. The optional callback is called with the
+        future once it's done.
+        """
+        watch = _Watch(get_state, profile, timeout, backoff)
+        if callback:
+            watch.future.add_done_callback(callback)
+
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name="amt-watcher",
+                                                daemon=True)
+                self._thread.start()
+        self._schedule(watch)
+        return watch.future
+
+    def _schedule(self, watch):
+        due = time.monotonic() + watch.delay()
+        with self._cond:
+            heapq.heappush(self._queue, (due, next(self._seq), watch))
+            self._cond.notify()
+
+    def _poll(self, watch):
+        if watch.future.cancelled():
+            return
+        try:
+            state = watch.get_state()
+        except Exception as e:   # pylint: disable=broad-except
+            watch.future.set_exception(e)
+            return
+
+        retval = watch.result(state)
+        if retval is None:
+            self._schedule(watch)
+        else:
+            watch.future.set_result(retval)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue or \
+                      self._queue[0][0] > time.monotonic():
+                    timeout = None
+                    if self._queue:
+                        timeout = self._queue[0][0] - time.monotonic()
+                    self._cond.wait(timeout)
+                _due, _seq, watch = heapq.heappop(self._queue)
+            self._executor.submit(self._poll, watch)
@@ -18,6 +18,41 @@
 from xml.etree import ElementTree
 
 
+class XmlResponse():
+    """
+    A parsed wsman response
+
+    The response document is parsed exactly once and all elements are
+    indexed by their namespace-qualified tag, so that subsequent lookups
+    don't need to walk (or re-parse) the document again.
+    """
+    def __init__(self, doc):
+        if isinstance(doc, (str, bytes)):
+            self.tree = ElementTree.fromstring(doc)
+        else:
+            self.tree = ElementTree.fromstring(doc.root().string())
+        self.doc = doc
+
+        self._index = {}
+        for elem in self.tree.iter():
+            self._index.setdefault(elem.tag, elem)
+
+    def find(self, namespace, item):
+        """
+        Find the first element with namespace and item
+        """
+        return self._index.get("{%s}%s" % (namespace, item))
+
+    def findtext(self, namespace, item, default=None):
+        """
+        Find the text of the first element with namespace and item
+        """
+        elem = self.find(namespace, item)
+        if elem is None:
+            return default
+        return elem.text
+
+
 def xml_find(doc, namespace, item):
     """
     Find the first element with namespace and item, in the XML doc
@@ -25,6 +60,6 @@ def xml_find(doc, namespace, item):
     if doc is None:
         raise Exception("xml_find (doc = None)")
 
-    tree = ElementTree.fromstring(doc.root().string())
-    query = (".//{%s}%s" % (namespace, item))
-    return tree.find(query)
+    if not isinstance(doc, XmlResponse):
+        doc = XmlResponse(doc)
+    return doc.find(namespace, item)
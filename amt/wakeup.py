@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018  Juerg Haefliger <juergh@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import errno
+import logging
+import selectors
+import socket
+import time
+
+# Connect errors that prove that the target is awake and answering
+_ANSWERED = (0, errno.ECONNREFUSED, errno.ECONNRESET)
+
+
+class _Probe():
+    """
+    A single non-blocking TCP connect (SYN) to a target address
+    """
+    def __init__(self, host, addr):
+        self.host = host
+        self.addr = addr
+        self.sock = socket.socket(addr[0], socket.SOCK_STREAM)
+        try:
+            self.sock.setblocking(False)
+            self.sock.connect_ex(addr[4])
+        except OSError:
+            self.sock.close()
+            raise
+
+    def result(self):
+        return self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+
+    def close(self, sel):
+        try:
+            sel.unregister(self.sock)
+        except KeyError:
+            pass
+        self.sock.close()
+
+
+def _resolve(host, ports):
+    """
+    Resolve the host and return the list of its TCP addresses
+    """
+    addrs = []
+    for port in ports:
+        try:
+            addrs.extend(socket.getaddrinfo(host, port,
+                                            type=socket.SOCK_STREAM))
+        except socket.gaierror as e:
+            logging.debug("Failed to resolve %s: %s", host, e)
+    return addrs
+
+
+def _probe(hosts, addrs, timeout, interval):
+    start = time.monotonic()
+    deadline = start + timeout
+
+    result = {host: None for host in hosts}
+    pending = set(host for host in hosts if addrs[host])
+
+    sel = selectors.DefaultSelector()
+    # The probes of the current round, per host
+    probes = {}
+    try:
+        next_round = start
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+
+            # Fire a new round of connection requests, replacing the
+            # previous round's
+            if now >= next_round:
+                for host in pending:
+                    for p in probes.pop(host, ()):
+                        p.close(sel)
+                    probes[host] = []
+                    for addr in addrs[host]:
+                        try:
+                            p = _Probe(host, addr)
+                        except OSError as e:
+                            logging.debug("Failed to probe %s: %s", host, e)
+                            continue
+                        probes[host].append(p)
+                        sel.register(p.sock, selectors.EVENT_WRITE, p)
+                next_round = now + interval
+
+            for key, _events in sel.select(min(next_round, deadline) - now):
+                p = key.data
+                sel.unregister(p.sock)
+                if p.host in pending and p.result() in _ANSWERED:
+                    result[p.host] = time.monotonic() - start
+                    pending.discard(p.host)
+                    for q in probes.pop(p.host):
+                        q.close(sel)
+    finally:
+        for host_probes in probes.values():
+            for p in host_probes:
+                p.close(sel)
+        sel.close()
+
+    return result
+
+
+def probe(hosts, ports=(16992,), timeout=1.0, interval=0.2, max_sockets=256):
+    """
+    Wake up the hosts by concurrently sending TCP connection requests to the
+    given ports, repeated every interval seconds, until a host answers (by
+    accepting or refusing the connection) or the timeout expires. Returns a
+    dict with the time it took each host to answer, or None if it didn't.
+
+    Each round replaces the previous round's connection requests and at most
+    max_sockets of them are in flight at any time, larger sets of hosts are
+    probed in batches.
+    """
+    addrs = {host: _resolve(host, ports) for host in hosts}
+
+    result = {}
+    batch = []
+    count = 0
+    for host in hosts:
+        if batch and count + len(addrs[host]) > max_sockets:
+            result.update(_probe(batch, addrs, timeout, interval))
+            batch = []
+            count = 0
+        batch.append(host)
+        count += len(addrs[host])
+    if batch:
+        result.update(_probe(batch, addrs, timeout, interval))
+    return result
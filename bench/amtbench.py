@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+#
+# Intel AMT power/WS-Man benchmarks
+#
+# Copyright (C) 2018  Juerg Haefliger <juergh@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Run from the top-level directory with 'python3 -m bench.amtbench'.
+
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import subprocess
+import sys
+import time
+
+from amt import aiopower, fleet, power, utils
+from bench.fakeamt import FakeAMT, power_state_response
+
+USERNAME = "admin"
+PASSWORD = "P@ssw0rd"
+
+
+def _summary(samples):
+    """
+    Summarize a list of latencies (in seconds)
+    """
+    samples = sorted(samples)
+    if not samples:
+        return {"n": 0}
+
+    def percentile(p):
+        return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+    return {
+        "n": len(samples),
+        "min": samples[0],
+        "avg": sum(samples) / len(samples),
+        "p50": percentile(0.50),
+        "p95": percentile(0.95),
+        "max": samples[-1],
+    }
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    retval = func(*args)
+    return time.perf_counter() - start, retval
+
+
+def _version():
+    try:
+        return subprocess.check_output(["git", "describe", "--always",
+                                        "--dirty"],
+                                       stderr=subprocess.DEVNULL).decode() \
+                                                                 .strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# -----------------------------------------------------------------------------
+# Benchmarks
+
+def bench_xml_parse(iterations):
+    """
+    Parse a power state response and look up the power state
+    """
+    namespace = power._CIM_AssociatedPowerManagementService   # pylint: disable=protected-access
+    doc = power_state_response(power.POWER_STATE_ON)
+
+    start = time.perf_counter()
+    for _i in range(iterations):
+        utils.XmlResponse(doc).findtext(namespace, "PowerState")
+    elapsed = time.perf_counter() - start
+    return {"iterations": iterations, "per_op": elapsed / iterations,
+            "ops_per_sec": iterations / elapsed}
+
+
+async def _bench_wake_up(fake, iterations):
+    client = aiopower.AsyncWsManClient(fake.address, USERNAME, PASSWORD)
+    samples = []
+    for _i in range(iterations):
+        client.last_query = 0
+        start = time.perf_counter()
+        await client.wake_up()
+        samples.append(time.perf_counter() - start)
+
+    # A wake-up within the wake-up interval is free
+    start = time.perf_counter()
+    await client.wake_up()
+    return {"latency": _summary(samples),
+            "skipped": time.perf_counter() - start}
+
+
+def bench_wake_up(fake, iterations):
+    """
+    Cost of wake_up() against an answering endpoint
+    """
+    return asyncio.run(_bench_wake_up(fake, iterations))
+
+
+def bench_sync(fake, iterations):
+    """
+    get_power_state/set_power_state latency of the synchronous driver
+    """
+    challenges = fake.stats["challenges"]
+    amt = power.AMTPower(fake.address, USERNAME, PASSWORD)
+    samples = [_timed(amt.get_power_state)[0] for _i in range(iterations)]
+    result = {"get_power_state": _summary(samples)}
+
+    samples = []
+    for state in (power.POWER_STATE_OFF, power.POWER_STATE_ON) * 2:
+        samples.append(_timed(amt.set_power_state, state, True)[0] -
+                       fake.transition_time)
+    result["set_power_state_wait_overhead"] = _summary(samples)
+    result["sessions"] = fake.stats["challenges"] - challenges
+    return result
+
+
+async def _bench_async(fake, iterations, concurrency):
+    amt = aiopower.AsyncAMTPower(fake.address, USERNAME, PASSWORD)
+    result = {}
+
+    samples = []
+    for _i in range(iterations):
+        start = time.perf_counter()
+        await amt.get_power_state()
+        samples.append(time.perf_counter() - start)
+    result["get_power_state"] = _summary(samples)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[amt.get_power_state()
+                           for _i in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    result["concurrent_gets_per_sec"] = concurrency / elapsed
+
+    samples = []
+    for state in (power.POWER_STATE_OFF, power.POWER_STATE_ON) * 2:
+        start = time.perf_counter()
+        await amt.set_power_state(state, wait=True)
+        samples.append(time.perf_counter() - start - fake.transition_time)
+    result["set_power_state_wait_overhead"] = _summary(samples)
+
+    await amt.close()
+    return result
+
+
+def bench_async(fake, iterations, concurrency):
+    """
+    get_power_state/set_power_state latency of the asyncio driver
+    """
+    return asyncio.run(_bench_async(fake, iterations, concurrency))
+
+
+async def _bench_faults(fake, iterations):
+    amt = aiopower.AsyncAMTPower(fake.address, USERNAME, PASSWORD)
+    samples = []
+    errors = 0
+    for _i in range(iterations):
+        start = time.perf_counter()
+        state = await amt.get_power_state()
+        samples.append(time.perf_counter() - start)
+        if state not in power.POWER_STATES:
+            errors += 1
+    await amt.close()
+    return {"get_power_state": _summary(samples), "errors": errors,
+            "fault_rate": fake.fault_rate}
+
+
+def bench_faults(fake, iterations):
+    """
+    get_power_state latency with a fraction of the requests failing
+    """
+    return asyncio.run(_bench_faults(fake, iterations))
+
+
+async def _bench_async_fleet(fakes):
+    amts = [aiopower.AsyncAMTPower(fake.address, USERNAME, PASSWORD)
+            for fake in fakes]
+    start = time.perf_counter()
+    states = await asyncio.gather(*[amt.get_power_state() for amt in amts])
+    elapsed = time.perf_counter() - start
+    for amt in amts:
+        await amt.close()
+    ok = sum(1 for state in states if state in power.POWER_STATES)
+    return {"hosts": len(fakes), "ok": ok, "elapsed": elapsed,
+            "hosts_per_sec": len(fakes) / elapsed}
+
+
+def bench_fleet(fakes, jobs):
+    """
+    Fleet throughput, power-state query of all hosts
+    """
+    result = {"async": asyncio.run(_bench_async_fleet(fakes))}
+
+    start = time.perf_counter()
+    results = list(fleet.run([fake.address for fake in fakes], USERNAME,
+                             PASSWORD, "power-state", jobs=jobs))
+    elapsed = time.perf_counter() - start
+    result["threaded"] = fleet.summary(results)
+    result["threaded"].update({"elapsed": elapsed,
+                               "hosts_per_sec": len(fakes) / elapsed})
+    return result
+
+
+# -----------------------------------------------------------------------------
+# Main entry point
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the AMT power "
+                                     "drivers against local fake AMT "
+                                     "endpoints.")
+    parser.add_argument("-o", "--output",
+                        help="Write the results (JSON) to OUTPUT. If not "
+                        "specified, they're written to stdout.")
+    parser.add_argument("-n", "--iterations", type=int, default=200,
+                        help="Iterations per latency benchmark. If not "
+                        "specified, defaults to '200'.")
+    parser.add_argument("-l", "--latency", type=float, default=0.0,
+                        help="Response latency of the fake endpoints in "
+                        "seconds. If not specified, defaults to '0'.")
+    parser.add_argument("-t", "--transition-time", type=float, default=0.2,
+                        help="Power state transition time in seconds. If not "
+                        "specified, defaults to '0.2'.")
+    parser.add_argument("-f", "--fault-rate", type=float, default=0.1,
+                        help="Fault rate for the fault benchmark. If not "
+                        "specified, defaults to '0.1'.")
+    parser.add_argument("-H", "--hosts", type=int, default=32,
+                        help="Number of fake hosts for the fleet benchmark. "
+                        "If not specified, defaults to '32'.")
+    parser.add_argument("-j", "--jobs", type=int, default=16,
+                        help="Number of concurrent jobs for the fleet "
+                        "benchmark. If not specified, defaults to '16'.")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Enable verbose output.")
+    args = parser.parse_args()
+
+    level = logging.DEBUG if args.verbose else logging.WARNING
+    logging.basicConfig(level=level, format="%(asctime)s: %(message)s",
+                        datefmt="%b %d %H:%M:%S")
+
+    fake = FakeAMT(username=USERNAME, password=PASSWORD,
+                   latency=args.latency,
+                   transition_time=args.transition_time).start()
+    faulty = FakeAMT(username=USERNAME, password=PASSWORD,
+                     latency=args.latency, fault_rate=args.fault_rate,
+                     seed=0).start()
+    fakes = [FakeAMT(username=USERNAME, password=PASSWORD,
+                     latency=args.latency).start()
+             for _i in range(args.hosts)]
+
+    results = {
+        "version": _version(),
+        "python": platform.python_version(),
+        "timestamp": time.time(),
+        "config": vars(args),
+        "results": {},
+    }
+    benchmarks = (
+        ("xml_parse", bench_xml_parse, (args.iterations * 10,)),
+        ("wake_up", bench_wake_up, (fake, args.iterations)),
+        ("sync", bench_sync, (fake, args.iterations)),
+        ("async", bench_async, (fake, args.iterations, args.iterations)),
+        ("faults", bench_faults, (faulty, args.iterations)),
+        ("fleet", bench_fleet, (fakes, args.jobs)),
+    )
+    for name, func, func_args in benchmarks:
+        print("Running %s ..." % name, file=sys.stderr)
+        results["results"][name] = func(*func_args)
+
+    for server in [fake, faulty] + fakes:
+        server.stop()
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as fh:
+            fh.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
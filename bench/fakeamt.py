@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+#
+# Fake Intel AMT WS-Man endpoint for benchmarks
+#
+# Copyright (C) 2018  Juerg Haefliger <juergh@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import argparse
+import hashlib
+import http.server
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+from amt import power
+
+_SOAP = "http://www.w3.org/2003/05/soap-envelope"
+_REALM = "Digest:FAKEAMT"
+
+_AUTH_RE = re.compile(r'(\w+)=("([^"]*)"|[^,\s]*)')
+_POWER_STATE_RE = re.compile(r"PowerState>(\d+)<")
+
+_GET_RESPONSE = """\
+<a:Envelope xmlns:a="%s"><a:Header/><a:Body>\
+<g:CIM_AssociatedPowerManagementService xmlns:g="%s">\
+<g:AvailableRequestedPowerStates>2</g:AvailableRequestedPowerStates>\
+<g:PowerState>%d</g:PowerState>\
+<g:RequestedPowerState>%d</g:RequestedPowerState>\
+</g:CIM_AssociatedPowerManagementService></a:Body></a:Envelope>"""
+
+_INVOKE_RESPONSE = """\
+<a:Envelope xmlns:a="%s"><a:Header/><a:Body>\
+<g:RequestPowerStateChange_OUTPUT xmlns:g="%s">\
+<g:ReturnValue>%d</g:ReturnValue>\
+</g:RequestPowerStateChange_OUTPUT></a:Body></a:Envelope>"""
+
+_FAULT_RESPONSE = """\
+<a:Envelope xmlns:a="%s"><a:Header/><a:Body><a:Fault>\
+<a:Code><a:Value>a:Receiver</a:Value></a:Code>\
+<a:Reason><a:Text xml:lang="en-US">%s</a:Text></a:Reason>\
+</a:Fault></a:Body></a:Envelope>"""
+
+# The state a power state change request ends up in and the state reported
+# while the transition is in progress (None: the current state)
+_transitions = {
+    power.POWER_STATE_ON: (power.POWER_STATE_ON, None),
+    power.POWER_STATE_CYCLE: (power.POWER_STATE_ON, power.POWER_STATE_OFF),
+    power.POWER_STATE_OFF: (power.POWER_STATE_OFF, None),
+    power.POWER_STATE_RESET: (power.POWER_STATE_ON, None),
+    power.POWER_STATE_NMI: (power.POWER_STATE_ON, None),
+}
+
+
+def power_state_response(state, requested=None):
+    """
+    Return the response to a CIM_AssociatedPowerManagementService get
+    """
+    if requested is None:
+        requested = state
+    return _GET_RESPONSE % (
+        _SOAP, power._CIM_AssociatedPowerManagementService,   # pylint: disable=protected-access
+        state, requested)
+
+
+def _md5(*args):
+    return hashlib.md5(":".join(args).encode()).hexdigest()
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, don't let Nagle's algorithm
+    # delay the body
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        # Close keep-alive connections after idle_timeout, like AMT does
+        self.timeout = self.server.fake.idle_timeout
+        super(_Handler, self).setup()
+
+    def log_message(self, fmt, *args):   # pylint: disable=arguments-differ
+        logging.debug("%s: " + fmt, self.address_string(), *args)
+
+    def _reply(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for key, val in (headers or {}).items():
+            self.send_header(key, val)
+        if body:
+            self.send_header("Content-Type",
+                             "application/soap+xml;charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self, fake):
+        auth = self.headers.get("Authorization", "")
+        if not auth.lower().startswith("digest "):
+            return False
+        params = {m.group(1): m.group(3) if m.group(3) is not None
+                  else m.group(2) for m in _AUTH_RE.finditer(auth[7:])}
+        try:
+            ha1 = _md5(params["username"], _REALM, fake.password)
+            ha2 = _md5(self.command, params["uri"])
+            expected = _md5(ha1, params["nonce"], params["nc"],
+                            params["cnonce"], params["qop"], ha2)
+        except KeyError:
+            return False
+        return params["username"] == fake.username and \
+            params["nonce"] == fake.nonce and params["response"] == expected
+
+    def do_POST(self):   # pylint: disable=invalid-name
+        fake = self.server.fake
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        if not self._authorized(fake):
+            fake.count("challenges")
+            self._reply(401, headers={
+                "WWW-Authenticate": 'Digest realm="%s", nonce="%s", '
+                                    'qop="auth"' % (_REALM, fake.nonce)})
+            return
+
+        if fake.latency:
+            time.sleep(fake.latency)
+
+        if fake.fault():
+            fake.count("faults")
+            self._reply(400, (_FAULT_RESPONSE %
+                              (_SOAP, fake.fault_reason)).encode())
+            return
+
+        body = body.decode(errors="replace")
+        if "RequestPowerStateChange" in body:
+            fake.count("invokes")
+            match = _POWER_STATE_RE.search(body)
+            retval = fake.request(int(match.group(1)) if match else None)
+            resp = _INVOKE_RESPONSE % (
+                _SOAP, power._CIM_PowerManagementService,   # pylint: disable=protected-access
+                retval)
+        else:
+            fake.count("gets")
+            resp = power_state_response(*fake.state())
+        self._reply(200, resp.encode())
+
+
+class _Server(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    # Don't drop connection requests (e.g., wake-up probes) under load
+    request_queue_size = 128
+
+
+class FakeAMT():
+    """
+    A stand-in Intel AMT WS-Man endpoint
+
+    Answers CIM_AssociatedPowerManagementService gets and
+    RequestPowerStateChange invokes (with HTTP digest authentication) after
+    latency seconds. A fraction fault_rate of the requests fails with a
+    SOAP fault, power state changes take transition_time seconds to
+    complete and keep-alive connections are closed after idle_timeout
+    seconds (None: never).
+    """
+    def __init__(self, host="127.0.0.1", port=0, username="admin",
+                 password="P@ssw0rd", latency=0.0, fault_rate=0.0,
+                 fault_reason="The operation timed out", transition_time=0.0,
+                 power_state=power.POWER_STATE_ON, seed=None,
+                 idle_timeout=None):
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.idle_timeout = idle_timeout
+        self.fault_rate = fault_rate
+        self.fault_reason = fault_reason
+        self.transition_time = transition_time
+        self.nonce = os.urandom(16).hex()
+        self.stats = {"challenges": 0, "gets": 0, "invokes": 0, "faults": 0}
+
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._state = power_state
+        self._requested = power_state
+        self._pending = None
+
+        self.server = _Server((host, port), _Handler)
+        self.server.fake = self
+        self._thread = None
+
+    @property
+    def address(self):
+        host, port = self.server.server_address[:2]
+        return "%s:%d" % (host, port)
+
+    def count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def fault(self):
+        with self._lock:
+            return self._random.random() < self.fault_rate
+
+    def state(self):
+        """
+        Return the current and the last requested power state
+        """
+        with self._lock:
+            if self._pending:
+                target, until = self._pending
+                if time.monotonic() >= until:
+                    self._state = target
+                    self._pending = None
+            return self._state, self._requested
+
+    def request(self, state):
+        """
+        Start a power state transition, return the ReturnValue
+        """
+        if state not in _transitions:
+            return 2
+        self.state()
+        target, interim = _transitions[state]
+        with self._lock:
+            self._requested = state
+            if interim is not None:
+                self._state = interim
+            self._pending = (target, time.monotonic() + self.transition_time)
+        return 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever,
+                                        name="fakeamt", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Intel AMT WS-Man "
+                                     "endpoint.")
+    parser.add_argument("-H", "--host", default="127.0.0.1",
+                        help="Address to listen on. If not specified, "
+                        "defaults to '127.0.0.1'.")
+    parser.add_argument("-p", "--port", type=int, default=16992,
+                        help="Port to listen on. If not specified, defaults "
+                        "to '16992'.")
+    parser.add_argument("-u", "--username", default="admin")
+    parser.add_argument("-P", "--password", default="P@ssw0rd")
+    parser.add_argument("-l", "--latency", type=float, default=0.0,
+                        help="Response latency in seconds.")
+    parser.add_argument("-f", "--fault-rate", type=float, default=0.0,
+                        help="Fraction of requests that fail with a SOAP "
+                        "fault.")
+    parser.add_argument("-t", "--transition-time", type=float, default=0.0,
+                        help="Time in seconds a power state change takes.")
+    parser.add_argument("-i", "--idle-timeout", type=float,
+                        help="Time in seconds after which idle keep-alive "
+                        "connections are closed.")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Enable verbose output.")
+    args = parser.parse_args()
+
+    level = logging.DEBUG if args.verbose else logging.INFO
+    logging.basicConfig(level=level, format="%(asctime)s: %(message)s",
+                        datefmt="%b %d %H:%M:%S")
+
+    fake = FakeAMT(args.host, args.port, args.username, args.password,
+                   latency=args.latency, fault_rate=args.fault_rate,
+                   transition_time=args.transition_time,
+                   idle_timeout=args.idle_timeout)
+    logging.info("Listening on %s", fake.address)
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+#
+# Fake RFB (VNC) server
+#
+# Copyright (C) 2018  Juerg Haefliger <juergh@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# A stand-in RFB server for testing vnc.rfb. The encoders are written
+# independently of the client's decoders and pick the subencodings by
+# content, like a real server does.
+
+import argparse
+import logging
+import os
+import select
+import socketserver
+import struct
+import threading
+import zlib
+
+import numpy as np
+
+from vnc import des, rfb
+
+# 32 bits per pixel, depth 24, little endian, true color, RGB888, the only
+# pixel format the fake speaks
+PIXEL_FORMAT = struct.pack(">BBBBHHHBBB3x", 32, 24, 0, 1, 255, 255, 255, 16,
+                           8, 0)
+
+# Hextile subencoding flags
+HEXTILE_RAW = 1
+HEXTILE_BACKGROUND = 2
+HEXTILE_FOREGROUND = 4
+HEXTILE_SUBRECTS = 8
+HEXTILE_COLOURED = 16
+
+
+def _tiles(x, y, w, h, size):
+    for ty in range(y, y + h, size):
+        for tx in range(x, x + w, size):
+            yield tx, ty, min(size, x + w - tx), min(size, y + h - ty)
+
+
+def _pixel(value):
+    return struct.pack("<I", value)
+
+
+def _cpixel(value):
+    return struct.pack("<I", value)[:3]
+
+
+def _runs(pixels):
+    """
+    Return the (pixel, length) runs of a sequence of pixels
+    """
+    runs = []
+    for pixel in pixels:
+        if runs and runs[-1][0] == pixel:
+            runs[-1][1] += 1
+        else:
+            runs.append([pixel, 1])
+    return runs
+
+
+def _row_rects(tile, skip):
+    """
+    Return (pixel, x, y, w, 1) runs of a tile, leaving out the pixel skip
+    """
+    rects = []
+    for y, row in enumerate(tile.tolist()):
+        x = 0
+        for pixel, length in _runs(row):
+            if pixel != skip:
+                rects.append((pixel, x, y, length, 1))
+            x += length
+    return rects
+
+
+def encode_raw(fb, x, y, w, h):
+    return fb[y:y + h, x:x + w].astype("<u4").tobytes()
+
+
+def encode_rre(fb, x, y, w, h):
+    rect = fb[y:y + h, x:x + w]
+    values, counts = np.unique(rect, return_counts=True)
+    bg = int(values[counts.argmax()])
+    rects = _row_rects(rect, bg)
+    data = struct.pack(">I", len(rects)) + _pixel(bg)
+    for pixel, sx, sy, sw, sh in rects:
+        data += _pixel(pixel) + struct.pack(">HHHH", sx, sy, sw, sh)
+    return data
+
+
+class _HextileEncoder():
+    def __init__(self):
+        self.bg = None
+        self.fg = None
+
+    def tile(self, tile):
+        values, counts = np.unique(tile, return_counts=True)
+        order = counts.argsort()[::-1]
+        colors = [int(v) for v in values[order]]
+        bg = colors[0]
+
+        flags = 0
+        data = b""
+        if bg != self.bg:
+            flags |= HEXTILE_BACKGROUND
+            data += _pixel(bg)
+            self.bg = bg
+        if len(colors) == 1:
+            return struct.pack(">B", flags) + data
+
+        rects = _row_rects(tile, bg)
+        if len(colors) == 2:
+            fg = colors[1]
+            if fg != self.fg:
+                flags |= HEXTILE_FOREGROUND
+                data += _pixel(fg)
+                self.fg = fg
+            subrects = b"".join(struct.pack(">BB", x << 4 | y,
+                                            (w - 1) << 4 | (h - 1))
+                                for _p, x, y, w, h in rects)
+        else:
+            flags |= HEXTILE_COLOURED
+            subrects = b"".join(_pixel(p) +
+                                struct.pack(">BB", x << 4 | y,
+                                            (w - 1) << 4 | (h - 1))
+                                for p, x, y, w, h in rects)
+            # The foreground color is undefined after coloured subrects
+            self.fg = None
+
+        if len(rects) > 255 or len(subrects) >= tile.size * 4:
+            # Raw is smaller (or the only option), the background and
+            # foreground colors are undefined afterwards
+            self.bg = None
+            self.fg = None
+            return struct.pack(">B", HEXTILE_RAW) + \
+                tile.astype("<u4").tobytes()
+
+        flags |= HEXTILE_SUBRECTS
+        return struct.pack(">B", flags) + data + \
+            struct.pack(">B", len(rects)) + subrects
+
+
+def encode_hextile(fb, x, y, w, h):
+    encoder = _HextileEncoder()
+    return b"".join(encoder.tile(fb[ty:ty + th, tx:tx + tw])
+                    for tx, ty, tw, th in _tiles(x, y, w, h, 16))
+
+
+def _zrle_tile(tile):
+    """
+    Encode a ZRLE tile with the smallest subencoding
+    """
+    pixels = [int(p) for p in tile.reshape(-1)]
+    palette = sorted(set(pixels))
+    if len(palette) == 1:
+        return b"\x01" + _cpixel(palette[0])
+
+    candidates = [b"\x00" + b"".join(_cpixel(p) for p in pixels)]
+    runs = _runs(pixels)
+
+    def run_length(length):
+        return b"\xff" * ((length - 1) // 255) + \
+            struct.pack(">B", (length - 1) % 255)
+
+    # Plain RLE
+    candidates.append(b"\x80" + b"".join(_cpixel(p) + run_length(n)
+                                         for p, n in runs))
+
+    if len(palette) <= 127:
+        index = {p: i for i, p in enumerate(palette)}
+        head = b"".join(_cpixel(p) for p in palette)
+        # Palette RLE, runs of 1 are a single index without the flag
+        data = struct.pack(">B", 128 + len(palette)) + head
+        for p, n in runs:
+            if n == 1:
+                data += struct.pack(">B", index[p])
+            else:
+                data += struct.pack(">B", index[p] | 0x80) + run_length(n)
+        candidates.append(data)
+
+        if len(palette) <= 16:
+            # Packed palette, each row padded to whole bytes
+            bits = 1 if len(palette) == 2 else 2 if len(palette) <= 4 else 4
+            data = struct.pack(">B", len(palette)) + head
+            for row in tile.tolist():
+                value = 0
+                nbits = 0
+                for p in row:
+                    value = value << bits | index[p]
+                    nbits += bits
+                nbits_padded = (nbits + 7) // 8 * 8
+                value <<= nbits_padded - nbits
+                data += value.to_bytes(nbits_padded // 8, "big")
+            candidates.append(data)
+
+    return min(candidates, key=len)
+
+
+def encode_zrle(fb, x, y, w, h, compressor):
+    data = b"".join(_zrle_tile(fb[ty:ty + th, tx:tx + tw])
+                    for tx, ty, tw, th in _tiles(x, y, w, h, 64))
+    data = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    return struct.pack(">I", len(data)) + data
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    # Unbuffered, so that select() tells if there's a message waiting
+    rbufsize = 0
+
+    def _recv(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.connection.recv(size - len(data))
+            if not chunk:
+                raise EOFError("Connection closed by client")
+            data += chunk
+        return data
+
+    def _read(self, fmt):
+        return struct.unpack(fmt, self._recv(struct.calcsize(fmt)))
+
+    def _handshake(self, fake):
+        self.wfile.write(b"RFB 003.%03d\n" % fake.minor)
+        version = self._recv(12)
+        minor = int(version[8:11])
+        if minor not in (3, 7, 8):
+            raise ValueError("Unsupported version %r" % version)
+
+        sec_type = 2 if fake.password is not None else 1
+        if minor == 3:
+            self.wfile.write(struct.pack(">I", sec_type))
+        else:
+            self.wfile.write(struct.pack(">BB", 1, sec_type))
+            (chosen,) = self._read(">B")
+            if chosen != sec_type:
+                raise ValueError("Invalid security type %d" % chosen)
+
+        ok = True
+        if sec_type == 2:
+            challenge = os.urandom(16)
+            self.wfile.write(challenge)
+            response = self._recv(16)
+            key = fake.password.encode()[:8].ljust(8, b"\x00")
+            key = bytes(int("{:08b}".format(b)[::-1], 2) for b in key)
+            ok = response == des.encrypt(key, challenge)
+        if sec_type == 2 or minor == 8:
+            self.wfile.write(struct.pack(">I", 0 if ok else 1))
+            if not ok and minor == 8:
+                reason = b"Authentication failed"
+                self.wfile.write(struct.pack(">I", len(reason)) + reason)
+        if not ok:
+            raise ValueError("Authentication failed")
+
+        (_shared,) = self._read(">B")
+        name = fake.name.encode()
+        height, width = fake.framebuffer.shape
+        self.wfile.write(struct.pack(">HH", width, height) + PIXEL_FORMAT +
+                         struct.pack(">I", len(name)) + name)
+
+    def _update(self, rects):
+        fake = self.server.fake
+        with fake.lock:
+            fb = fake.framebuffer.copy()
+        encoding = fake.encoding if fake.encoding in self.encodings else \
+            rfb.ENCODING_RAW
+
+        data = struct.pack(">BxH", 0, len(rects))
+        for x, y, w, h in rects:
+            data += struct.pack(">HHHHi", x, y, w, h, encoding)
+            if encoding == rfb.ENCODING_RRE:
+                data += encode_rre(fb, x, y, w, h)
+            elif encoding == rfb.ENCODING_HEXTILE:
+                data += encode_hextile(fb, x, y, w, h)
+            elif encoding == rfb.ENCODING_ZRLE:
+                data += encode_zrle(fb, x, y, w, h, self.compressor)
+            else:
+                data += encode_raw(fb, x, y, w, h)
+        self.wfile.write(data)
+
+    def _damaged(self, x, y, w, h):
+        """
+        Return the damaged rectangles clipped to the requested one
+        """
+        fake = self.server.fake
+        rects = []
+        with fake.lock:
+            for dx, dy, dw, dh in fake.damage.pop(self, []):
+                x0, y0 = max(x, dx), max(y, dy)
+                x1, y1 = min(x + w, dx + dw), min(y + h, dy + dh)
+                if x1 > x0 and y1 > y0:
+                    rects.append((x0, y0, x1 - x0, y1 - y0))
+        return rects
+
+    def handle(self):
+        fake = self.server.fake
+        self.encodings = ()
+        self.compressor = zlib.compressobj()
+        # A pending incremental update request, answered on damage
+        pending = None
+        try:
+            self._handshake(fake)
+            with fake.lock:
+                fake.clients.append(self)
+            while True:
+                if pending is not None:
+                    rects = self._damaged(*pending)
+                    if rects:
+                        self._update(rects)
+                        pending = None
+                readable, _w, _x = select.select([self.connection], [], [],
+                                                 0.01)
+                if not readable:
+                    continue
+
+                (msg_type,) = self._read(">B")
+                if msg_type == 0:
+                    (pixel_format,) = self._read(">3x16s")
+                    if pixel_format != PIXEL_FORMAT:
+                        raise ValueError("Unsupported pixel format")
+                elif msg_type == 2:
+                    (count,) = self._read(">xH")
+                    self.encodings = self._read(">%di" % count)
+                elif msg_type == 3:
+                    incremental, x, y, w, h = self._read(">BHHHH")
+                    if incremental:
+                        pending = (x, y, w, h)
+                    else:
+                        self._update([(x, y, w, h)])
+                elif msg_type == 4:
+                    down, key = self._read(">B2xI")
+                    fake.key(self, key, down)
+                elif msg_type == 5:
+                    buttons, x, y = self._read(">BHH")
+                    with fake.lock:
+                        fake.events.append(("pointer", buttons, x, y))
+                elif msg_type == 6:
+                    (length,) = self._read(">3xI")
+                    self._recv(length)
+                else:
+                    raise ValueError("Unsupported message %d" % msg_type)
+        except (EOFError, OSError, ValueError) as e:
+            logging.debug("Client %s: %s", self.client_address, e)
+        finally:
+            with fake.lock:
+                if self in fake.clients:
+                    fake.clients.remove(self)
+                fake.damage.pop(self, None)
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class FakeVNC():
+    """
+    A stand-in RFB server
+
+    Serves the framebuffer (a height x width uint32 0x00RRGGBB array) in
+    encoding (Raw, RRE, Hextile or ZRLE) if the client supports it and in Raw
+    otherwise. Incremental update requests are answered once a part of the
+    requested area is damaged (see damage). Key and pointer events are
+    recorded in events, key presses optionally damage on_key.
+    """
+    def __init__(self, host="127.0.0.1", port=0, width=64, height=48,
+                 password=None, minor=8, encoding=rfb.ENCODING_RAW,
+                 name="fakevnc", on_key=None):
+        self.password = password
+        self.minor = minor
+        self.encoding = encoding
+        self.name = name
+        self.on_key = on_key
+        self.framebuffer = np.zeros((height, width), dtype=np.uint32)
+        self.events = []
+        self.clients = []
+        self.damage = {}
+        self.lock = threading.Lock()
+
+        self.server = _Server((host, port), _Handler)
+        self.server.fake = self
+        self._thread = None
+
+    @property
+    def address(self):
+        host, port = self.server.server_address[:2]
+        return "%s:%d" % (host, port)
+
+    def set_framebuffer(self, framebuffer, x=0, y=0):
+        """
+        Update a part of the framebuffer and damage it
+        """
+        h, w = framebuffer.shape
+        with self.lock:
+            self.framebuffer[y:y + h, x:x + w] = framebuffer
+        self.damage_rect(x, y, w, h)
+
+    def damage_rect(self, x, y, w, h):
+        """
+        Mark a rectangle as changed for all connected clients
+        """
+        with self.lock:
+            for client in self.clients:
+                self.damage.setdefault(client, []).append((x, y, w, h))
+
+    def key(self, client, key, down):
+        with self.lock:
+            self.events.append(("key", key, down))
+        if down and self.on_key:
+            self.damage_rect(*self.on_key)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever,
+                                        name="fakevnc", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake RFB (VNC) server.")
+    parser.add_argument("-H", "--host", default="127.0.0.1",
+                        help="Address to listen on. If not specified, "
+                        "defaults to '127.0.0.1'.")
+    parser.add_argument("-p", "--port", type=int, default=5900,
+                        help="Port to listen on. If not specified, defaults "
+                        "to '5900'.")
+    parser.add_argument("-P", "--password", help="VNC password.")
+    parser.add_argument("-s", "--size", default="640x480",
+                        help="Framebuffer size. If not specified, defaults "
+                        "to '640x480'.")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Enable verbose output.")
+    args = parser.parse_args()
+
+    level = logging.DEBUG if args.verbose else logging.INFO
+    logging.basicConfig(level=level, format="%(asctime)s: %(message)s",
+                        datefmt="%b %d %H:%M:%S")
+
+    width, height = (int(v) for v in args.size.split("x"))
+    fake = FakeVNC(args.host, args.port, width, height, args.password)
+    fake.framebuffer[:] = np.random.default_rng().integers(
+        0, 1 << 24, (height, width), dtype=np.uint32)
+    logging.info("Listening on %s", fake.address)
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
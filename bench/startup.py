@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+#
+# Startup time benchmarks
+#
+# Copyright (C) 2018  Juerg Haefliger <juergh@gmail.com>
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Run from the top-level directory with 'python3 -m bench.startup'.
+
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from amt import agent
+from bench.amtbench import PASSWORD, USERNAME, _summary, _version
+from bench.fakeamt import FakeAMT
+
+TOPDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _run(cmd, iterations, env=None):
+    """
+    Run a command iterations times (after a warm-up run), return the wall
+    clock times
+    """
+    env = dict(os.environ, PYTHONPATH=TOPDIR, **(env or {}))
+    samples = []
+    for i in range(iterations + 1):
+        start = time.perf_counter()
+        proc = subprocess.run(cmd, cwd=TOPDIR, env=env,
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.PIPE)
+        elapsed = time.perf_counter() - start
+        if proc.returncode:
+            logging.debug("%s failed: %s", " ".join(cmd),
+                          proc.stderr.decode(errors="replace").strip())
+            return {"failed": proc.returncode}
+        if i:
+            samples.append(elapsed)
+    return _summary(samples)
+
+
+def _script(name, *args):
+    return [sys.executable, os.path.join(TOPDIR, name)] + list(args)
+
+
+def _imports(*modules):
+    return [sys.executable, "-c", "import " + ", ".join(modules)]
+
+
+# -----------------------------------------------------------------------------
+# Main entry point
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the startup time "
+                                     "of the command line tools.")
+    parser.add_argument("-o", "--output",
+                        help="Write the results (JSON) to OUTPUT. If not "
+                        "specified, they're written to stdout.")
+    parser.add_argument("-n", "--iterations", type=int, default=20,
+                        help="Runs per command. If not specified, defaults "
+                        "to '20'.")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Enable verbose output.")
+    args = parser.parse_args()
+
+    level = logging.DEBUG if args.verbose else logging.WARNING
+    logging.basicConfig(level=level, format="%(asctime)s: %(message)s",
+                        datefmt="%b %d %H:%M:%S")
+
+    commands = [
+        ("python", [sys.executable, "-c", "pass"]),
+        ("import_amt_power", _imports("amt.power")),
+        ("import_amt_fleet", _imports("amt.fleet")),
+        ("amt_cli_help", _script("amt-cli", "--help")),
+        ("jvncviewer_help", _script("jvncviewer", "--help")),
+    ]
+
+    fake = FakeAMT(username=USERNAME, password=PASSWORD).start()
+    server = agent.Server(agent.Agent(),
+                          os.path.join(tempfile.mkdtemp(), "agent.sock"))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    power_state = _script("amt-cli", "power-state", fake.address, PASSWORD,
+                          "-u", USERNAME)
+    commands.append(("amt_cli_power_state", power_state + ["-n"]))
+    commands.append(("amt_cli_power_state_agent", power_state,
+                     {"AMT_AGENT_SOCKET": server.path}))
+
+    results = {
+        "version": _version(),
+        "python": platform.python_version(),
+        "timestamp": time.time(),
+        "config": vars(args),
+        "results": {},
+    }
+    for name, cmd, *env in commands:
+        print("Running %s ..." % name, file=sys.stderr)
+        results["results"][name] = _run(cmd, args.iterations, *env)
+    server.shutdown()
+    server.server_close()
+    os.rmdir(os.path.dirname(server.path))
+    fake.stop()
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as fh:
+            fh.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018  Juerg Haefliger <juergh@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import unittest
+
+from vnc import des
+
+# Key, plaintext, ciphertext
+VECTORS = (
+    ("133457799BBCDFF1", "0123456789ABCDEF", "85E813540F0AB405"),
+    ("0E329232EA6D0D73", "8787878787878787", "0000000000000000"),
+    ("0000000000000000", "0000000000000000", "8CA64DE9C1B123A7"),
+    ("FFFFFFFFFFFFFFFF", "FFFFFFFFFFFFFFFF", "7359B2163E4EDC58"),
+)
+
+
+class TestDES(unittest.TestCase):
+    def test_vectors(self):
+        for key, plain, cipher in VECTORS:
+            with self.subTest(key=key):
+                self.assertEqual(des.encrypt(bytes.fromhex(key),
+                                             bytes.fromhex(plain)),
+                                 bytes.fromhex(cipher))
+
+    def test_ecb(self):
+        key = bytes.fromhex(VECTORS[0][0])
+        plain = bytes.fromhex(VECTORS[0][1])
+        self.assertEqual(des.encrypt(key, plain * 2),
+                         des.encrypt(key, plain) * 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018  Juerg Haefliger <juergh@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import unittest
+
+from vnc import quality
+
+
+class _Controller(quality.QualityController):
+    """
+    A controller without a display, the configured levels are recorded
+    """
+    def _configure(self):
+        self.configured = getattr(self, "configured", []) + \
+            [(self.depth, self.lossy)]
+
+
+class TestQualityController(unittest.TestCase):
+    def setUp(self):
+        self.applied = 0
+        self.status = None
+        self.controller = _Controller(None, self._apply, status=self._status,
+                                      adaptive=True, min_change_interval=0)
+
+    def _apply(self):
+        self.applied += 1
+
+    def _status(self, text):
+        self.status = text
+
+    def _feed(self, samples, rtt, rate, throughput=None):
+        for _i in range(samples):
+            self.controller._measured(throughput or rate, (rtt, rate))
+
+    def test_busy_fast_link(self):
+        # A busy screen on a link that doesn't queue keeps the quality
+        self._feed(3, 0.001, 10 * 1024)
+        self._feed(20, 0.002, 20 * 1024 * 1024)
+        self.assertEqual(self.controller.level, 0)
+        self.assertEqual(self.applied, 0)
+
+    def test_drop_on_queueing(self):
+        self._feed(3, 0.02, 1024)
+        self._feed(2, 0.3, 200 * 1024)
+        self.assertEqual(self.controller.level, 0)
+        self._feed(1, 0.3, 200 * 1024)
+        self.assertEqual(self.controller.level, 1)
+        self.assertEqual(self.controller.capacity, 200 * 1024)
+        self.assertEqual(self.applied, 1)
+        self.assertEqual(self.controller.configured[-1], ("full", True))
+
+    def test_idle_link(self):
+        # Queueing delay without traffic isn't the updates' fault
+        self._feed(3, 0.02, 1024)
+        self._feed(10, 0.3, 1024)
+        self.assertEqual(self.controller.level, 0)
+
+    def test_raise(self):
+        self._feed(3, 0.02, 1024)
+        self._feed(3, 0.3, 200 * 1024)
+        self._feed(3, 0.3, 200 * 1024)
+        self.assertEqual(self.controller.level, 2)
+
+        # The next better level would need twice the rate: not while the
+        # link carries 80 kB/s, but at 40 kB/s
+        self._feed(10, 0.02, 80 * 1024)
+        self.assertEqual(self.controller.level, 2)
+        self._feed(5, 0.02, 40 * 1024)
+        self.assertEqual(self.controller.level, 2)
+        self._feed(1, 0.02, 40 * 1024)
+        self.assertEqual(self.controller.level, 1)
+
+    def test_no_link(self):
+        for _i in range(20):
+            self.controller._measured(10 * 1024 * 1024)
+        self.assertEqual(self.controller.level, 0)
+        self.assertEqual(self.status, "full  ~10240.0 kB/s")
+
+    def test_not_adaptive(self):
+        controller = _Controller(None, self._apply, depth="low", lossy=True)
+        for _i in range(20):
+            controller._measured(200 * 1024, (0.02 + _i, 200 * 1024))
+        self.assertEqual((controller.depth, controller.lossy), ("low", True))
+        self.assertEqual(self.applied, 0)
+
+    def test_min_change_interval(self):
+        self.controller.min_change_interval = 3600
+        self.controller._last_change = quality.time.monotonic()
+        self._feed(3, 0.02, 1024)
+        self._feed(10, 0.3, 200 * 1024)
+        self.assertEqual(self.controller.level, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018  Juerg Haefliger <juergh@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import unittest
+
+import numpy as np
+
+from bench.fakevnc import FakeVNC
+from vnc import rfb
+
+ENCODINGS = {
+    "raw": rfb.ENCODING_RAW,
+    "rre": rfb.ENCODING_RRE,
+    "hextile": rfb.ENCODING_HEXTILE,
+    "zrle": rfb.ENCODING_ZRLE,
+}
+
+
+def _test_image(width=160, height=96, seed=0):
+    """
+    An image that exercises all the subencodings: solid areas, two-colour
+    stripes, a few-colour checkerboard, runs of many colours and noise
+    """
+    rng = np.random.default_rng(seed)
+    fb = np.full((96, 160), 0x204080, dtype=np.uint32)
+    fb[8:40, 0:40] = np.where(np.arange(40) % 3, 0xffffff, 0x000000)
+    checker = (np.arange(24)[:, None] // 2 + np.arange(40) // 3) % 5
+    fb[40:64, 40:80] = np.array([0x000000, 0xff0000, 0x00ff00, 0x0000ff,
+                                 0xffff00], dtype=np.uint32)[checker]
+    runs = np.repeat(np.arange(200, dtype=np.uint32) * 0x010203, 4)
+    fb[0:64, 80:144] = np.resize(runs, (64, 64)) & 0xffffff
+    fb[64:96, 128:160] = rng.integers(0, 1 << 24, (32, 32), dtype=np.uint32)
+    fb[64:96, 0:64] = (np.arange(32)[:, None] + np.arange(64)) % 4 * 0x123456
+    return fb[:height, :width]
+
+
+class _FakeTestCase(unittest.TestCase):
+    def _fake(self, **kwargs):
+        fake = FakeVNC(**kwargs).start()
+        self.addCleanup(fake.stop)
+        return fake
+
+    def _client(self, fake, password=None, **kwargs):
+        client = rfb.RFBClient(fake.address, password, timeout=5, **kwargs)
+        client.connect()
+        self.addCleanup(client.close)
+        return client
+
+
+class TestHandshake(_FakeTestCase):
+    def test_no_password(self):
+        fake = self._fake(name="test")
+        client = self._client(fake)
+        self.assertEqual((client.width, client.height), (64, 48))
+        self.assertEqual(client.name, "test")
+
+    def test_password(self):
+        for minor in (3, 7, 8):
+            with self.subTest(minor=minor):
+                fake = self._fake(password="secret", minor=minor)
+                client = self._client(fake, "secret")
+                self.assertEqual(client.width, 64)
+
+    def test_wrong_password(self):
+        for minor in (3, 8):
+            with self.subTest(minor=minor):
+                fake = self._fake(password="secret", minor=minor)
+                client = rfb.RFBClient(fake.address, "wrong", timeout=5)
+                with self.assertRaises(rfb.RFBError):
+                    client.connect()
+                self.assertIsNone(client._sock)
+
+
+class TestDecoders(_FakeTestCase):
+    def _check(self, encoding):
+        fake = self._fake(width=160, height=96, encoding=encoding)
+        fake.framebuffer[:] = _test_image()
+        client = self._client(fake)
+
+        rects = client.update(incremental=False, timeout=5)
+        self.assertEqual(rects, [(0, 0, 160, 96)])
+        np.testing.assert_array_equal(client.framebuffer, fake.framebuffer)
+
+        # Incremental updates of parts of the framebuffer (and with ZRLE,
+        # more data from the same zlib stream)
+        for i, (x, y, w, h) in enumerate(((5, 7, 33, 20), (64, 32, 64, 64),
+                                          (150, 90, 10, 6))):
+            client.request_update()
+            fake.set_framebuffer(_test_image(seed=i + 1)[:h, :w], x, y)
+            rects = client.poll(5)
+            self.assertEqual(rects, [(x, y, w, h)])
+            np.testing.assert_array_equal(client.framebuffer,
+                                          fake.framebuffer)
+
+    def test_raw(self):
+        self._check(rfb.ENCODING_RAW)
+
+    def test_rre(self):
+        self._check(rfb.ENCODING_RRE)
+
+    def test_hextile(self):
+        self._check(rfb.ENCODING_HEXTILE)
+
+    def test_zrle(self):
+        self._check(rfb.ENCODING_ZRLE)
+
+    def test_unsupported_encoding(self):
+        # The fake falls back to Raw if the client doesn't announce ZRLE
+        fake = self._fake(encoding=rfb.ENCODING_ZRLE)
+        fake.framebuffer[:] = _test_image(64, 48)
+        client = self._client(fake, encodings=(rfb.ENCODING_RAW,))
+        client.update(incremental=False, timeout=5)
+        np.testing.assert_array_equal(client.framebuffer, fake.framebuffer)
+
+    def test_screenshot(self):
+        fake = self._fake(width=4, height=2)
+        fake.framebuffer[:] = 0x102030
+        client = self._client(fake)
+        client.update(incremental=False, timeout=5)
+        screenshot = client.screenshot()
+        self.assertEqual(screenshot.shape, (2, 4, 3))
+        self.assertEqual(screenshot[1, 3].tolist(), [0x10, 0x20, 0x30])
+
+
+class TestInput(_FakeTestCase):
+    def test_keys(self):
+        fake = self._fake()
+        client = self._client(fake)
+        client.send_keys((0xffe1, 0x61))
+        self.assertTrue(client.sync(5))
+        self.assertEqual(fake.events, [("key", 0xffe1, 1), ("key", 0x61, 1),
+                                       ("key", 0x61, 0),
+                                       ("key", 0xffe1, 0)])
+
+    def test_pointer(self):
+        fake = self._fake()
+        client = self._client(fake)
+        client.pointer(10, 20, 1)
+        self.assertTrue(client.sync(5))
+        self.assertEqual(fake.events, [("pointer", 1, 10, 20)])
+
+    def test_sync_skips_other_updates(self):
+        # The key press answers the pending incremental request, sync() has
+        # to wait for the answer to its own request
+        fake = self._fake(on_key=(10, 10, 8, 8))
+        client = self._client(fake)
+        client.update(incremental=False, timeout=5)
+        client.request_update()
+        client.send_keys((0x61,))
+        self.assertTrue(client.sync(5))
+        self.assertIsNone(client.poll(0.2))
+
+    def test_sync_waits_for_earlier_requests(self):
+        # The key press answers the pending incremental request with an
+        # update that covers the pixel sync() asks for, too
+        fake = self._fake(on_key=(0, 0, 8, 8))
+        client = self._client(fake)
+        client.update(incremental=False, timeout=5)
+        client.request_update()
+        client.send_keys((0x61,))
+        self.assertTrue(client.sync(5))
+        self.assertIsNone(client.poll(0.2))
+
+    def test_update_timeout(self):
+        fake = self._fake()
+        client = self._client(fake)
+        self.assertIsNone(client.update(timeout=0.2))
+
+
+if __name__ == "__main__":
+    unittest.main()
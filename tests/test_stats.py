@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018  Juerg Haefliger <juergh@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import socket
+import time
+import unittest
+
+from vnc import stats
+
+
+def _have_tcp_info():
+    with socket.socket() as sock:
+        return stats.tcp_info(sock) is not None
+
+
+@unittest.skipUnless(_have_tcp_info(), "no TCP_INFO")
+class TestLinkStats(unittest.TestCase):
+    def setUp(self):
+        server = socket.socket()
+        self.addCleanup(server.close)
+        server.bind(("127.0.0.1", 0))
+        server.listen()
+        self.port = server.getsockname()[1]
+        self.client = socket.create_connection(("127.0.0.1", self.port))
+        self.addCleanup(self.client.close)
+        self.peer, _addr = server.accept()
+        self.addCleanup(self.peer.close)
+
+    def test_find_socket(self):
+        sock = stats.find_socket("127.0.0.1", str(self.port))
+        self.assertIsNotNone(sock)
+        self.addCleanup(sock.close)
+        self.assertEqual(sock.getsockname(), self.client.getsockname())
+        self.assertIsNone(stats.find_socket("127.0.0.1", 1))
+
+    def test_sample(self):
+        link = stats.LinkStats(self.client)
+        self.assertIsNone(link.sample())
+        self.peer.sendall(b"x" * 100000)
+        time.sleep(0.1)
+        rtt, rate = link.sample()
+        self.assertGreater(rtt, 0)
+        self.assertGreater(rate, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018  Juerg Haefliger <juergh@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import os
+import struct
+import tempfile
+import unittest
+import zlib
+
+import numpy as np
+
+from vnc import utils
+
+
+def _chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + \
+        struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+
+class TestPNG(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, "test.png")
+        self.rgb = np.random.default_rng(0).integers(0, 256, (7, 5, 3),
+                                                     dtype=np.uint8)
+
+    def _write(self, data):
+        with open(self.path, "wb") as fh:
+            fh.write(data)
+
+    def _filtered(self, rgba=False):
+        """
+        A PNG file with every filter type, filtered by hand
+        """
+        height, width, _depth = self.rgb.shape
+        image = self.rgb
+        if rgba:
+            image = np.dstack((image, np.full((height, width), 255,
+                                              dtype=np.uint8)))
+        bpp = image.shape[2]
+        lines = image.reshape(height, width * bpp).astype(np.int16)
+        raw = b""
+        for y in range(height):
+            ftype = y % 5
+            line = lines[y]
+            prev = lines[y - 1] if y else np.zeros_like(line)
+            left = np.concatenate((np.zeros(bpp, dtype=np.int16),
+                                   line[:-bpp]))
+            upleft = np.concatenate((np.zeros(bpp, dtype=np.int16),
+                                     prev[:-bpp]))
+            if ftype == 1:
+                pred = left
+            elif ftype == 2:
+                pred = prev
+            elif ftype == 3:
+                pred = (left + prev) >> 1
+            elif ftype == 4:
+                p = left + prev - upleft
+                pa, pb, pc = (np.abs(p - left), np.abs(p - prev),
+                              np.abs(p - upleft))
+                pred = np.where((pa <= pb) & (pa <= pc), left,
+                                np.where(pb <= pc, prev, upleft))
+            else:
+                pred = 0
+            raw += bytes([ftype]) + ((line - pred) & 0xff).astype(
+                np.uint8).tobytes()
+        return b"\x89PNG\r\n\x1a\n" + \
+            _chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8,
+                                        6 if rgba else 2, 0, 0, 0)) + \
+            _chunk(b"IDAT", zlib.compress(raw)) + _chunk(b"IEND", b"")
+
+    def test_roundtrip(self):
+        utils.write_png(self.path, self.rgb)
+        np.testing.assert_array_equal(utils.read_png(self.path), self.rgb)
+
+    def test_filters(self):
+        for rgba in (False, True):
+            with self.subTest(rgba=rgba):
+                self._write(self._filtered(rgba))
+                np.testing.assert_array_equal(utils.read_png(self.path),
+                                              self.rgb)
+
+    def test_not_png(self):
+        self._write(b"GIF89a")
+        with self.assertRaises(ValueError):
+            utils.read_png(self.path)
+
+    def test_truncated(self):
+        utils.write_png(self.path, self.rgb)
+        with open(self.path, "rb") as fh:
+            data = fh.read()
+        # Cut in the IHDR chunk, between chunks, in the IDAT chunk and
+        # before the IEND chunk
+        for size in (8, 12, 20, 33, 45, len(data) - 12):
+            with self.subTest(size=size):
+                self._write(data[:size])
+                with self.assertRaisesRegex(ValueError, "truncated"):
+                    utils.read_png(self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018  Juerg Haefliger <juergh@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# VNC color depths, kept apart from vnc.quality so that the command line can
+# list them without loading GTK
+
+# Names of the GtkVnc color depths, see quality.gtk_depth
+NAMES = ("default", "full", "medium", "low", "ultra-low")
+
+# Bytes per pixel on the wire
+BPP = dict(zip(NAMES, (4, 4, 2, 1, 1)))
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018  Juerg Haefliger <juergh@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# Keysyms and text to keystroke translation
+
+# Some X11 keysyms
+KEY_BackSpace = 0xff08
+KEY_Tab = 0xff09
+KEY_Return = 0xff0d
+KEY_Escape = 0xff1b
+KEY_Delete = 0xffff
+KEY_Home = 0xff50
+KEY_Left = 0xff51
+KEY_Up = 0xff52
+KEY_Right = 0xff53
+KEY_Down = 0xff54
+KEY_Page_Up = 0xff55
+KEY_Page_Down = 0xff56
+KEY_End = 0xff57
+KEY_F1 = 0xffbe
+KEY_F12 = 0xffc9
+KEY_Shift_L = 0xffe1
+KEY_Control_L = 0xffe3
+KEY_Alt_L = 0xffe9
+
+_key_names = {
+    "backspace": KEY_BackSpace,
+    "tab": KEY_Tab,
+    "enter": KEY_Return,
+    "return": KEY_Return,
+    "esc": KEY_Escape,
+    "escape": KEY_Escape,
+    "del": KEY_Delete,
+    "delete": KEY_Delete,
+    "home": KEY_Home,
+    "left": KEY_Left,
+    "up": KEY_Up,
+    "right": KEY_Right,
+    "down": KEY_Down,
+    "pgup": KEY_Page_Up,
+    "pgdn": KEY_Page_Down,
+    "end": KEY_End,
+    "shift": KEY_Shift_L,
+    "ctrl": KEY_Control_L,
+    "alt": KEY_Alt_L,
+    "space": ord(" "),
+}
+_key_names.update(("f%d" % (i + 1), KEY_F1 + i) for i in range(12))
+
+
+def keysyms_from_string(keys):
+    """
+    Translate a key combination like 'ctrl-alt-del' or 'f12' to a list of
+    keysyms
+    """
+    keysyms = []
+    for name in keys.split("-"):
+        if name.lower() in _key_names:
+            keysyms.append(_key_names[name.lower()])
+        elif len(name) == 1:
+            keysyms.append(ord(name))
+        else:
+            raise ValueError("Invalid key: %s" % name)
+    return keysyms
+
+
+# Characters that need the shift key on a US keyboard. The keysym alone is
+# not enough for servers that translate keysyms to scancodes (like Intel
+# AMT), they need to see the shift key being pressed.
+US_SHIFTED = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZ~!@#$%^&*()_+{}|:"<>?')
+
+_char_keysyms = {
+    "\n": KEY_Return,
+    "\t": KEY_Tab,
+    "\b": KEY_BackSpace,
+    "\x1b": KEY_Escape,
+}
+
+
+def char_keysym(char):
+    """
+    Return the keysym of a character
+    """
+    if char in _char_keysyms:
+        return _char_keysyms[char]
+    code = ord(char)
+    if 0x20 <= code <= 0x7e or 0xa0 <= code <= 0xff:
+        # Latin-1 keysyms are identical to the code points
+        return code
+    if code > 0xff:
+        return 0x01000000 | code
+    raise ValueError("Cannot type character %r" % char)
+
+
+def strokes(text, shifted=US_SHIFTED):
+    """
+    Translate text to a list of keystrokes, each one a list of keysyms to
+    press in order (and release in reverse order)
+    """
+    result = []
+    for char in text.replace("\r\n", "\n"):
+        keysym = char_keysym(char)
+        if char in shifted:
+            result.append([KEY_Shift_L, keysym])
+        else:
+            result.append([keysym])
+    return result
+
+
+class Pacer():
+    """
+    Adaptive keystroke pacing
+
+    Keystrokes are sent in batches and the time the server takes to
+    process a batch is compared to the fastest round trip seen so far. The
+    difference is the time the keystrokes were queued up on the server.
+    While it stays below the target, the batch size grows by one keystroke.
+    Once the server falls behind (and would start dropping keys), the batch
+    size is halved and, at a batch size of one, the delay between batches
+    is doubled.
+    """
+    def __init__(self, batch=4, max_batch=64, target=0.025, max_delay=0.5):
+        self.batch = batch
+        self.max_batch = max_batch
+        self.target = target
+        self.max_delay = max_delay
+
+        self.delay = 0
+        self.base = None
+
+    def feedback(self, elapsed):
+        """
+        Adjust the pace after a batch took elapsed seconds to be processed
+        """
+        if self.base is None or elapsed < self.base:
+            self.base = elapsed
+
+        if elapsed - self.base <= self.target:
+            if self.delay:
+                self.delay = self.delay / 2 if self.delay > 0.01 else 0
+            else:
+                self.batch = min(self.batch + 1, self.max_batch)
+        elif self.batch > 1:
+            self.batch = max(self.batch // 2, 1)
+        else:
+            self.delay = min(max(self.delay * 2, 0.01), self.max_delay)
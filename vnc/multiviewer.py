@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018  Juerg Haefliger <juergh@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import logging
+
+import gi
+gi.require_version('Gtk', '3.0')
+
+from gi.repository import Gtk
+
+from vnc import task
+from vnc.statusicon import StatusIcon, STATUS_ERROR, STATUS_UNKNOWN
+from vnc.viewer import VNCViewer
+
+
+class _Tab(Gtk.HBox):
+    """
+    Notebook tab label with the per-session connection and power status
+    """
+    def __init__(self, viewer):
+        super(_Tab, self).__init__(spacing=4)
+
+        self.connection_status = StatusIcon(size=12)
+        self.connection_status.set_status(STATUS_ERROR)
+        self.pack_start(self.connection_status, False, False, 0)
+
+        self.power_status = StatusIcon(size=12)
+        self.power_status.set_status(STATUS_UNKNOWN)
+        if viewer.bmc:
+            self.pack_start(self.power_status, False, False, 0)
+
+        self.pack_start(Gtk.Label(viewer.host), False, False, 0)
+
+        close = Gtk.Button.new_from_icon_name("window-close",
+                                              Gtk.IconSize.MENU)
+        close.set_relief(Gtk.ReliefStyle.NONE)
+        close.connect("clicked", viewer.quit)
+        self.pack_start(close, False, False, 0)
+
+        self.show_all()
+
+    def set_status(self, connection, power):
+        self.connection_status.set_status(connection)
+        if power:
+            self.power_status.set_status(power)
+
+
+class MultiViewer():
+    """
+    Many VNC/AMT sessions, one per notebook tab, in a single window
+
+    All sessions share the main loop, the status icon pixbufs and the
+    background task executor.
+    """
+    def __init__(self, title="jvncviewer"):
+        self.viewers = []
+        self._tabs = {}
+
+        self.notebook = Gtk.Notebook()
+        self.notebook.set_scrollable(True)
+
+        self.window = Gtk.Window(title=title)
+        self.window.set_default_size(1024, 768)
+        self.window.add(self.notebook)
+        self.window.connect("destroy", self.quit)
+        self.window.show_all()
+
+    def _status(self, viewer, connection, power):
+        self._tabs[viewer].set_status(connection, power)
+
+    def _close(self, viewer):
+        logging.debug("Closing tab %s", viewer.host)
+        self.notebook.remove_page(self.notebook.page_num(viewer.layout))
+        self.viewers.remove(viewer)
+        del self._tabs[viewer]
+        if not self.viewers:
+            self.quit()
+
+    def add(self, host, password, bmc=None, **kwargs):
+        """
+        Add a session and connect it
+        """
+        viewer = VNCViewer(host, password, bmc=bmc, embedded=True, **kwargs)
+        viewer.on_status = self._status
+        viewer.on_quit = self._close
+
+        tab = _Tab(viewer)
+        self._tabs[viewer] = tab
+        self.viewers.append(viewer)
+        self.notebook.append_page(viewer.layout, tab)
+        self.notebook.set_tab_reorderable(viewer.layout, True)
+
+        viewer.connect()
+        return viewer
+
+    def quit(self, _src=None):
+        logging.debug("Quitting")
+        for viewer in self.viewers:
+            viewer.close()
+        task.shutdown()
+        Gtk.main_quit()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018  Juerg Haefliger <juergh@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import logging
+import time
+
+import gi
+gi.require_version('Gtk', '3.0')
+
+from gi.repository import Gtk
+from gi.repository import GdkPixbuf
+from gi.repository import GLib
+
+from vnc.recording import Player
+
+
+def _format_time(seconds):
+    seconds = int(seconds)
+    return "%d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60,
+                             seconds % 60)
+
+
+class PlayerWindow():
+    """
+    A small player for session recordings with a slider to seek
+    """
+    def __init__(self, path, speed=1.0, fps=10):
+        self.player = Player(path)
+        self.speed = speed
+
+        self.playing = False
+        self._position = 0
+        self._started = None
+        self._seeking = False
+
+        self.image = Gtk.Image()
+        scrolled = Gtk.ScrolledWindow()
+        scrolled.add(self.image)
+
+        self.button = Gtk.Button(label="Play")
+        self.button.connect("clicked", self._toggle)
+        self.scale = Gtk.Scale.new_with_range(Gtk.Orientation.HORIZONTAL, 0,
+                                              max(self.player.duration, 1),
+                                              1)
+        self.scale.set_draw_value(False)
+        self.scale.connect("value-changed", self._seek)
+        self.time = Gtk.Label()
+
+        controls = Gtk.HBox()
+        controls.pack_start(self.button, False, False, 5)
+        controls.pack_start(self.scale, True, True, 5)
+        controls.pack_start(self.time, False, False, 5)
+
+        layout = Gtk.VBox()
+        layout.pack_start(scrolled, True, True, 0)
+        layout.pack_end(controls, False, False, 0)
+
+        self.window = Gtk.Window(title="jvncviewer - %s" % path)
+        self.window.set_default_size(800, 600)
+        self.window.add(layout)
+        self.window.connect("destroy", self.quit)
+        self.window.show_all()
+
+        self.player.seek(0)
+        self._show_frame()
+        self._show_time(0)
+        GLib.timeout_add(int(1000 / fps), self._tick)
+
+    def _show_frame(self):
+        player = self.player
+        data = GLib.Bytes.new(bytes(player.framebuffer))
+        pixbuf = GdkPixbuf.Pixbuf.new_from_bytes(
+            data, GdkPixbuf.Colorspace.RGB, player.channels == 4, 8,
+            player.width, player.height, player.width * player.channels)
+        self.image.set_from_pixbuf(pixbuf)
+
+    def _show_time(self, position):
+        self.time.set_text("%s / %s" % (_format_time(position),
+                                        _format_time(self.player.duration)))
+
+    def _now(self):
+        if not self.playing:
+            return self._position
+        return self._position + (time.monotonic() - self._started) * self.speed
+
+    def _toggle(self, _src):
+        self._position = self._now()
+        if not self.playing and self._position >= self.player.duration:
+            # Start over
+            self._position = 0
+            self.player.seek(0)
+            self._show_frame()
+        self._started = time.monotonic()
+        self.playing = not self.playing
+        self.button.set_label("Pause" if self.playing else "Play")
+
+    def _seek(self, scale):
+        if self._seeking:
+            return
+        self._position = scale.get_value()
+        self._started = time.monotonic()
+        logging.debug("Seeking to %.1fs", self._position)
+        self.player.seek(self._position)
+        self._show_frame()
+        self._show_time(self._position)
+
+    def _tick(self):
+        if not self.playing:
+            return True
+
+        position = min(self._now(), self.player.duration)
+        if self.player.advance(position):
+            self._show_frame()
+        self._show_time(position)
+        if position >= self.player.duration:
+            self._toggle(None)
+
+        # Move the slider without seeking
+        self._seeking = True
+        self.scale.set_value(position)
+        self._seeking = False
+        return True
+
+    def quit(self, _src=None):
+        logging.debug("Quitting")
+        self.player.close()
+        Gtk.main_quit()
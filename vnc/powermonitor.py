@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018  Juerg Haefliger <juergh@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import logging
+
+from gi.repository import GLib
+
+from amt import scheduler
+from vnc import task
+
+
+class PowerMonitor():
+    """
+    Periodically query the power state of a host
+
+    There's at most one scheduled or running query at any time. The query
+    interval backs off (up to max_interval) while the host doesn't report a
+    valid power state. The callback is called on the main loop with the
+    power state. Queries go through the shared AMT scheduler, so they wait
+    for pending power state changes.
+    """
+    def __init__(self, bmc, callback, interval=10, max_interval=60,
+                 key=None):
+        self.bmc = bmc
+        self.callback = callback
+        self.interval = interval
+        self.max_interval = max_interval
+        self.key = key if key is not None else ("power-state", id(bmc))
+
+        self.running = False
+        self._delay = interval
+        self._source = None
+
+    def _cancel(self):
+        if self._source is not None:
+            GLib.source_remove(self._source)
+            self._source = None
+
+    def _schedule(self, delay):
+        self._cancel()
+        self._source = GLib.timeout_add(int(delay * 1000), self._query)
+
+    def _query(self):
+        self._source = None
+        task.submit(self._get_power_state, key=self.key,
+                    callback=self._result)
+        return False
+
+    def _get_power_state(self):
+        return scheduler.get_power_state(self.bmc)
+
+    def _result(self, future):
+        if not self.running or future.cancelled() or future.exception():
+            return
+
+        state = future.result()
+        if state in self.bmc.POWER_STATES:
+            self._delay = self.interval
+        else:
+            self._delay = min(self._delay * 2, self.max_interval)
+            logging.debug("No valid power state, next query in %ss",
+                          self._delay)
+
+        self.callback(state)
+        if self.running and self._source is None:
+            self._schedule(self._delay)
+
+    def start(self):
+        """
+        Start monitoring (or refresh if already running)
+        """
+        self.running = True
+        return self.refresh()
+
+    def stop(self):
+        """
+        Stop monitoring
+        """
+        self.running = False
+        self._cancel()
+
+    def refresh(self):
+        """
+        Query the power state right away
+        """
+        if self.running:
+            self._cancel()
+            self._delay = self.interval
+            self._query()
+        return False
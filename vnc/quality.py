@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018  Juerg Haefliger <juergh@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+import collections
+import logging
+import time
+
+from vnc import depths
+from vnc.stats import LinkStats, UpdateStats
+
+# Quality levels (color depth, lossy encoding), from best to worst
+LEVELS = (
+    ("full", False),
+    ("full", True),
+    ("medium", True),
+    ("low", True),
+    ("ultra-low", True),
+)
+
+
+def describe(depth, lossy):
+    return "%s%s" % (depth, "/lossy" if lossy else "")
+
+
+def gtk_depth(name):
+    """
+    Return the GtkVnc color depth of a depth name
+    """
+    from gi.repository import GtkVnc   # pylint: disable=import-outside-toplevel
+
+    return getattr(GtkVnc.DisplayDepthColor, name.upper().replace("-", "_"))
+
+
+class QualityController():
+    """
+    Adapt the color depth and lossy encoding of a VNC display to the link
+
+    Every interval seconds, the round trip time and the received bytes of
+    the session's TCP connection are sampled (from the kernel, see
+    stats.LinkStats). The lowest round trip time of the last rtt_window
+    samples is taken as the delay of the idle link, anything above it is
+    queueing. A link that can't keep up with the updates queues them, so if
+    the queueing delay stays above max_delay for drop_after samples in a
+    row while data is flowing (above min_rate), the quality is dropped one
+    level and the rate the link carried is remembered. If the link doesn't
+    queue and the rate the next better level would need (estimated from the
+    bytes per pixel) fits below that rate with headroom for raise_after
+    samples, the quality is raised one level again. Without link statistics
+    (no TCP_INFO), the quality isn't adapted.
+
+    No extra connections to the server are made. gtk-vnc negotiates the
+    pixel format and encodings when connecting, so a change is applied by
+    the apply callback (which reconnects).
+    """
+    def __init__(self, display, apply, status=None, depth="default",
+                 lossy=False, adaptive=False, interval=5, min_rate=16 * 1024,
+                 max_delay=0.1, rtt_window=60, drop_after=3, headroom=1.5,
+                 raise_after=6, min_change_interval=30):
+        self.display = display
+        self.apply = apply
+        self.status = status
+        self.interval = interval
+        self.min_rate = min_rate
+        self.max_delay = max_delay
+        self.drop_after = drop_after
+        self.headroom = headroom
+        self.raise_after = raise_after
+        self.min_change_interval = min_change_interval
+        self.adaptive = adaptive
+
+        self.level = 0
+        self.depth = depth
+        self.lossy = lossy
+        if adaptive:
+            self.depth, self.lossy = LEVELS[0]
+        self._configure()
+
+        self.stats = UpdateStats()
+        self.link = None
+        self.throughput = 0
+        self.rtt = None
+        self.rate = None
+        # The rate at which the link last started to queue
+        self.capacity = None
+        self._rtts = collections.deque(maxlen=rtt_window)
+        self._queued = 0
+        self._good = 0
+        self._last_change = 0
+        self._source = None
+
+    def _configure(self):
+        self.display.set_depth(gtk_depth(self.depth))
+        self.display.set_lossy_encoding(self.lossy)
+
+    def _status(self):
+        if not self.status:
+            return
+        if self.rtt is None:
+            # Only the estimate from the redrawn area is known
+            self.status("%s  ~%.1f kB/s" % (describe(self.depth, self.lossy),
+                                            self.throughput / 1024))
+        else:
+            self.status("%s  %.1f kB/s  %.0f ms" %
+                        (describe(self.depth, self.lossy), self.rate / 1024,
+                         self.rtt * 1000))
+
+    def _set_level(self, level):
+        self.depth, self.lossy = LEVELS[level]
+        logging.info("Switching to %s (%.1f kB/s, %.0f ms)",
+                     describe(self.depth, self.lossy), self.rate / 1024,
+                     self.rtt * 1000)
+        self.level = level
+        self._queued = 0
+        self._good = 0
+        self._last_change = time.monotonic()
+        self._configure()
+        self.apply()
+
+    def _measured(self, throughput, link=None):
+        """
+        Process a sample: the estimated update throughput and the round
+        trip time and receive rate of the link (None if unknown)
+        """
+        self.throughput = throughput
+        self.rtt, self.rate = link if link else (None, None)
+        self._status()
+
+        if not self.adaptive or link is None:
+            return
+
+        rtt, rate = link
+        self._rtts.append(rtt)
+        delay = rtt - min(self._rtts)
+
+        if rate >= self.min_rate and delay > self.max_delay:
+            self._queued += 1
+        else:
+            self._queued = 0
+
+        # The rate the next better level would need for the same updates
+        good = False
+        if self.level > 0 and delay <= self.max_delay / 2:
+            depth, _lossy = LEVELS[self.level - 1]
+            needed = rate * depths.BPP[depth] / depths.BPP[self.depth]
+            good = self.capacity is None or \
+                needed * self.headroom < self.capacity
+        self._good = self._good + 1 if good else 0
+
+        if time.monotonic() - self._last_change < self.min_change_interval:
+            return
+
+        if self._queued >= self.drop_after and self.level < len(LEVELS) - 1:
+            self.capacity = rate
+            self._set_level(self.level + 1)
+        elif self._good >= self.raise_after:
+            self._set_level(self.level - 1)
+
+    def _sample(self):
+        _updates, throughput = self.stats.rates()
+        self._measured(throughput, self.link.sample() if self.link else None)
+        return True
+
+    def add_update(self, pixels):
+        """
+        Account for a framebuffer update
+        """
+        self.stats.add(pixels, depths.BPP[self.depth])
+
+    def start(self, sock=None):
+        """
+        Start sampling, sock is the session's TCP connection (if known)
+        """
+        from gi.repository import GLib   # pylint: disable=import-outside-toplevel
+
+        if self._source is not None:
+            if sock is not None:
+                sock.close()
+            return
+
+        self.stats.rates()
+        if sock is not None:
+            self.link = LinkStats(sock)
+            self.link.sample()
+        self._source = GLib.timeout_add_seconds(self.interval, self._sample)
+
+    def stop(self):
+        from gi.repository import GLib   # pylint: disable=import-outside-toplevel
+
+        if self._source is not None:
+            GLib.source_remove(self._source)
+            self._source = None
+        if self.link is not None:
+            self.link.close()
+            self.link = None
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018  Juerg Haefliger <juergh@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import logging
+import random
+import time
+
+from gi.repository import Gio
+from gi.repository import GLib
+
+
+def probe(host, port, callback, timeout=2, cancellable=None):
+    """
+    Probe a TCP port without blocking the main loop. The callback is called
+    with a success flag, the time the probe took and an error message.
+    """
+    def _probed(client, result, start):
+        try:
+            conn = client.connect_to_host_finish(result)
+            conn.close(None)
+        except GLib.Error as e:
+            if cancellable is None or not cancellable.is_cancelled():
+                callback(False, time.monotonic() - start, e.message)
+            return
+        callback(True, time.monotonic() - start, None)
+
+    client = Gio.SocketClient()
+    client.set_timeout(timeout)
+    client.connect_to_host_async(host, int(port), cancellable, _probed,
+                                 time.monotonic())
+
+
+class Reconnector():
+    """
+    Reconnect to a VNC server with exponential backoff and jitter
+
+    Before every attempt, the server port is probed with a cheap
+    non-blocking TCP connect and the (expensive) VNC connection is only
+    established once the port answers. The status callback is called with a
+    short message whenever the reconnect state changes.
+
+    Reconnects can be paused (e.g., while the host is powered off), in
+    which case a scheduled attempt is held back until they're resumed.
+    """
+    def __init__(self, host, port, connect, status=None, initial=0.5,
+                 maximum=30, factor=2, jitter=0.25, probe_timeout=2):
+        self.host = host
+        self.port = int(port)
+        self.connect = connect
+        self.status = status
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.probe_timeout = probe_timeout
+
+        self.attempts = 0
+        self.started = None
+        self.paused = False
+        self._held = False
+        self._delay = 0
+        self._source = None
+        self._cancellable = None
+
+    def _status(self, msg):
+        if self.status:
+            self.status(msg)
+
+    def _next_delay(self):
+        delay = self._delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+        self._delay = min(max(self._delay * self.factor, self.initial),
+                          self.maximum)
+        return delay
+
+    def _probe(self):
+        self._source = None
+        self.attempts += 1
+        logging.debug("Probing %s:%s (attempt %d)", self.host, self.port,
+                      self.attempts)
+
+        self._cancellable = Gio.Cancellable()
+        probe(self.host, self.port, self._probed, timeout=self.probe_timeout,
+              cancellable=self._cancellable)
+        return False
+
+    def _probed(self, ok, _elapsed, error):
+        self._cancellable = None
+        if not ok:
+            delay = self._next_delay()
+            logging.debug("Probe of %s:%s failed (%s), next attempt in "
+                          "%.1fs", self.host, self.port, error, delay)
+            self._status("Reconnecting (attempt %d, next in %.0fs)" %
+                         (self.attempts, delay))
+            self._source = GLib.timeout_add(int(delay * 1000), self._probe)
+            return
+
+        logging.debug("%s:%s is answering, reconnecting", self.host,
+                      self.port)
+        self._status("Reconnecting (attempt %d)" % self.attempts)
+        self.connect()
+
+    def schedule(self):
+        """
+        Schedule the next reconnect attempt
+        """
+        self.cancel()
+        if self.started is None:
+            self.started = time.monotonic()
+            self.attempts = 0
+            self._delay = 0
+        if self.paused:
+            logging.debug("Reconnects to %s:%s are paused", self.host,
+                          self.port)
+            self._held = True
+            return
+        delay = self._next_delay()
+        self._source = GLib.timeout_add(int(delay * 1000), self._probe)
+
+    def cancel(self):
+        """
+        Cancel a pending reconnect attempt
+        """
+        if self._source is not None:
+            GLib.source_remove(self._source)
+            self._source = None
+        if self._cancellable is not None:
+            self._cancellable.cancel()
+            self._cancellable = None
+
+    def pause(self, msg=None):
+        """
+        Pause reconnecting, a pending attempt is held back until resume()
+        """
+        if self.paused:
+            return
+        self.paused = True
+        if self._source is not None or self._cancellable is not None:
+            self._held = True
+            self.cancel()
+        if msg:
+            self._status(msg)
+
+    def resume(self):
+        """
+        Resume reconnecting, a held back attempt is made right away
+        """
+        if not self.paused:
+            return
+        self.paused = False
+        if self._held:
+            self._held = False
+            # Whatever kept the server away is gone, so start over with the
+            # shortest delay
+            self._delay = 0
+            self.schedule()
+
+    def connected(self):
+        """
+        Notify the reconnector that the connection has been established
+        """
+        self._held = False
+        self.cancel()
+        if self.started is not None:
+            elapsed = time.monotonic() - self.started
+            logging.info("Reconnected to %s:%s after %d attempt(s) in %.1fs",
+                         self.host, self.port, max(self.attempts, 1), elapsed)
+            self._status("Reconnected in %.1fs" % elapsed)
+        self.started = None
@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018  Juerg Haefliger <juergh@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# Console session recordings
+#
+# A recording starts with a header (magic and start time) followed by
+# records. Every record has a header (type, timestamp in seconds since the
+# start and payload length) and a zlib-compressed payload:
+#
+#   keyframe:  width, height, channels, all pixels
+#   delta:     number of rectangles, (x, y, w, h, pixels) per rectangle
+#   index:     (timestamp, offset) of every keyframe
+#
+# The index is written when the recording is closed, followed by a footer
+# with its offset. Recordings without an index (e.g., after a crash) are
+# still playable, the player then scans the record headers instead.
+
+import logging
+import queue
+import struct
+import threading
+import time
+import zlib
+
+MAGIC = b"JVNCREC1"
+FOOTER_MAGIC = b"JVNCIDX1"
+
+RECORD_KEYFRAME = 1
+RECORD_DELTA = 2
+RECORD_INDEX = 3
+
+_HEADER = struct.Struct(">8sd")
+_RECORD = struct.Struct(">BdI")
+_FOOTER = struct.Struct(">Q8s")
+_KEYFRAME = struct.Struct(">HHB")
+_RECT = struct.Struct(">HHHH")
+_INDEX_ENTRY = struct.Struct(">dQ")
+
+
+def _pack(pixels, width, height, channels, rowstride):
+    """
+    Strip the row padding off the pixels
+    """
+    stride = width * channels
+    if rowstride == stride:
+        return bytes(pixels[:stride * height])
+    return b"".join(pixels[row * rowstride:row * rowstride + stride]
+                    for row in range(height))
+
+
+def _crop(frame, width, channels, x, y, w, h):
+    stride = width * channels
+    return b"".join(frame[(y + row) * stride + x * channels:
+                          (y + row) * stride + (x + w) * channels]
+                    for row in range(h))
+
+
+def _paste(frame, width, channels, x, y, w, h, data):
+    stride = width * channels
+    line = w * channels
+    for row in range(h):
+        start = (y + row) * stride + x * channels
+        frame[start:start + line] = data[row * line:(row + 1) * line]
+
+
+def changed_tiles(prev, frame, width, height, channels, tile=64):
+    """
+    Compare two frames and return the changed tiles as (x, y, w, h)
+    rectangles, adjacent tiles in a row are merged
+    """
+    stride = width * channels
+    rects = []
+    for y in range(0, height, tile):
+        h = min(tile, height - y)
+        band = slice(y * stride, (y + h) * stride)
+        if prev[band] == frame[band]:
+            continue
+
+        start = None
+        for x in range(0, width, tile):
+            w = min(tile, width - x)
+            dirty = any(
+                prev[(y + r) * stride + x * channels:
+                     (y + r) * stride + (x + w) * channels] !=
+                frame[(y + r) * stride + x * channels:
+                      (y + r) * stride + (x + w) * channels]
+                for r in range(h))
+            if dirty and start is None:
+                start = x
+            elif not dirty and start is not None:
+                rects.append((start, y, x - start, h))
+                start = None
+        if start is not None:
+            rects.append((start, y, width - start, h))
+    return rects
+
+
+class Recorder():
+    """
+    Record a session to a file
+
+    Frames are handed over with add(), which never blocks: the comparison
+    with the previous frame, compression and disk I/O all happen in a
+    background writer thread. If the writer falls behind, frames are
+    dropped and the next frame is written as a keyframe.
+    """
+    def __init__(self, path, keyframe_interval=60, max_pending=4, tile=64,
+                 level=6):
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        self.tile = tile
+        self.level = level
+
+        self.frames = 0
+        self.dropped = 0
+        self.bytes = 0
+
+        self._start = time.monotonic()
+        self._index = []
+        self._prev = None
+        self._geometry = None
+        self._last_keyframe = None
+        self._resync = False
+
+        self._fh = open(path, "wb")
+        self._fh.write(_HEADER.pack(MAGIC, time.time()))
+        self._queue = queue.Queue(max_pending)
+        self._thread = threading.Thread(target=self._run,
+                                        name="vnc-recorder", daemon=True)
+        self._thread.start()
+
+    def add(self, width, height, channels, rowstride, pixels):
+        """
+        Queue a frame (a copy of the framebuffer pixels) for recording
+        """
+        try:
+            self._queue.put_nowait((time.monotonic() - self._start, width,
+                                    height, channels, rowstride, pixels))
+        except queue.Full:
+            self.dropped += 1
+            self._resync = True
+
+    def _write(self, kind, timestamp, payload):
+        payload = zlib.compress(payload, self.level)
+        offset = self._fh.tell()
+        self._fh.write(_RECORD.pack(kind, timestamp, len(payload)))
+        self._fh.write(payload)
+        self.bytes += _RECORD.size + len(payload)
+        return offset
+
+    def _frame(self, timestamp, width, height, channels, rowstride, pixels):
+        frame = _pack(pixels, width, height, channels, rowstride)
+        geometry = (width, height, channels)
+
+        if self._resync or geometry != self._geometry or \
+           timestamp - self._last_keyframe >= self.keyframe_interval:
+            self._resync = False
+            offset = self._write(RECORD_KEYFRAME, timestamp,
+                                 _KEYFRAME.pack(width, height, channels) +
+                                 frame)
+            self._index.append((timestamp, offset))
+            self._last_keyframe = timestamp
+        else:
+            rects = changed_tiles(self._prev, frame, width, height, channels,
+                                  self.tile)
+            if not rects:
+                return
+            payload = [struct.pack(">H", len(rects))]
+            for rect in rects:
+                payload.append(_RECT.pack(*rect))
+                payload.append(_crop(frame, width, channels, *rect))
+            self._write(RECORD_DELTA, timestamp, b"".join(payload))
+
+        self._prev = frame
+        self._geometry = geometry
+        self.frames += 1
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                self._frame(*item)
+            except Exception as e:   # pylint: disable=broad-except
+                logging.error("Recording to %s failed: %s", self.path, e)
+                self._resync = True
+
+    def close(self):
+        """
+        Flush pending frames and write the index
+        """
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+        offset = self._write(RECORD_INDEX, time.monotonic() - self._start,
+                             b"".join(_INDEX_ENTRY.pack(*entry)
+                                      for entry in self._index))
+        self._fh.write(_FOOTER.pack(offset, FOOTER_MAGIC))
+        self._fh.close()
+        logging.info("Recorded %d frames (%d dropped, %d keyframes, %.1f MB) "
+                     "to %s", self.frames, self.dropped, len(self._index),
+                     self.bytes / 1024 / 1024, self.path)
+
+
+class Player():
+    """
+    Play back a recording
+
+    The framebuffer is a bytearray of packed pixels (width x height x
+    channels). seek() jumps to the closest keyframe before the requested
+    time and applies the deltas from there.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._fh = open(path, "rb")
+
+        magic, self.start_time = _HEADER.unpack(self._fh.read(_HEADER.size))
+        if magic != MAGIC:
+            raise ValueError("%s: not a recording" % path)
+
+        self.index = self._read_index()
+        if not self.index:
+            raise ValueError("%s: no keyframes" % path)
+        self.duration = self._duration
+
+        self.timestamp = None
+        self._next = self.index[0][1]
+        self.width = 0
+        self.height = 0
+        self.channels = 0
+        self.framebuffer = None
+
+    def _records(self, offset):
+        """
+        Iterate over the record headers starting at offset
+        """
+        self._fh.seek(offset)
+        while True:
+            header = self._fh.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                return
+            kind, timestamp, length = _RECORD.unpack(header)
+            yield offset, kind, timestamp, length
+            offset += _RECORD.size + length
+            self._fh.seek(offset)
+
+    def _read_index(self):
+        self._fh.seek(0, 2)
+        size = self._fh.tell()
+        if size >= _HEADER.size + _FOOTER.size:
+            self._fh.seek(size - _FOOTER.size)
+            offset, magic = _FOOTER.unpack(self._fh.read(_FOOTER.size))
+            if magic == FOOTER_MAGIC:
+                self._fh.seek(offset)
+                _kind, self._duration, length = _RECORD.unpack(
+                    self._fh.read(_RECORD.size))
+                data = zlib.decompress(self._fh.read(length))
+                return [_INDEX_ENTRY.unpack_from(data, pos)
+                        for pos in range(0, len(data), _INDEX_ENTRY.size)]
+
+        # No index, scan the record headers
+        logging.debug("%s has no index, scanning it", self.path)
+        index = []
+        self._duration = 0
+        for offset, kind, timestamp, _length in self._records(_HEADER.size):
+            if kind == RECORD_KEYFRAME:
+                index.append((timestamp, offset))
+            if kind in (RECORD_KEYFRAME, RECORD_DELTA):
+                self._duration = timestamp
+        return index
+
+    def _payload(self, length):
+        data = self._fh.read(length)
+        if len(data) < length:
+            raise EOFError("Truncated record")
+        return zlib.decompress(data)
+
+    def _apply(self, kind, timestamp, data):
+        if kind == RECORD_KEYFRAME:
+            self.width, self.height, self.channels = \
+                _KEYFRAME.unpack_from(data)
+            self.framebuffer = bytearray(data[_KEYFRAME.size:])
+        elif kind == RECORD_DELTA:
+            (count,) = struct.unpack_from(">H", data)
+            pos = 2
+            for _i in range(count):
+                x, y, w, h = _RECT.unpack_from(data, pos)
+                pos += _RECT.size
+                size = w * h * self.channels
+                _paste(self.framebuffer, self.width, self.channels, x, y, w,
+                       h, data[pos:pos + size])
+                pos += size
+        self.timestamp = timestamp
+
+    def _step(self, until=None):
+        """
+        Apply the next record if it's a frame at or before until, return its
+        timestamp or None
+        """
+        self._fh.seek(self._next)
+        header = self._fh.read(_RECORD.size)
+        if len(header) < _RECORD.size:
+            return None
+        kind, timestamp, length = _RECORD.unpack(header)
+        if kind not in (RECORD_KEYFRAME, RECORD_DELTA) or \
+           (until is not None and timestamp > until):
+            return None
+        try:
+            self._apply(kind, timestamp, self._payload(length))
+        except (EOFError, zlib.error):
+            return None
+        self._next += _RECORD.size + length
+        return timestamp
+
+    def frames(self, start=0, end=None):
+        """
+        Iterate over the frames from start to end (in seconds), yields the
+        timestamp of every frame, the frame is in self.framebuffer
+        """
+        self.seek(start)
+        yield self.timestamp
+        while True:
+            timestamp = self._step(end)
+            if timestamp is None:
+                return
+            yield timestamp
+
+    def advance(self, until):
+        """
+        Apply all frames up to until, return the number of frames applied
+        """
+        count = 0
+        while self._step(until) is not None:
+            count += 1
+        return count
+
+    def seek(self, timestamp):
+        """
+        Jump to the last frame at or before timestamp (or the first frame)
+        """
+        self._next = self.index[0][1]
+        for keyframe, offset in self.index:
+            if keyframe > timestamp:
+                break
+            self._next = offset
+        self._step()
+        self.advance(timestamp)
+        return self.timestamp
+
+    def close(self):
+        self._fh.close()
@@ -0,0 +1,511 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018  Juerg Haefliger <juergh@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# Headless RFB (VNC) protocol client with a NumPy framebuffer
+
+import logging
+import select
+import socket
+import struct
+import time
+import zlib
+
+import numpy as np
+
+from vnc import des
+from vnc import keyboard
+from vnc.utils import parse_host
+
+# Encodings
+ENCODING_RAW = 0
+ENCODING_COPYRECT = 1
+ENCODING_RRE = 2
+ENCODING_HEXTILE = 5
+ENCODING_ZRLE = 16
+ENCODING_DESKTOP_SIZE = -223
+
+ENCODINGS = (ENCODING_ZRLE, ENCODING_HEXTILE, ENCODING_RRE,
+             ENCODING_COPYRECT, ENCODING_RAW, ENCODING_DESKTOP_SIZE)
+
+# 32 bits per pixel, depth 24, little endian, true color, RGB888, i.e., the
+# framebuffer is a height x width array of 0x00RRGGBB uint32 values
+_PIXEL_FORMAT = struct.pack(">BBBBHHHBBB3x", 32, 24, 0, 1, 255, 255, 255, 16,
+                            8, 0)
+
+# Hextile subencoding flags
+_HEXTILE_RAW = 1
+_HEXTILE_BACKGROUND = 2
+_HEXTILE_FOREGROUND = 4
+_HEXTILE_SUBRECTS = 8
+_HEXTILE_COLOURED = 16
+
+
+class RFBError(Exception):
+    pass
+
+
+def _cpixels(data):
+    """
+    Convert 3-byte ZRLE CPIXELs to 32-bit pixels
+    """
+    buf = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.uint32)
+    return buf[:, 0] | (buf[:, 1] << 8) | (buf[:, 2] << 16)
+
+
+def _key_events(keysyms):
+    """
+    Key events to press the keys in order and release them in reverse order
+    """
+    data = b"".join(struct.pack(">BBxxI", 4, 1, k) for k in keysyms)
+    data += b"".join(struct.pack(">BBxxI", 4, 0, k) for k in reversed(keysyms))
+    return data
+
+
+class RFBClient():
+    """
+    A headless RFB client
+
+    The framebuffer is kept in a NumPy array (self.framebuffer, height x
+    width uint32 0x00RRGGBB) and updated with vectorized operations where
+    the encoding allows it.
+    """
+    def __init__(self, host, password=None, shared=True, timeout=10,
+                 encodings=ENCODINGS):
+        self.host, self.port = parse_host(host)
+        self.password = password
+        self.shared = shared
+        self.timeout = timeout
+        self.encodings = encodings
+
+        self.width = 0
+        self.height = 0
+        self.name = None
+        self.framebuffer = None
+
+        self._sock = None
+        self._buf = bytearray()
+        self._zlib = None
+        # Update requests that haven't been answered yet
+        self._requested = 0
+
+    # -------------------------------------------------------------------------
+    # Low-level I/O
+
+    def _fill(self, n):
+        while len(self._buf) < n:
+            data = self._sock.recv(max(n - len(self._buf), 65536))
+            if not data:
+                raise RFBError("Connection closed by server")
+            self._buf += data
+
+    def _read(self, n):
+        self._fill(n)
+        data = bytes(self._buf[:n])
+        del self._buf[:n]
+        return data
+
+    def _unpack(self, fmt):
+        return struct.unpack(fmt, self._read(struct.calcsize(fmt)))
+
+    def _send(self, data):
+        self._sock.sendall(data)
+
+    def _wait(self, timeout):
+        if self._buf:
+            return True
+        readable, _w, _x = select.select([self._sock], [], [], timeout)
+        return bool(readable)
+
+    # -------------------------------------------------------------------------
+    # Handshake
+
+    def _reason(self):
+        (length,) = self._unpack(">I")
+        return self._read(length).decode(errors="replace")
+
+    def _authenticate(self):
+        challenge = self._read(16)
+        key = (self.password or "").encode()[:8].ljust(8, b"\x00")
+        # VNC uses the bits of each key byte in reverse order
+        key = bytes(int("{:08b}".format(b)[::-1], 2) for b in key)
+        self._send(des.encrypt(key, challenge))
+
+    def _handshake(self):
+        version = self._read(12)
+        if not version.startswith(b"RFB "):
+            raise RFBError("Not an RFB server: %r" % version)
+        major, minor = int(version[4:7]), int(version[8:11])
+        minor = 8 if (major, minor) >= (3, 8) else 7 if minor >= 7 else 3
+        self._send(b"RFB 003.%03d\n" % minor)
+        logging.debug("RFB protocol version 3.%d", minor)
+
+        if minor == 3:
+            (sec_type,) = self._unpack(">I")
+            if sec_type == 0:
+                raise RFBError(self._reason())
+        else:
+            (count,) = self._unpack(">B")
+            if count == 0:
+                raise RFBError(self._reason())
+            types = self._read(count)
+            if 2 in types and (self.password or 1 not in types):
+                sec_type = 2
+            elif 1 in types:
+                sec_type = 1
+            else:
+                raise RFBError("No supported security type in %s" %
+                               list(types))
+            self._send(struct.pack(">B", sec_type))
+
+        if sec_type == 2:
+            self._authenticate()
+        elif sec_type != 1:
+            raise RFBError("Unsupported security type %d" % sec_type)
+
+        if sec_type == 2 or minor == 8:
+            (result,) = self._unpack(">I")
+            if result:
+                reason = self._reason() if minor == 8 else ""
+                raise RFBError("Authentication failure: %s" % reason)
+
+        self._send(struct.pack(">B", 1 if self.shared else 0))
+        width, height, _pixel_format, name_len = self._unpack(">HH16sI")
+        self.name = self._read(name_len).decode(errors="replace")
+        self._resize(width, height)
+
+        self._send(b"\x00\x00\x00\x00" + _PIXEL_FORMAT)
+        self._send(struct.pack(">BxH%di" % len(self.encodings), 2,
+                               len(self.encodings), *self.encodings))
+
+    def _resize(self, width, height):
+        logging.debug("Framebuffer size: %dx%d", width, height)
+        self.width = width
+        self.height = height
+        self.framebuffer = np.zeros((height, width), dtype=np.uint32)
+
+    # -------------------------------------------------------------------------
+    # Rectangle decoders
+
+    def _pixels(self, count):
+        return np.frombuffer(self._read(count * 4), dtype="<u4")
+
+    def _raw(self, x, y, w, h):
+        self.framebuffer[y:y + h, x:x + w] = self._pixels(w * h).reshape(h, w)
+
+    def _copyrect(self, x, y, w, h):
+        sx, sy = self._unpack(">HH")
+        self.framebuffer[y:y + h, x:x + w] = \
+            self.framebuffer[sy:sy + h, sx:sx + w].copy()
+
+    def _rre(self, x, y, w, h):
+        (count,) = self._unpack(">I")
+        fb = self.framebuffer
+        fb[y:y + h, x:x + w] = self._pixels(1)[0]
+        subrects = np.frombuffer(self._read(count * 12), dtype=np.dtype(
+            [("pixel", "<u4"), ("x", ">u2"), ("y", ">u2"), ("w", ">u2"),
+             ("h", ">u2")]))
+        for pixel, sx, sy, sw, sh in subrects.tolist():
+            fb[y + sy:y + sy + sh, x + sx:x + sx + sw] = pixel
+
+    def _hextile(self, x, y, w, h):
+        fb = self.framebuffer
+        bg = fg = 0
+        for ty in range(y, y + h, 16):
+            th = min(16, y + h - ty)
+            for tx in range(x, x + w, 16):
+                tw = min(16, x + w - tx)
+                (flags,) = self._unpack(">B")
+
+                if flags & _HEXTILE_RAW:
+                    self._raw(tx, ty, tw, th)
+                    continue
+
+                if flags & _HEXTILE_BACKGROUND:
+                    bg = self._pixels(1)[0]
+                if flags & _HEXTILE_FOREGROUND:
+                    fg = self._pixels(1)[0]
+                fb[ty:ty + th, tx:tx + tw] = bg
+
+                if not flags & _HEXTILE_SUBRECTS:
+                    continue
+                (count,) = self._unpack(">B")
+                if flags & _HEXTILE_COLOURED:
+                    subrects = np.frombuffer(self._read(count * 6),
+                                             dtype=np.dtype([("pixel", "<u4"),
+                                                             ("xy", "u1"),
+                                                             ("wh", "u1")]))
+                    pixels = subrects["pixel"].tolist()
+                else:
+                    subrects = np.frombuffer(self._read(count * 2),
+                                             dtype=np.dtype([("xy", "u1"),
+                                                             ("wh", "u1")]))
+                    pixels = [fg] * count
+                for pixel, xy, wh in zip(pixels, subrects["xy"].tolist(),
+                                         subrects["wh"].tolist()):
+                    sx, sy = tx + (xy >> 4), ty + (xy & 0xf)
+                    fb[sy:sy + (wh & 0xf) + 1, sx:sx + (wh >> 4) + 1] = pixel
+
+    def _zrle(self, x, y, w, h):
+        (length,) = self._unpack(">I")
+        if self._zlib is None:
+            # A single zlib stream is used for the whole connection
+            self._zlib = zlib.decompressobj()
+        data = self._zlib.decompress(self._read(length))
+
+        fb = self.framebuffer
+        pos = 0
+        for ty in range(y, y + h, 64):
+            th = min(64, y + h - ty)
+            for tx in range(x, x + w, 64):
+                tw = min(64, x + w - tx)
+                npix = tw * th
+                sub = data[pos]
+                pos += 1
+
+                if sub == 0:
+                    # Raw CPIXELs
+                    fb[ty:ty + th, tx:tx + tw] = \
+                        _cpixels(data[pos:pos + npix * 3]).reshape(th, tw)
+                    pos += npix * 3
+
+                elif sub == 1:
+                    # Solid tile
+                    fb[ty:ty + th, tx:tx + tw] = _cpixels(data[pos:pos + 3])[0]
+                    pos += 3
+
+                elif sub <= 16:
+                    # Packed palette
+                    palette = _cpixels(data[pos:pos + sub * 3])
+                    pos += sub * 3
+                    bits = 1 if sub == 2 else 2 if sub <= 4 else 4
+                    row_bytes = (tw * bits + 7) // 8
+                    packed = np.frombuffer(data, dtype=np.uint8,
+                                           count=row_bytes * th, offset=pos)
+                    pos += row_bytes * th
+                    unpacked = np.unpackbits(packed.reshape(th, row_bytes),
+                                             axis=1)
+                    idx = unpacked.reshape(th, -1, bits)
+                    idx = idx.dot(1 << np.arange(bits - 1, -1, -1))
+                    fb[ty:ty + th, tx:tx + tw] = palette[idx[:, :tw]]
+
+                elif sub == 128 or sub >= 130:
+                    # Plain or palette RLE
+                    palette = None
+                    if sub >= 130:
+                        palette = _cpixels(data[pos:pos + (sub - 128) * 3])
+                        pos += (sub - 128) * 3
+                    pixels, runs, pos = self._zrle_runs(data, pos, npix,
+                                                        palette)
+                    fb[ty:ty + th, tx:tx + tw] = \
+                        np.repeat(pixels, runs).reshape(th, tw)
+
+                else:
+                    raise RFBError("Invalid ZRLE subencoding %d" % sub)
+
+    @staticmethod
+    def _zrle_runs(data, pos, npix, palette):
+        pixels = []
+        runs = []
+        total = 0
+        while total < npix:
+            if palette is None:
+                pixels.append(data[pos] | (data[pos + 1] << 8) |
+                              (data[pos + 2] << 16))
+                pos += 3
+                long_run = True
+            else:
+                index = data[pos]
+                pos += 1
+                pixels.append(palette[index & 0x7f])
+                long_run = bool(index & 0x80)
+
+            run = 1
+            if long_run:
+                while data[pos] == 255:
+                    run += 255
+                    pos += 1
+                run += data[pos]
+                pos += 1
+            runs.append(run)
+            total += run
+        return np.array(pixels, dtype=np.uint32), runs, pos
+
+    # -------------------------------------------------------------------------
+    # Server messages
+
+    def _framebuffer_update(self):
+        (count,) = self._unpack(">xH")
+        rects = []
+        for _i in range(count):
+            x, y, w, h, encoding = self._unpack(">HHHHi")
+            if encoding == ENCODING_RAW:
+                self._raw(x, y, w, h)
+            elif encoding == ENCODING_COPYRECT:
+                self._copyrect(x, y, w, h)
+            elif encoding == ENCODING_RRE:
+                self._rre(x, y, w, h)
+            elif encoding == ENCODING_HEXTILE:
+                self._hextile(x, y, w, h)
+            elif encoding == ENCODING_ZRLE:
+                self._zrle(x, y, w, h)
+            elif encoding == ENCODING_DESKTOP_SIZE:
+                self._resize(w, h)
+                x, y = 0, 0
+            else:
+                raise RFBError("Unsupported encoding %d" % encoding)
+            rects.append((x, y, w, h))
+        # An update answers the oldest outstanding request
+        self._requested = max(self._requested - 1, 0)
+        return rects
+
+    def poll(self, timeout=None):
+        """
+        Process the next server message, waiting at most timeout seconds for
+        it to arrive. Returns the list of updated rectangles (x, y, w, h) for
+        framebuffer updates, an empty list for other messages and None if no
+        message arrived.
+        """
+        if not self._wait(timeout):
+            return None
+
+        (msg_type,) = self._unpack(">B")
+        if msg_type == 0:
+            return self._framebuffer_update()
+        if msg_type == 1:
+            # Colour map entries, not used for true color
+            _first, count = self._unpack(">xHH")
+            self._read(count * 6)
+        elif msg_type == 2:
+            logging.debug("Bell")
+        elif msg_type == 3:
+            (length,) = self._unpack(">3xI")
+            self._read(length)
+        else:
+            raise RFBError("Unsupported server message %d" % msg_type)
+        return []
+
+    # -------------------------------------------------------------------------
+    # Public methods
+
+    def connect(self):
+        logging.debug("Connecting to %s:%s", self.host, self.port)
+        self._sock = socket.create_connection((self.host, int(self.port)),
+                                              self.timeout)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._buf = bytearray()
+        self._zlib = None
+        self._requested = 0
+        try:
+            self._handshake()
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        if self._sock:
+            logging.debug("Disconnecting from %s:%s", self.host, self.port)
+            self._sock.close()
+            self._sock = None
+
+    def request_update(self, incremental=True, x=0, y=0, w=None, h=None):
+        """
+        Request a framebuffer update
+        """
+        if w is None:
+            w = self.width - x
+        if h is None:
+            h = self.height - y
+        self._send(struct.pack(">BBHHHH", 3, 1 if incremental else 0, x, y,
+                               w, h))
+        self._requested += 1
+
+    def update(self, incremental=True, timeout=None):
+        """
+        Request a framebuffer update and wait for it, return the list of
+        updated rectangles or None if no update arrived in time
+        """
+        self.request_update(incremental)
+        while True:
+            rects = self.poll(timeout)
+            if rects is None or rects:
+                return rects
+
+    def screenshot(self):
+        """
+        Return a copy of the framebuffer as a height x width x 3 RGB array
+        """
+        bgrx = self.framebuffer.view(np.uint8).reshape(self.height,
+                                                       self.width, 4)
+        return bgrx[:, :, 2::-1].copy()
+
+    def send_key(self, keysym, down):
+        self._send(struct.pack(">BBxxI", 4, 1 if down else 0, keysym))
+
+    def send_keys(self, keysyms):
+        """
+        Press the keys in order and release them in reverse order
+        """
+        self._send(_key_events(keysyms))
+
+    def sync(self, timeout=None):
+        """
+        Wait until the server has processed all messages sent so far, i.e.,
+        until it answers a (tiny) non-incremental update request. The server
+        answers the requests in order, one update each, so that's once all
+        the requests sent before it have been answered as well. An earlier
+        incremental request that the server holds back (because nothing
+        changed) holds back sync() too. Returns False on timeout.
+        """
+        self.request_update(incremental=False, w=1, h=1)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._requested:
+            remaining = None
+            if deadline is not None:
+                remaining = max(deadline - time.monotonic(), 0)
+            if self.poll(remaining) is None:
+                return False
+        return True
+
+    def type_text(self, text, pacer=None, shifted=keyboard.US_SHIFTED):
+        """
+        Type text as keystrokes, paced so that the server doesn't drop any.
+        Returns the number of keystrokes and the time it took.
+        """
+        if pacer is None:
+            pacer = keyboard.Pacer()
+
+        todo = keyboard.strokes(text, shifted)
+        count = len(todo)
+        start = time.monotonic()
+        while todo:
+            batch, todo = todo[:pacer.batch], todo[pacer.batch:]
+            sent = time.monotonic()
+            self._send(b"".join(_key_events(keysyms) for keysyms in batch))
+            if not self.sync(self.timeout):
+                raise RFBError("Timed out waiting for the server")
+            pacer.feedback(time.monotonic() - sent)
+            if pacer.delay and todo:
+                time.sleep(pacer.delay)
+
+        elapsed = time.monotonic() - start
+        logging.debug("Typed %d keystrokes in %.2fs (batch %d, delay %.3fs)",
+                      count, elapsed, pacer.batch, pacer.delay)
+        return count, elapsed
+
+    def pointer(self, x, y, buttons=0):
+        self._send(struct.pack(">BBHH", 5, buttons, x, y))
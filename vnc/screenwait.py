@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018  Juerg Haefliger <juergh@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+#
+# Wait for the remote screen to reach a known state
+
+import hashlib
+import logging
+import time
+
+import numpy as np
+
+from vnc import utils
+
+
+def rgb_to_pixels(rgb):
+    """
+    Convert a height x width x 3 RGB array to framebuffer pixels
+    """
+    rgb = rgb.astype(np.uint32)
+    return (rgb[:, :, 0] << 16) | (rgb[:, :, 1] << 8) | rgb[:, :, 2]
+
+
+def region_digest(framebuffer, region=None):
+    """
+    Return the hex digest of a framebuffer region (x, y, w, h)
+    """
+    if region is not None:
+        x, y, w, h = region
+        framebuffer = framebuffer[y:y + h, x:x + w]
+    return hashlib.blake2b(np.ascontiguousarray(framebuffer).tobytes(),
+                           digest_size=16).hexdigest()
+
+
+def _intersects(region, rect):
+    x, y, w, h = region
+    rx, ry, rw, rh = rect
+    return rx < x + w and x < rx + rw and ry < y + h and y < ry + rh
+
+
+class Screen():
+    """
+    A reference screen (or part of it), given either as an RGB image or as
+    the digest of the region
+
+    With an image, up to tolerance (a fraction) of the pixels may differ.
+    Without a region, the whole framebuffer is compared.
+    """
+    def __init__(self, image=None, region=None, digest=None, tolerance=0.0,
+                 name=None):
+        if image is None and digest is None:
+            raise ValueError("Either an image or a digest is required")
+
+        self.pixels = None if image is None else rgb_to_pixels(image)
+        self.region = region
+        self.digest = digest
+        self.tolerance = tolerance
+        self.name = name
+
+    @classmethod
+    def from_png(cls, path, region=None, tolerance=0.0):
+        """
+        Load a reference screen from a PNG file. If region is (x, y) or
+        None, the size of the region is the size of the image.
+        """
+        image = utils.read_png(path)
+        if region is not None and len(region) == 2:
+            region = (region[0], region[1], image.shape[1], image.shape[0])
+        return cls(image=image, region=region, tolerance=tolerance,
+                   name=path)
+
+    def _region(self, framebuffer):
+        if self.region is not None:
+            return self.region
+        return (0, 0, framebuffer.shape[1], framebuffer.shape[0])
+
+    def affected(self, framebuffer, rects):
+        """
+        Check if any of the updated rectangles touches the region
+        """
+        region = self._region(framebuffer)
+        return any(_intersects(region, rect) for rect in rects)
+
+    def matches(self, framebuffer):
+        x, y, w, h = self._region(framebuffer)
+        area = framebuffer[y:y + h, x:x + w]
+
+        if self.digest is not None:
+            return region_digest(area) == self.digest
+
+        if area.shape != self.pixels.shape:
+            return False
+        if self.tolerance <= 0:
+            return np.array_equal(area, self.pixels)
+        diff = np.count_nonzero(area != self.pixels)
+        return diff <= self.tolerance * area.size
+
+
+def wait_for_screen(client, screens, timeout=60):
+    """
+    Wait until the screen of the RFB client matches one of the reference
+    screens. Only screens whose region was touched by a framebuffer update
+    are compared again. Returns the index of the matching screen or None
+    on timeout.
+    """
+    deadline = time.monotonic() + timeout
+
+    # Start with a full update to know the current screen
+    rects = client.update(incremental=False, timeout=timeout)
+    while True:
+        if rects:
+            fb = client.framebuffer
+            for i, screen in enumerate(screens):
+                if screen.affected(fb, rects) and screen.matches(fb):
+                    logging.debug("Screen %s matched", screen.name or i)
+                    return i
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            logging.debug("Timed out waiting for screen")
+            return None
+
+        # Block until the next update arrives, nothing runs while the
+        # screen doesn't change
+        rects = client.update(incremental=True, timeout=remaining)
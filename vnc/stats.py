@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018  Juerg Haefliger <juergh@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import os
+import socket
+import struct
+import time
+
+# Offsets of tcpi_rtt (microseconds) and tcpi_bytes_received in the Linux
+# struct tcp_info, the latter was added in Linux 4.1
+_TCPI_RTT = 68
+_TCPI_BYTES_RECEIVED = 128
+_TCPI_SIZE = 136
+
+
+class UpdateStats():
+    """
+    Framebuffer update statistics of a session
+    """
+    def __init__(self):
+        self.updates = 0
+        self.pixels = 0
+        self.bytes = 0
+        self.start = time.monotonic()
+        self._last = (self.start, 0, 0)
+
+    def add(self, pixels, bpp):
+        self.updates += 1
+        self.pixels += pixels
+        self.bytes += pixels * bpp
+
+    def rates(self):
+        """
+        Return the updates and (estimated) bytes per second since the last
+        call
+        """
+        now = time.monotonic()
+        last, updates, nbytes = self._last
+        self._last = (now, self.updates, self.bytes)
+        elapsed = max(now - last, 0.001)
+        return (self.updates - updates) / elapsed, \
+            (self.bytes - nbytes) / elapsed
+
+
+def tcp_info(sock):
+    """
+    Return the smoothed round trip time (in seconds) and the number of
+    bytes received of a TCP connection, or None if the kernel doesn't tell
+    """
+    try:
+        info = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO,
+                               _TCPI_SIZE)
+    except (AttributeError, OSError):
+        return None
+    if len(info) < _TCPI_SIZE:
+        return None
+    (rtt,) = struct.unpack_from("I", info, _TCPI_RTT)
+    (received,) = struct.unpack_from("Q", info, _TCPI_BYTES_RECEIVED)
+    return rtt / 1000000.0, received
+
+
+def find_socket(host, port):
+    """
+    Return a socket (a duplicate) of an established TCP connection of this
+    process to host:port, or None if there's none. gtk-vnc doesn't expose
+    the socket of its connection, so look it up by its peer address.
+    """
+    try:
+        addrs = set(addr[4][0] for addr in
+                    socket.getaddrinfo(host, port, type=socket.SOCK_STREAM))
+        fds = os.listdir("/proc/self/fd")
+    except OSError:
+        return None
+
+    for fd in fds:
+        try:
+            if not os.readlink("/proc/self/fd/" + fd).startswith("socket:"):
+                continue
+            sock = socket.socket(fileno=os.dup(int(fd)))
+        except OSError:
+            continue
+        try:
+            if sock.family in (socket.AF_INET, socket.AF_INET6) and \
+               sock.type == socket.SOCK_STREAM:
+                peer = sock.getpeername()
+                if peer[0] in addrs and peer[1] == int(port):
+                    return sock
+        except OSError:
+            pass
+        sock.close()
+    return None
+
+
+class LinkStats():
+    """
+    Statistics of the TCP connection of a session, as measured by the
+    kernel
+    """
+    def __init__(self, sock):
+        self.sock = sock
+        self._last = None
+
+    def sample(self):
+        """
+        Return the round trip time and the bytes per second received since
+        the last call, or None if not available (yet)
+        """
+        info = tcp_info(self.sock)
+        if info is None:
+            return None
+        rtt, received = info
+        now = time.monotonic()
+        last = self._last
+        self._last = (now, received)
+        if last is None:
+            return None
+        return rtt, (received - last[1]) / max(now - last[0], 0.001)
+
+    def close(self):
+        self.sock.close()
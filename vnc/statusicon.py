@@ -30,18 +30,28 @@ STATUS_UNKNOWN = "blue"
 
 _status_list = (STATUS_OK, STATUS_WARNING, STATUS_ERROR, STATUS_UNKNOWN)
 
+# Pixbufs shared by all status icons, indexed by size
+_pixbuf_cache = {}
 
-class StatusIcon(Gtk.Image):
-    def __init__(self, size=16):
-        super(StatusIcon, self).__init__()
 
-        self._pixbuf = {}
+def _pixbufs(size):
+    if size not in _pixbuf_cache:
+        pixbuf = {}
         for status in _status_list:
             tmp = Gtk.Image()
             tmp.set_from_file(os.path.join(os.path.dirname(__file__),
                                            os.pardir, "icons",
                                            status + ".png"))
-            self._pixbuf[status] = tmp.get_pixbuf().scale_simple(size, size, 2)
+            pixbuf[status] = tmp.get_pixbuf().scale_simple(size, size, 2)
+        _pixbuf_cache[size] = pixbuf
+    return _pixbuf_cache[size]
+
+
+class StatusIcon(Gtk.Image):
+    def __init__(self, size=16):
+        super(StatusIcon, self).__init__()
+
+        self._pixbuf = _pixbufs(size)
 
     def set_status(self, status):
         if status in _status_list:
@@ -16,22 +16,98 @@
 # License along with this library; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 
+import concurrent.futures
 import logging
 import threading
 
+from gi.repository import GLib
 
-class _Task(threading.Thread):
-    def __init__(self, func, *args):
-        super(_Task, self).__init__()
-        self.func = func
-        self.args = args
-        self.retval = None
 
-    def run(self):
-        logging.debug("Running background task: %s", self.func.__name__)
-        self.retval = self.func(*self.args)
+def _deliver(callback, future):
+    callback(future)
+    return False
+
+
+class Executor():
+    """
+    A bounded pool of background worker threads
+
+    Tasks can be submitted with a key, in which case a task with the same
+    key that is still pending or running is not started a second time.
+    Callbacks are delivered on the GLib main loop.
+    """
+    def __init__(self, max_workers=4):
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="vnc-task")
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _run(self, func, *args):   # pylint: disable=no-self-use
+        logging.debug("Running background task: %s", func.__name__)
+        return func(*args)
+
+    def _done(self, key, future, callback):
+        if key is not None:
+            with self._lock:
+                if self._pending.get(key) is future:
+                    del self._pending[key]
+        if future.cancelled():
+            return
+        if future.exception():
+            logging.error("Background task failed: %s", future.exception())
+        if callback:
+            GLib.idle_add(_deliver, callback, future)
+
+    def submit(self, func, *args, key=None, callback=None):
+        """
+        Run func(*args) in the background and return its future. The
+        optional callback is called with the future on the main loop.
+        """
+        with self._lock:
+            if key is not None and key in self._pending:
+                logging.debug("Background task already pending: %s", key)
+                return self._pending[key]
+            future = self._executor.submit(self._run, func, *args)
+            if key is not None:
+                self._pending[key] = future
+
+        future.add_done_callback(lambda f: self._done(key, f, callback))
+        return future
+
+    def shutdown(self):
+        """
+        Cancel all pending tasks and stop the workers once the running tasks
+        are finished
+        """
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    """
+    Return the shared executor
+    """
+    global _executor   # pylint: disable=global-statement
+    with _executor_lock:
+        if _executor is None:
+            _executor = Executor()
+    return _executor
+
+
+def submit(func, *args, key=None, callback=None):
+    return executor().submit(func, *args, key=key, callback=callback)
 
 
 def run(func, *args):
-    task = _Task(func, *args)
-    task.start()
+    return executor().submit(func, *args)
+
+
+def shutdown():
+    global _executor   # pylint: disable=global-statement
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown()
+            _executor = None
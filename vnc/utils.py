@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018  Juerg Haefliger <juergh@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import struct
+import zlib
+
+
+def parse_host(host, port="5900"):
+    """
+    Split a host[:port] string into host and port
+    """
+    if ":" in host:
+        host, port = host.split(':')
+    return host, port
+
+
+def write_png(path, rgb):
+    """
+    Write an RGB image (a height x width x 3 uint8 array) to a PNG file
+    """
+    height, width, _depth = rgb.shape
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + \
+            struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    # Filter type 0 (none) for every scanline
+    raw = b"".join(b"\x00" + rgb[row].tobytes() for row in range(height))
+    with open(path, "wb") as fh:
+        fh.write(b"\x89PNG\r\n\x1a\n")
+        fh.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2,
+                                            0, 0, 0)))
+        fh.write(chunk(b"IDAT", zlib.compress(raw, 6)))
+        fh.write(chunk(b"IEND", b""))
+
+
+def _unfilter(data, bpp):
+    """
+    Undo the PNG filters of the scanlines (a height x (1 + width * bpp)
+    uint8 array, each starting with its filter type) and return the height
+    x width x bpp pixels
+    """
+    import numpy as np   # pylint: disable=import-outside-toplevel
+
+    height = data.shape[0]
+    width = (data.shape[1] - 1) // bpp
+    lines = data[:, 1:].reshape(height, width, bpp)
+    ftype = data[:, :1]
+    if not ftype.any():
+        return lines
+
+    # A filtered byte depends on the (unfiltered) bytes to its left, above
+    # and above left. So all pixels on a diagonal x + y = step can be
+    # unfiltered at once, given the previous two diagonals. Skew the image,
+    # such that diagonal step is skewed[step] (and row y in it is at y) and
+    # pad the unfiltered result with a zero row and column.
+    steps = width + height - 1
+    skewed = np.zeros((steps, height, bpp), dtype=np.int16)
+    for y in range(height):
+        skewed[y:y + width, y] = lines[y]
+    out = np.zeros((steps + 1, height + 1, bpp), dtype=np.int16)
+
+    sub, up, average, paeth = ((ftype == t).astype(np.int16)
+                               for t in (1, 2, 3, 4))
+    for step in range(steps):
+        y0, y1 = max(0, step - width + 1), min(height, step + 1)
+        a = out[step, y0 + 1:y1 + 1]
+        b = out[step, y0:y1]
+        c = out[max(step - 1, 0), y0:y1]
+
+        p = a + b - c
+        pa, pb, pc = np.abs(p - a), np.abs(p - b), np.abs(p - c)
+        pred = np.where((pa <= pb) & (pa <= pc), a,
+                        np.where(pb <= pc, b, c)) * paeth[y0:y1]
+        pred += a * sub[y0:y1] + b * up[y0:y1] + \
+            ((a + b) >> 1) * average[y0:y1]
+        out[step + 1, y0 + 1:y1 + 1] = (skewed[step, y0:y1] + pred) & 0xff
+
+    pixels = np.empty((height, width, bpp), dtype=np.uint8)
+    for y in range(height):
+        pixels[y] = out[y + 1:y + 1 + width, y + 1]
+    return pixels
+
+
+def read_png(path):
+    """
+    Read an 8-bit RGB or RGBA (non-interlaced) PNG file and return it as a
+    height x width x 3 uint8 array
+    """
+    import numpy as np   # pylint: disable=import-outside-toplevel
+
+    with open(path, "rb") as fh:
+        data = fh.read()
+    if not data.startswith(b"\x89PNG\r\n\x1a\n"):
+        raise ValueError("%s: not a PNG file" % path)
+
+    pos = 8
+    idat = b""
+    header = None
+    while True:
+        if pos + 8 > len(data):
+            raise ValueError("%s: truncated PNG file" % path)
+        (length,) = struct.unpack(">I", data[pos:pos + 4])
+        kind = data[pos + 4:pos + 8]
+        body = data[pos + 8:pos + 8 + length]
+        if len(body) != length:
+            raise ValueError("%s: truncated PNG file" % path)
+        if kind == b"IHDR" and length == 13:
+            header = struct.unpack(">IIBBBBB", body)
+        elif kind == b"IDAT":
+            idat += body
+        elif kind == b"IEND":
+            break
+        pos += 12 + length
+
+    if header is None:
+        raise ValueError("%s: not a PNG file (IHDR missing)" % path)
+    width, height, depth, color, _c, _f, interlace = header
+    if depth != 8 or color not in (2, 6) or interlace:
+        raise ValueError("%s: unsupported PNG format" % path)
+
+    bpp = 3 if color == 2 else 4
+    try:
+        raw = zlib.decompress(idat)
+    except zlib.error as e:
+        raise ValueError("%s: corrupt PNG data (%s)" % (path, e))
+    if len(raw) < height * (width * bpp + 1):
+        raise ValueError("%s: truncated PNG file" % path)
+    data = np.frombuffer(raw, dtype=np.uint8, count=height * (width * bpp + 1))
+    image = _unfilter(data.reshape(height, width * bpp + 1), bpp)
+    return image[:, :, :3]
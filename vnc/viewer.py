@@ -18,6 +18,8 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
 
 import logging
+import threading
+import time
 
 import gi
 gi.require_version('Gtk', '3.0')
@@ -28,17 +30,38 @@ from gi.repository import Gdk
 from gi.repository import GLib
 from gi.repository import GtkVnc
 
+from amt import metrics
+from amt import scheduler
+from vnc import keyboard
+from vnc import stats
 from vnc import task
+from vnc.powermonitor import PowerMonitor
+from vnc.quality import QualityController
+from vnc.reconnect import Reconnector
+from vnc.recording import Recorder
 from vnc.statusicon import StatusIcon, STATUS_OK, STATUS_ERROR, STATUS_UNKNOWN
+from vnc.utils import parse_host
 
 GLib.threads_init()
 
+_connects = metrics.counter("vnc_connects_total", "VNC connection attempts")
+_disconnects = metrics.counter("vnc_disconnects_total", "VNC disconnects")
+_connect_latency = metrics.histogram(
+    "vnc_connect_seconds",
+    "Time from opening the connection until it's connected/initialized")
+_reconnect_latency = metrics.histogram(
+    "vnc_reconnect_seconds", "Time from a disconnect until reconnected")
+_session_duration = metrics.histogram(
+    "vnc_session_seconds", "Duration of VNC sessions",
+    buckets=(1, 10, 60, 300, 900, 3600, 4 * 3600, 24 * 3600))
+
 
 class VNCViewer():
-    def __init__(self, host, password, bmc=None):
-        port = "5900"
-        if ":" in host:
-            host, port = host.split(':')
+    def __init__(self, host, password, bmc=None, disconnect_timeout=10,
+                 power_interval=10, embedded=False, depth="default",
+                 lossy=False, scaling=False, auto_quality=False, record=None,
+                 record_fps=5):
+        host, port = parse_host(host)
 
         self.host = host
         self.port = port
@@ -49,18 +72,66 @@ class VNCViewer():
         self.connected = False
         self.power = None
 
+        # Connection lifecycle timestamps for metrics
+        self._connect_time = None
+        self._connected_time = None
+        self._disconnected_time = None
+
+        # Typing of pasted text, a batch of keystrokes every interval (ms)
+        self.type_batch = 2
+        self.type_interval = 40
+        self._typing = None
+
+        # Set while there's no connection to the server, so that background
+        # tasks can block until a disconnect has been processed
+        self.disconnected = threading.Event()
+        self.disconnected.set()
+        self.disconnect_timeout = disconnect_timeout
+
         # Status icons
         self.connection_status = StatusIcon()
         self.connection_status.set_status(STATUS_ERROR)
         if bmc:
             self.power_status = StatusIcon()
             self.power_status.set_status(STATUS_UNKNOWN)
+            self.power_monitor = PowerMonitor(bmc, self._power_state,
+                                              interval=power_interval,
+                                              key=("power-state", host))
+
+        # Session recording, the framebuffer is captured at most record_fps
+        # times per second and only if it was redrawn
+        self.recorder = None
+        self._record_dirty = False
+        if record:
+            self.recorder = Recorder(record)
+            GLib.timeout_add(int(1000 / record_fps), self._record)
+
+        # Window sizing, bursts of desktop resizes (e.g., while the guest
+        # boots) are coalesced and only the final size is applied
+        self.resize_delay = 250
+        self._desktop_size = None
+        self._applied_size = None
+        self._resizes = 0
+        self._resize_source = None
+
+        # Reconnect engine
+        self.reconnector = Reconnector(host, port, self.connect,
+                                       status=self._set_status_message)
 
         # Menubar
-        menubar = self._menubar(bmc)
+        menubar = self._menubar(bmc, scaling)
 
-        # VNC display
+        # VNC display, reused across reconnects
         self.vncdisplay = GtkVnc.Display()
+        self.vncdisplay.connect("vnc-desktop-resize", self._desktop_resize)
+        self.vncdisplay.connect("vnc-auth-credential", self._auth_credential)
+        self.vncdisplay.connect("vnc-auth-failure", self._auth_failure)
+        self.vncdisplay.connect("vnc-connected", self._connected)
+        self.vncdisplay.connect("vnc-disconnected", self._disconnected)
+        self.vncdisplay.connect("vnc-error", self._error)
+        self.vncdisplay.connect("vnc-initialized", self._initialized)
+        self.vncdisplay.connect_after("draw", self._draw)
+        self.vncdisplay.set_scaling(scaling)
         self.vncbox = Gtk.VBox()
         self.vncbox.set_size_request(720, 400)
         self.vncbox.add(self.vncdisplay)
@@ -69,22 +140,42 @@ class VNCViewer():
         statusbar = Gtk.HBox()
         statusbar.pack_start(Gtk.Label("Connection:"), False, False, 10)
         statusbar.pack_start(self.connection_status, False, False, 10)
-        statusbar.pack_start(Gtk.Label("Power:"), False, False, 10)
-        statusbar.pack_start(self.power_status, False, False, 10)
+        if bmc:
+            statusbar.pack_start(Gtk.Label("Power:"), False, False, 10)
+            statusbar.pack_start(self.power_status, False, False, 10)
+        self.status_message = Gtk.Label()
+        statusbar.pack_end(self.status_message, False, False, 10)
+        self.quality_status = Gtk.Label()
+        statusbar.pack_end(self.quality_status, False, False, 10)
+
+        # Encoding/quality control
+        self.quality = QualityController(self.vncdisplay, self._apply_quality,
+                                         status=self.quality_status.set_text,
+                                         depth=depth, lossy=lossy,
+                                         adaptive=auto_quality)
 
         # Layout
-        layout = Gtk.VBox()
-        layout.pack_start(menubar, False, False, 0)
-        layout.pack_start(self.vncbox, True, True, 0)
-        layout.pack_end(statusbar, False, False, 0)
+        self.layout = Gtk.VBox()
+        self.layout.pack_start(menubar, False, False, 0)
+        self.layout.pack_start(self.vncbox, True, True, 0)
+        self.layout.pack_end(statusbar, False, False, 0)
+
+        # Callbacks for embedding the viewer into a multi-session window
+        self.on_status = None
+        self.on_quit = None
 
         # Window
+        if embedded:
+            self.window = None
+            self.layout.show_all()
+            return
+
         self.window = Gtk.Window(title="jvncviewer - %s" % host)
-        self.window.add(layout)
+        self.window.add(self.layout)
         self.window.connect("destroy", self.quit)
         self.window.show_all()
 
-    def _menubar(self, bmc):
+    def _menubar(self, bmc, scaling):
         #
         # 'File' menu
         #
@@ -104,14 +195,31 @@ class VNCViewer():
         sendkey_cad.connect("activate", self._send_cad)
         sendkey_f12 = Gtk.MenuItem("F12")
         sendkey_f12.connect("activate", self._send_f12)
+        sendkey_paste = Gtk.MenuItem("Paste Clipboard as Keystrokes")
+        sendkey_paste.connect("activate", self._send_clipboard)
 
         menu_sendkey = Gtk.Menu()
         menu_sendkey.append(sendkey_cad)
         menu_sendkey.append(sendkey_f12)
+        menu_sendkey.append(Gtk.SeparatorMenuItem())
+        menu_sendkey.append(sendkey_paste)
 
         menuitem_sendkey = Gtk.MenuItem("Send Key")
         menuitem_sendkey.set_submenu(menu_sendkey)
 
+        #
+        # 'View' menu
+        #
+        view_scale = Gtk.CheckMenuItem("Scale to Window")
+        view_scale.set_active(scaling)
+        view_scale.connect("toggled", self._view_scale)
+
+        menu_view = Gtk.Menu()
+        menu_view.append(view_scale)
+
+        menuitem_view = Gtk.MenuItem("View")
+        menuitem_view.set_submenu(menu_view)
+
         #
         # 'System' menu
         #
@@ -145,63 +253,172 @@ class VNCViewer():
         menubar = Gtk.MenuBar()
         menubar.append(menuitem_file)
         menubar.append(menuitem_sendkey)
+        menubar.append(menuitem_view)
         menubar.append(menuitem_system)
 
         return menubar
 
     def _update_statusbar(self):
         if self.connected:
-            self.connection_status.set_status(STATUS_OK)
+            connection = STATUS_OK
         else:
-            self.connection_status.set_status(STATUS_ERROR)
+            connection = STATUS_ERROR
+        self.connection_status.set_status(connection)
 
+        power = None
         if self.bmc:
             if not self.power:
-                self.power_status.set_status(STATUS_UNKNOWN)
+                power = STATUS_UNKNOWN
             elif self.power == self.bmc.POWER_STATE_OFF:
-                self.power_status.set_status(STATUS_ERROR)
+                power = STATUS_ERROR
             elif self.power == self.bmc.POWER_STATE_ON:
-                self.power_status.set_status(STATUS_OK)
+                power = STATUS_OK
             else:
-                self.power_status.set_status(STATUS_UNKNOWN)
+                power = STATUS_UNKNOWN
+            self.power_status.set_status(power)
+
+        if self.on_status:
+            self.on_status(self, connection, power)
+
+    def _apply_quality(self):
+        if self.connected:
+            self.disconnect(reconnect=True)
+
+    def _set_status_message(self, msg):
+        self.status_message.set_text(msg)
+
+    def _power_state(self, state):
+        logging.debug("System power state is: %s", state)
+        self.power = state
+        self._update_statusbar()
+
+        # There's no point in trying to reconnect to a host that's powered
+        # off, so hold off until it's back on (or its state is unknown)
+        if state == self.bmc.POWER_STATE_OFF:
+            if not self.reconnector.paused:
+                logging.info("%s is powered off, pausing reconnects",
+                             self.host)
+            self.reconnector.pause("Powered off, waiting for power on")
+        elif self.reconnector.paused:
+            logging.info("%s is no longer powered off, resuming reconnects",
+                         self.host)
+            self.reconnector.resume()
 
     # -------------------------------------------------------------------------
     # VNC/GTK signal handlers
 
-    def _auth_credential(self, _src, _credList):   # pylint: disable=no-self-use
+    def _auth_credential(self, _src, _credList):
         logging.error("Server requires authentication")
-        Gtk.main_quit()
+        self.quit()
 
-    def _auth_failure(self, _src, msg):   # pylint: disable=no-self-use
+    def _auth_failure(self, _src, msg):
         logging.error("Authentication failure: %s", msg.strip())
-        Gtk.main_quit()
+        self.quit()
 
     def _connected(self, _src):
         logging.debug("Connected to server")
+        now = time.monotonic()
+        if self._connect_time is not None:
+            _connect_latency.observe(now - self._connect_time,
+                                     phase="connected")
+        if self._disconnected_time is not None:
+            _reconnect_latency.observe(now - self._disconnected_time)
+            self._disconnected_time = None
+        self._connected_time = now
         self.connected = True
+        self.disconnected.clear()
+        self.reconnector.connected()
+        # The quality controller measures the link on (a duplicate of) the
+        # connection's socket
+        self.quality.start(stats.find_socket(self.host, self.port))
         self._update_statusbar()
-        self._system_get_power_state()
+        if self.bmc:
+            # Refresh the power state, unless the initial query is still
+            # pending
+            self.power_monitor.start()
 
     def _disconnected(self, _src):
         logging.debug("Disconnected from server")
+        now = time.monotonic()
+        _disconnects.inc()
+        if self._connected_time is not None:
+            _session_duration.observe(now - self._connected_time)
+            self._connected_time = None
+        self._connect_time = None
+        if self.reconnect:
+            self._disconnected_time = now
         self.connected = False
+        self.disconnected.set()
+        self.quality.stop()
         self._update_statusbar()
 
         if self.reconnect:
             # Automatically reconnect
-            GLib.timeout_add(500, self.connect)
+            self.reconnector.schedule()
 
     def _error(self, _src, msg):   # pylint: disable=no-self-use
         logging.error("Error: %s", msg)
 
-    def _initialized(self, _src):   # pylint: disable=no-self-use
+    def _initialized(self, _src):
         logging.debug("Connection initialized")
-
-    def _size_allocate(self, _src, _rect):
-        logging.debug("Size allocation")
-        # HACK: Shrink the window so that is resizes automatically to the
-        # size that the VNC display requests.
-        self.window.resize(10, 10)
+        if self._connect_time is not None:
+            _connect_latency.observe(time.monotonic() - self._connect_time,
+                                     phase="initialized")
+            self._connect_time = None
+
+    def _draw(self, src, cr):
+        # Estimate the size of the framebuffer update from the redrawn area
+        x1, y1, x2, y2 = cr.clip_extents()
+        pixels = (x2 - x1) * (y2 - y1)
+        if self.vncdisplay.get_scaling():
+            alloc = src.get_allocation()
+            fb_area = self.vncdisplay.get_width() * self.vncdisplay.get_height()
+            pixels *= fb_area / float(max(alloc.width * alloc.height, 1))
+        self.quality.add_update(pixels)
+        self._record_dirty = True
+        return False
+
+    def _record(self):
+        if self.recorder is None:
+            return False
+        if self._record_dirty and self.connected:
+            self._record_dirty = False
+            pixbuf = self.vncdisplay.get_pixbuf()
+            if pixbuf:
+                # get_pixels() returns a copy, the recorder does the rest in
+                # the background
+                self.recorder.add(pixbuf.get_width(), pixbuf.get_height(),
+                                  pixbuf.get_n_channels(),
+                                  pixbuf.get_rowstride(), pixbuf.get_pixels())
+        return True
+
+    def _desktop_resize(self, _src, width, height):
+        logging.debug("Desktop resized to %dx%d", width, height)
+        self._desktop_size = (width, height)
+        self._resizes += 1
+        if self._resize_source is None:
+            self._resize_source = GLib.timeout_add(self.resize_delay,
+                                                   self._apply_size)
+
+    def _apply_size(self):
+        self._resize_source = None
+        logging.debug("Applying desktop size %dx%d (%d resize(s) coalesced)",
+                      self._desktop_size[0], self._desktop_size[1],
+                      self._resizes)
+        self._resizes = 0
+
+        if self._desktop_size == self._applied_size:
+            return False
+        self._applied_size = self._desktop_size
+        self._fit_window()
+        return False
+
+    def _fit_window(self):
+        # In scale-to-window mode the window keeps its size and the display
+        # is scaled. Otherwise, shrink the window to its minimum size once,
+        # which is the size the VNC display requests.
+        if self.window and not self.vncdisplay.get_scaling():
+            self.window.resize(1, 1)
 
     # -------------------------------------------------------------------------
     # 'Send Key' menu signal handlers
@@ -214,65 +431,96 @@ class VNCViewer():
         logging.debug("Send F12")
         self.vncdisplay.send_keys([Gdk.KEY_F12])
 
+    def _send_clipboard(self, _src):
+        clipboard = Gtk.Clipboard.get(Gdk.SELECTION_CLIPBOARD)
+        clipboard.request_text(self._clipboard_text)
+
+    def _clipboard_text(self, _clipboard, text):
+        if text:
+            self.type_text(text)
+
+    def _type_strokes(self, strokes, count, start):
+        if not self.connected:
+            self._typing = None
+            self._set_status_message("Typing aborted")
+            return False
+
+        for keysyms in strokes[:self.type_batch]:
+            self.vncdisplay.send_keys(keysyms)
+        del strokes[:self.type_batch]
+        if strokes:
+            return True
+
+        self._typing = None
+        rate = count / max(time.monotonic() - start, 0.001)
+        logging.info("Typed %d keystrokes (%.0f keystrokes/s)", count, rate)
+        self._set_status_message("Typed %d keystrokes (%.0f/s)" %
+                                 (count, rate))
+        return False
+
     # -------------------------------------------------------------------------
     # System background methods
     # These are long running and need to be run in separate threads
 
-    def __system_get_power_state(self):
-        logging.debug("Getting system power state")
-        self.power = self.bmc.get_power_state()
-        logging.debug("System power state is: %s", self.power)
-        GLib.idle_add(self._update_statusbar)
-
-        if self.power not in self.bmc.POWER_STATES:
-            GLib.timeout_add(2000, self._system_get_power_state)
-
     def __system_set_power_state(self, state):
         logging.debug("Setting system power state to: %s", state)
 
         # Per the Intel AMT spec, some power commands are rejected if there's
         # an active connection, so break it first and re-establish it again
-        # afterwards. It's OK to sleep here since this method runs in the
+        # afterwards. It's OK to block here since this method runs in the
         # background and won't block the UI.
         if state in (self.bmc.POWER_STATE_OFF, self.bmc.POWER_STATE_CYCLE):
             GLib.idle_add(self.disconnect, False)
-            while self.connected:
-                pass
+            if not self.disconnected.wait(self.disconnect_timeout):
+                logging.error("Timed out waiting for the disconnect, not "
+                              "setting the power state")
+                GLib.idle_add(self.connect)
+                return
 
-        # Set the requested power state
-        errno = self.bmc.set_power_state(state)
-        if errno:
-            # Retry once
-            self.bmc.set_power_state(state)
+        # Set the requested power state, the scheduler retries if the
+        # firmware is busy and keeps the power state queries out of the way
+        scheduler.set_power_state(self.bmc, state)
 
         if state in (self.bmc.POWER_STATE_OFF, self.bmc.POWER_STATE_CYCLE):
             # Reconnect
             GLib.idle_add(self.connect)
 
         # Get the current power state and update the statusbar
-        GLib.timeout_add(2000, self._system_get_power_state)
+        GLib.idle_add(self.power_monitor.refresh)
+
+    # -------------------------------------------------------------------------
+    # 'View' menu signal handlers
+
+    def _view_scale(self, src):
+        scaling = src.get_active()
+        logging.debug("Scale to window: %s", scaling)
+        self.vncdisplay.set_scaling(scaling)
+        self._fit_window()
 
     # -------------------------------------------------------------------------
     # 'System' menu signal handlers
 
-    def _system_get_power_state(self):
-        task.run(self.__system_get_power_state)
+    def _system_set_power_state(self, state):
+        # Only a repeated click of the same action is dropped while it's
+        # pending, different actions are queued by the AMT scheduler
+        task.submit(self.__system_set_power_state, state,
+                    key=("power", self.host, state))
 
     def _system_reconnect(self, _src):
         logging.debug("Reconnecting to %s:%s", self.host, self.port)
         self.disconnect(reconnect=True)
 
     def _system_pon(self, _src):
-        task.run(self.__system_set_power_state, self.bmc.POWER_STATE_ON)
+        self._system_set_power_state(self.bmc.POWER_STATE_ON)
 
     def _system_poff(self, _src):
-        task.run(self.__system_set_power_state, self.bmc.POWER_STATE_OFF)
+        self._system_set_power_state(self.bmc.POWER_STATE_OFF)
 
     def _system_pcycle(self, _src):
-        task.run(self.__system_set_power_state, self.bmc.POWER_STATE_CYCLE)
+        self._system_set_power_state(self.bmc.POWER_STATE_CYCLE)
 
     def _system_reset(self, _src):
-        task.run(self.__system_set_power_state, self.bmc.POWER_STATE_RESET)
+        self._system_set_power_state(self.bmc.POWER_STATE_RESET)
 
     # -------------------------------------------------------------------------
     # Public methods
@@ -280,39 +528,85 @@ class VNCViewer():
     def connect(self):
         logging.debug("Connecting to %s:%s", self.host, self.port)
         self.reconnect = True
+        self.reconnector.cancel()
 
-        # Remove the previous VNC display from the window layout (in case of a
-        # reconnect)
-        self.vncbox.remove(self.vncdisplay)
+        # Query the power state while the connection is being established
+        # rather than after, so that it's known even if the host is off and
+        # the connection never comes up
+        if self.bmc and not self.power_monitor.running:
+            self.power_monitor.start()
 
-        # Create the VNC display and add it to the window layout
-        self.vncdisplay = GtkVnc.Display()
-        self.vncbox.add(self.vncdisplay)
-        self.vncdisplay.show()
+        if self.vncdisplay.is_open():
+            logging.debug("Already connected")
+            return
 
+        # The display (and its framebuffer) is reused, only the credentials
+        # need to be set again since they're dropped when the connection is
+        # closed
         if self.password:
             self.vncdisplay.set_credential(GtkVnc.DisplayCredential.CLIENTNAME,
                                            "jvncviewer")
             self.vncdisplay.set_credential(GtkVnc.DisplayCredential.PASSWORD,
                                            self.password)
 
-        self.vncdisplay.realize()
-
-        self.vncdisplay.connect("size-allocate", self._size_allocate)
-        self.vncdisplay.connect("vnc-auth-credential", self._auth_credential)
-        self.vncdisplay.connect("vnc-auth-failure", self._auth_failure)
-        self.vncdisplay.connect("vnc-connected", self._connected)
-        self.vncdisplay.connect("vnc-disconnected", self._disconnected)
-        self.vncdisplay.connect("vnc-error", self._error)
-        self.vncdisplay.connect("vnc-initialized", self._initialized)
-
+        _connects.inc()
+        self._connect_time = time.monotonic()
         self.vncdisplay.open_host(self.host, self.port)
 
     def disconnect(self, reconnect=True):
         logging.debug("Disconnecting from %s:%s", self.host, self.port)
         self.reconnect = reconnect
+        if not reconnect:
+            self.reconnector.cancel()
+        # Close the quality controller's duplicate of the socket first, it
+        # would keep the connection open otherwise
+        self.quality.stop()
+        self.vncdisplay.close()
+
+    def type_text(self, text):
+        """
+        Type text as keystrokes, a batch at a time so that the server doesn't
+        drop any
+        """
+        if self._typing is not None:
+            GLib.source_remove(self._typing)
+            self._typing = None
+
+        try:
+            strokes = keyboard.strokes(text)
+        except ValueError as e:
+            logging.error("%s", e)
+            self._set_status_message(str(e))
+            return
+
+        logging.debug("Typing %d keystrokes", len(strokes))
+        self._typing = GLib.timeout_add(self.type_interval, self._type_strokes,
+                                        strokes, len(strokes),
+                                        time.monotonic())
+
+    def close(self):
+        logging.debug("Closing session to %s:%s", self.host, self.port)
+        self.reconnect = False
+        self.reconnector.cancel()
+        self.quality.stop()
+        if self._resize_source is not None:
+            GLib.source_remove(self._resize_source)
+            self._resize_source = None
+        if self._typing is not None:
+            GLib.source_remove(self._typing)
+            self._typing = None
+        if self.recorder:
+            self.recorder.close()
+            self.recorder = None
+        if self.bmc:
+            self.power_monitor.stop()
         self.vncdisplay.close()
 
-    def quit(self, _src=None):   # pylint: disable=no-self-use
+    def quit(self, _src=None):
         logging.debug("Quitting")
+        self.close()
+        if self.on_quit:
+            self.on_quit(self)
+            return
+        task.shutdown()
         Gtk.main_quit()
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+#
+# Copyright (C) 2018  Juerg Haefliger <juergh@gmail.com>
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.0 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301 USA
+
+import logging
+
+import gi
+gi.require_version('Gtk', '3.0')
+gi.require_version('GtkVnc', '2.0')
+
+from gi.repository import Gtk
+from gi.repository import GLib
+from gi.repository import GtkVnc
+
+from vnc import depths
+from vnc import task
+from vnc.quality import gtk_depth
+from vnc.reconnect import Reconnector
+from vnc.stats import UpdateStats
+from vnc.utils import parse_host
+from vnc.viewer import VNCViewer
+
+
+class Thumbnail(Gtk.EventBox):
+    """
+    A low-bandwidth, read-only, scaled-down preview of a VNC session
+
+    The VNC display is rendered scaled-down into an offscreen window and the
+    visible preview is refreshed from it at most max_fps times per second,
+    and only if the framebuffer changed.
+    """
+    def __init__(self, host, password, bmc=None, width=320, height=200,
+                 max_fps=2, depth="ultra-low"):
+        super(Thumbnail, self).__init__()
+
+        host, port = parse_host(host)
+
+        self.host = host
+        self.port = port
+        self.password = password
+        self.bmc = bmc
+        self.width = width
+        self.height = height
+        self.max_fps = max_fps
+        self.depth = depth
+
+        self.stats = UpdateStats()
+        self.paused = False
+        self._dirty = False
+        self._fb_size = (width, height)
+
+        self.vncdisplay = GtkVnc.Display()
+        self.vncdisplay.set_read_only(True)
+        self.vncdisplay.set_depth(gtk_depth(depth))
+        self.vncdisplay.set_lossy_encoding(True)
+        self.vncdisplay.set_scaling(True)
+        self.vncdisplay.set_keyboard_grab(False)
+        self.vncdisplay.set_pointer_grab(False)
+        self.vncdisplay.set_size_request(width, height)
+        self.vncdisplay.connect("vnc-connected", self._connected)
+        self.vncdisplay.connect("vnc-disconnected", self._disconnected)
+        self.vncdisplay.connect("vnc-desktop-resize", self._desktop_resize)
+
+        self.offscreen = Gtk.OffscreenWindow()
+        self.offscreen.add(self.vncdisplay)
+        self.offscreen.connect("damage-event", self._damage)
+        self.offscreen.show_all()
+
+        self.reconnector = Reconnector(host, port, self.open)
+
+        # Preview and label
+        self.preview = Gtk.Image()
+        self.preview.set_size_request(width, height)
+        self.label = Gtk.Label(host)
+        box = Gtk.VBox()
+        box.pack_start(self.preview, False, False, 0)
+        box.pack_start(self.label, False, False, 2)
+        self.add(box)
+        self.show_all()
+
+        self._source = GLib.timeout_add(int(1000 / max_fps), self._refresh)
+
+    def _connected(self, _src):
+        logging.debug("Thumbnail %s connected", self.host)
+        self.reconnector.connected()
+
+    def _disconnected(self, _src):
+        logging.debug("Thumbnail %s disconnected", self.host)
+        if not self.paused:
+            self.reconnector.schedule()
+
+    def _desktop_resize(self, _src, width, height):
+        self._fb_size = (width, height)
+
+    def _damage(self, _src, event):
+        # Damage is reported for the scaled-down display, so scale it back
+        # up to estimate the size of the framebuffer update
+        fb_width, fb_height = self._fb_size
+        scale = (fb_width * fb_height) / float(self.width * self.height)
+        self.stats.add(event.area.width * event.area.height * scale,
+                       depths.BPP[self.depth])
+        self._dirty = True
+        return False
+
+    def _refresh(self):
+        if self._dirty:
+            self._dirty = False
+            pixbuf = self.offscreen.get_pixbuf()
+            if pixbuf:
+                self.preview.set_from_pixbuf(pixbuf)
+        return True
+
+    def update_label(self):
+        updates, nbytes = self.stats.rates()
+        self.label.set_text("%s  %.1f upd/s  %.1f kB/s" %
+                            (self.host, updates, nbytes / 1024))
+        self.set_tooltip_text("%d updates, %.1f MB total" %
+                              (self.stats.updates,
+                               self.stats.bytes / 1024 / 1024))
+
+    def open(self):
+        if self.vncdisplay.is_open():
+            return
+        if self.password:
+            self.vncdisplay.set_credential(GtkVnc.DisplayCredential.CLIENTNAME,
+                                           "jvncviewer")
+            self.vncdisplay.set_credential(GtkVnc.DisplayCredential.PASSWORD,
+                                           self.password)
+        self.vncdisplay.open_host(self.host, self.port)
+
+    def pause(self):
+        self.paused = True
+        self.reconnector.cancel()
+        self.vncdisplay.close()
+
+    def resume(self):
+        self.paused = False
+        self.open()
+
+    def close(self):
+        self.pause()
+        if self._source is not None:
+            GLib.source_remove(self._source)
+            self._source = None
+
+
+class Wall():
+    """
+    A wall of session thumbnails, clicking a thumbnail opens a full-quality
+    viewer for that session
+    """
+    def __init__(self, columns=4, width=320, height=200, max_fps=2,
+                 stats_interval=5, **viewer_args):
+        self.width = width
+        self.height = height
+        self.max_fps = max_fps
+        self.viewer_args = viewer_args
+        self.thumbnails = []
+        self._promoted = {}
+
+        self.flowbox = Gtk.FlowBox()
+        self.flowbox.set_max_children_per_line(columns)
+        self.flowbox.set_selection_mode(Gtk.SelectionMode.NONE)
+        self.flowbox.set_homogeneous(True)
+
+        scrolled = Gtk.ScrolledWindow()
+        scrolled.add(self.flowbox)
+
+        self.window = Gtk.Window(title="jvncviewer - wall")
+        self.window.set_default_size(columns * (width + 12), 2 * (height + 40))
+        self.window.add(scrolled)
+        self.window.connect("destroy", self.quit)
+        self.window.show_all()
+
+        GLib.timeout_add_seconds(stats_interval, self._update_stats)
+
+    def _update_stats(self):
+        for thumbnail in self.thumbnails:
+            thumbnail.update_label()
+        return True
+
+    def _clicked(self, thumbnail, _event):
+        self.promote(thumbnail)
+        return True
+
+    def _demoted(self, viewer):
+        thumbnail = self._promoted.pop(viewer, None)
+        if thumbnail is None:
+            return
+        logging.debug("Demoting %s", thumbnail.host)
+        viewer.window.destroy()
+        thumbnail.resume()
+
+    def add(self, host, password, bmc=None):
+        """
+        Add a thumbnail and connect it
+        """
+        thumbnail = Thumbnail(host, password, bmc=bmc, width=self.width,
+                              height=self.height, max_fps=self.max_fps)
+        thumbnail.connect("button-press-event", self._clicked)
+        self.thumbnails.append(thumbnail)
+        self.flowbox.add(thumbnail)
+        thumbnail.open()
+        return thumbnail
+
+    def promote(self, thumbnail):
+        """
+        Open a full-quality viewer for a thumbnail's session, the thumbnail
+        session is paused in the meantime
+        """
+        if thumbnail.paused:
+            return
+        logging.debug("Promoting %s", thumbnail.host)
+        thumbnail.pause()
+        viewer = VNCViewer("%s:%s" % (thumbnail.host, thumbnail.port),
+                           thumbnail.password, bmc=thumbnail.bmc,
+                           **self.viewer_args)
+        viewer.on_quit = self._demoted
+        self._promoted[viewer] = thumbnail
+        viewer.connect()
+
+    def stats(self):
+        """
+        Return the update statistics of all sessions
+        """
+        return {t.host: {"updates": t.stats.updates, "pixels": t.stats.pixels,
+                         "bytes": t.stats.bytes}
+                for t in self.thumbnails}
+
+    def quit(self, _src=None):
+        logging.debug("Quitting")
+        for viewer in list(self._promoted):
+            viewer.close()
+        for thumbnail in self.thumbnails:
+            thumbnail.close()
+        task.shutdown()
+        Gtk.main_quit()